@@ -1,20 +1,47 @@
 #supports mutimedia/multi-language
 
 import openai
-import requests
 import json
+import logging
 import re
 import os
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
-from urllib.parse import quote_plus
+from urllib.parse import quote_plus, urlsplit
+
+import http_client
+import metrics
+import timing
+from book_stream import BookArrayParser
+from kcls_parser import find_kcls_match
+from apiSettings import ApiSettings
+from cache import CoalescingCache, SemanticCache
 
 load_dotenv()
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+settings = ApiSettings()
+log = logging.getLogger(f'bookquest.{__name__}')
 
-def create_response(user_msg, max_tokens=500):
-    system_prompt = """
+# Host label of LLM errors in the upstream metrics
+OPENAI_HOST = urlsplit(os.getenv('OPENAI_BASE_URL') or 'https://api.openai.com/v1').hostname
+
+# Fields update_kcls_availability sets on a book
+KCLS_FIELDS = ('title', 'availability', 'link', 'exist')
+
+# Availability per (title, author last name, media type code); concurrent chats share one fetch
+kcls_cache = CoalescingCache(maxsize=settings.kcls_cache_size if settings.upstream_caches else 0,
+                             ttl=settings.kcls_cache_ttl, stale_ttl=settings.kcls_cache_stale_ttl,
+                             refresh_timeout=settings.enrich_stage_timeout)
+
+# LLM book lists by prompt meaning; the backends set its encoder once the embedding model is loaded
+response_cache = SemanticCache(threshold=settings.response_cache_threshold, maxsize=settings.response_cache_size,
+                               ttl=settings.response_cache_ttl)
+
+metrics.watch_cache('kcls', kcls_cache)
+metrics.watch_cache('llm_response', response_cache)
+
+
+SYSTEM_PROMPT = """
         You are an assistant that generates book recommendations based on user input.
         Default to 5 books unless user says otherwise.
         Output a JSON array of books, no extra text.
@@ -25,21 +52,67 @@ def create_response(user_msg, max_tokens=500):
         "media_type" ("book" by default, or "audiobook", "ebook" if specified).
         """
 
+
+def completion_messages(user_msg):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT.strip()},
+        {"role": "user", "content": user_msg}
+    ]
+
+
+def create_response(user_msg, max_tokens=500):
     response = openai.chat.completions.create(
         model="gpt-4.1",
-        messages=[
-            {"role": "system", "content": system_prompt.strip()},
-            {"role": "user", "content": user_msg}
-        ],
+        messages=completion_messages(user_msg),
         max_tokens=max_tokens
     )
 
     return json.loads(response.choices[0].message.content)
 
-def update_kcls_availability(book, timeout=4):
+
+def stream_response(user_msg, max_tokens=500, on_complete=None):
+    """
+    Like create_response, but streams the completion and yields each book as soon as its object is
+    complete. Malformed objects are skipped; if the stream breaks off or the array is truncated the
+    books already yielded stand, but a failure before the first book is raised like create_response's.
+    on_complete gets copies of all books (as parsed, before callers change them) if the completion
+    finished cleanly.
+    """
+    parser = BookArrayParser()
+    books = []
+    finish_reason = None
+    try:
+        stream = openai.chat.completions.create(
+            model="gpt-4.1",
+            messages=completion_messages(user_msg),
+            max_tokens=max_tokens,
+            stream=True,
+            timeout=settings.llm_stream_timeout
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            for book in parser.feed(chunk.choices[0].delta.content or ''):
+                if book.get('title'):
+                    books.append(dict(book))
+                    yield book
+    except openai.OpenAIError as e:
+        metrics.UPSTREAM_ERRORS.inc(host=OPENAI_HOST)
+        log.warning("LLM stream failed after %d books: %s", parser.parsed, e)
+        if not books:
+            raise
+    else:
+        if on_complete and books and finish_reason == 'stop' and not (parser.truncated or parser.errors):
+            on_complete(books)
+    finally:
+        if parser.close() or parser.errors:
+            log.warning("LLM stream: %d books parsed, %d malformed or truncated", parser.parsed, parser.errors)
+
+def kcls_query_parts(book):
+    """(title, author last name, media type code) used for the KCLS query and as its cache key"""
     title = book.get('title', '').lower()
-    subtitle = book.get('subtitle', '').lower()
-    author_lastname = book.get('author', '').strip().split()[-1].lower()
+    author_lastname = (book.get('author', '').strip().split() or [''])[-1].lower()
     media_type = book.get('media_type', '').lower()
 
     media_type_code_key = {"book": "bk",
@@ -48,64 +121,71 @@ def update_kcls_availability(book, timeout=4):
                            }
     
     media_type_code = media_type_code_key.get(media_type, "bk")
+    return title, author_lastname, media_type_code
+
+def build_kcls_url(book):
+    title, author_lastname, media_type_code = kcls_query_parts(book)
 
     # build the raw query and percent-encode it to safely handle special characters
     raw_query = f"(title:({title}) AND contributor:({author_lastname})) formatcode:({media_type_code})"
     query = quote_plus(raw_query, safe='')
-    url = f"https://kcls.bibliocommons.com/v2/search?custom_edit=false&query={query}&searchType=bl&suppress=true"
+    return f"{settings.kcls_url}/v2/search?custom_edit=false&query={query}&searchType=bl&suppress=true"
+
+def update_kcls_availability(book, timeout=4):
+    """Set availability, link, exist (and the KCLS title) on book, served from kcls_cache when fresh"""
+    key = '|'.join(kcls_query_parts(book))
+    with timing.stage('kcls'):
+        result = kcls_cache.get_or_load(key, lambda timeout: fetch_kcls_availability(dict(book), timeout), timeout)
+
+    if result is None:  # KCLS unreachable, keep the search link and assume it exists
+        book['availability'] = False
+        book['link'] = build_kcls_url(book)
+        book['exist'] = True
+        return False, None
+
+    book.update(result)
+
+def fetch_kcls_availability(book, timeout=4):
+    """Scrape the KCLS search page for book; returns the KCLS_FIELDS to set, or None if the fetch failed"""
+    title = book.get('title', '').lower()
+    url = build_kcls_url(book)
     
     book['availability'] = False
     book['link'] = url
     book['exist'] = True
 
-    print(url)
+    log.debug("KCLS lookup url=%s", url)
 
     try:
-        resp = requests.get(url, timeout=timeout)
+        resp = http_client.get(url, timeout=timeout, stream=True)
         resp.raise_for_status()
     except Exception as e:
-        print(f"Error fetching URL: {e}")
-        return False, None
-
-    soup = BeautifulSoup(resp.content, 'lxml')
-    title_lower = title.lower().strip()
+        log.warning("KCLS lookup failed url=%s error=%s", url, e)
+        return None
 
-    info_block = soup.find('li', class_='row cp-search-result-item')
-    
-    # Iterate cp-search-result-item siblings and only check manifestation items inside a matching info block
-    while info_block:
-        title_block = info_block.select_one('.title-content, span.title-content, .cp-title .title-content, h2 .title-content')
-        if title_block and title_block.get_text(strip=True):
-            info_title = title_block.get_text(strip=True).strip()
-            print(info_title, title_lower)
-            if info_title.lower() in title_lower or title_lower in info_title.lower():
-                book['title'] = info_title
-                for manifestation_block in info_block.find_all('div', class_='manifestation-item cp-manifestation-list-item row'):
-                    availability_block = manifestation_block.find('div', class_='manifestation-item-availability-block-wrap')
-                    if availability_block:
-                        status_span = availability_block.find('span', class_='cp-availability-status')
-
-                        if status_span:
-                            status_text = status_span.get_text(strip=True).lower()
-                            is_available = ("available" in status_text) and ("not" not in status_text)
-
-                            if is_available:
-                                book['availability'] = True
-
-                            link_tag = manifestation_block.find('a', class_='manifestation-item-link')
-                            if link_tag and link_tag.has_attr('href'):
-                                full_link = "https://kcls.bibliocommons.com" + link_tag['href']
-                                book['link'] = full_link
-
-                            book['exist'] = True
-                            return
-                # title matched but no manifestation inside this info block matched — continue to next info block
-        # advance to next top-level search result item
-        print("No matching manifestation found in this info block, checking next sibling.", title_lower)
-        info_block = info_block.find_next_sibling('div', class_='cp-search-result-item')
-
-    # If none matched
-    book['exist'] = False
+    # stream the page through the parser and stop reading at the first matching manifestation
+    try:
+        match = find_kcls_match(resp.iter_content(chunk_size=16384), title)
+    except Exception as e:
+        log.warning("KCLS page read failed url=%s error=%s", url, e)
+        return None
+    finally:
+        resp.close()
+
+    return apply_kcls_match(book, match)
+
+def apply_kcls_match(book, match):
+    """Set the KCLS_FIELDS on book from a kcls_parser match (None: KCLS does not carry it) and return them"""
+    if match:
+        book['title'] = match['title']
+        book['availability'] = match['available']
+        if match['link']:
+            book['link'] = match['link']
+        book['exist'] = True
+    else:
+        book['exist'] = False
+
+    return {field: book[field] for field in KCLS_FIELDS}
 
 
 #books = [{'title': 'The Dark Forest', 'subtitle': '', 'author': 'Liu Cixin', 'media_type': 'ebook'}]
@@ -1,12 +1,90 @@
 #old version
+import os
+
+
 class ApiSettings:
     def __init__(self):
         self.initial_fetch_limit = 30  # Get more candidates initially
+        self.shortlist_factor = 1.5     # Candidates (x num_books) kept by the metadata ranking for the description ranking
+        self.description_fetch_budget = 8   # Uncached descriptions fetched per search chat; the rest of the shortlist keeps its metadata description
         self.num_books = 10     # Return top 5 after sorting
         self.popularity_weight = 0.2    # Adjust balance between relevance/popularity (0-1)
         self.min_ratings = 20   # Adjust balance between relevance/popularity (0-1)
         self.min_avg_rating = 3.0   # Adjust balance between relevance/popularity (0-1)
 
+        self.enrich_workers = 8     # Max concurrent KCLS/Open Library lookups per process
+        self.enrich_stage_timeout = 4.0     # Seconds allowed for a single KCLS/OL stage of one book
+        self.enrich_deadline = 8.0  # Seconds allowed for enriching all books of one chat turn (per book when streamed, all within llm_stream_timeout + enrich_deadline)
+        self.llm_streaming = os.getenv('BOOKQUEST_LLM_STREAMING', '1') != '0'   # Start enriching each book as the LLM streams it
+        self.llm_stream_timeout = 30    # Seconds allowed for a streamed LLM completion
+        self.response_cache = os.getenv('BOOKQUEST_RESPONSE_CACHE', '1') != '0'     # Answer near-duplicate prompts with an earlier LLM book list
+        self.response_cache_threshold = 0.9     # Min cosine similarity between prompt embeddings for a hit
+        self.response_cache_size = 2000     # LLM book lists kept in memory
+        self.response_cache_ttl = 6 * 3600  # Seconds a cached book list is reused
+        self.query_routing = os.getenv('BOOKQUEST_QUERY_ROUTING', '1') != '0'   # Answer plain topical queries with testAPI's local search + ranking instead of the LLM
+        self.router_threshold = 0.6     # Min router probability of the local path to take it (query_router.py)
+        self.router_max_terms = 5   # Search terms a plain query may have before length counts against the local path
+
+        self.http_pool_size = 10    # Keep-alive connections kept per host
+        self.http_connect_timeout = 3.05    # Default connect timeout (seconds) for outbound calls
+        self.http_read_timeout = 10     # Default read timeout (seconds) for outbound calls
+        self.http_retries = 2   # Retries for transient 5xx/429 responses and connection errors
+        self.http_backoff_factor = 0.3  # Exponential backoff base (seconds) between retries
+        self.http_backoff_jitter = 0.2  # Max random jitter (seconds) added to each backoff
+        self.http_user_agent = "BookQuest/1.0"
+        self.async_max_connections = 64     # async_backend: concurrent requests (and connections) per upstream host
+        self.openlibrary_url = os.getenv('BOOKQUEST_OPENLIBRARY_URL', 'https://openlibrary.org')   # Base URL for Open Library calls (stubs in load tests)
+        self.kcls_url = os.getenv('BOOKQUEST_KCLS_URL', 'https://kcls.bibliocommons.com')  # Base URL for KCLS search pages (stubs in load tests)
+
+        self.cache_dir = os.getenv('BOOKQUEST_CACHE_DIR', '.cache')    # On-disk caches (SQLite files) live here
+        self.upstream_caches = os.getenv('BOOKQUEST_UPSTREAM_CACHES', '1') != '0'  # Cache Open Library / KCLS results; off, every chat goes upstream (cold load tests)
+        self.openlibrary_source = os.getenv('BOOKQUEST_OPENLIBRARY_SOURCE', 'api')  # 'api' (openlibrary.org) or 'mirror' (local dump mirror, ol_mirror.py)
+        self.openlibrary_mirror_path = os.getenv('BOOKQUEST_OPENLIBRARY_MIRROR', os.path.join(self.cache_dir, 'ol_mirror.sqlite3'))
+        self.description_cache_size = 5000  # Work descriptions kept in memory
+        self.description_cache_ttl = 30 * 24 * 3600     # Descriptions rarely change, keep them for 30 days
+        self.description_negative_ttl = 24 * 3600   # Re-check works without a description once a day
+        self.resolution_cache_size = 5000   # (title, author) -> Open Library doc resolutions kept in memory
+        self.resolution_cache_ttl = 7 * 24 * 3600   # Ratings/covers drift slowly, refresh resolutions weekly
+        self.resolution_negative_ttl = 24 * 3600    # Retry unmatched title/author pairs once a day
+
+        self.kcls_cache_size = 2000     # KCLS availability results kept in memory
+        self.kcls_cache_ttl = 10 * 60   # Seconds a KCLS availability result is served as fresh
+        self.kcls_cache_stale_ttl = 30 * 60     # Further seconds it is served stale while refreshing in the background
+
+        self.session_max_messages = 20  # Messages kept per chat session (plus the system message)
+        self.session_max_sessions = 1000    # Sessions kept in memory before LRU eviction
+        self.session_idle_ttl = 2 * 3600    # Seconds of inactivity before a session is dropped
+        self.session_memory_budget = 16 * 1024 * 1024   # Total characters of message content kept in memory
+        self.session_backend = os.getenv('BOOKQUEST_SESSION_BACKEND', 'memory')     # 'memory' or 'sqlite' (survives restarts)
+        self.return_full_history = True     # /chat returns the whole history; clients can send full_history=false
+
+        self.card_cache_size = 2000     # Rendered book cards kept in memory
+        self.card_cache_ttl = 3600  # Seconds a rendered card is reused
+
+        self.embedding_dir = os.path.join(self.cache_dir, 'embeddings')    # Memory-mapped description embeddings
+        self.embedding_quantize = False     # Store embeddings as int8 with a per-row scale (4x smaller)
+        self.embedding_batch_size = 64  # Descriptions encoded per model.encode batch
+        self.catalog_path = os.getenv('BOOKQUEST_CATALOG', 'catalog.json')  # server.py catalog: JSON list of {key, title, description}
+        self.search_approximate = False     # Use the approximate (IVF) index for /api/search
+        self.hybrid_search = True   # Fuse BM25 with the embedding index over the catalog (server.py, testAPI candidates)
+        self.hybrid_candidates = 200    # Catalog books testAPI adds to the Open Library results per query
+        self.hybrid_depth = 500     # Books taken from each of the BM25 and embedding rankings before fusion
+        self.rrf_k = 60     # Reciprocal rank fusion constant: higher flattens the weight of top ranks
+        self.query_cache_size = 4096    # Query embeddings kept in memory (~1.5 KB each)
+        self.embedding_batching = True  # Merge concurrent query encodes into one batched forward pass
+        self.embedding_max_batch = 32   # Max queries per batched forward pass
+        self.embedding_max_wait_ms = 5  # Max time the first query of a batch waits for others
+        self.embedding_batch_timeout = 2.0  # Seconds a query waits for its batch before encoding on its own
+
+        self.log_level = os.getenv('BOOKQUEST_LOG_LEVEL', 'INFO')   # bookquest.* loggers (logs.py); DEBUG adds a line per upstream lookup
+        self.admin_token = os.getenv('BOOKQUEST_ADMIN_TOKEN')   # Enables /admin/profiles (X-Admin-Token) and X-Profile: <token> (profiling.py)
+        self.profile_sample_rate = float(os.getenv('BOOKQUEST_PROFILE_SAMPLE_RATE', '0'))  # Fraction of /chat, /chat/stream and /api/search requests profiled
+        self.profile_interval_ms = 5    # Stack sampling interval of a profiled request
+        self.profile_dir = os.path.join(self.cache_dir, 'profiles')    # Collapsed-stack profiles (flame graph input)
+        self.profile_keep = 200     # Newest profiles kept on disk
+        self.lazy_startup = os.getenv('BOOKQUEST_LAZY_STARTUP', '1') != '0'    # Load models in the background; /readyz says when done
+        self.ready_timeout = 30     # Seconds a request waits for startup to finish before a 503
+
         self.STOP_WORDS = [
             "a", "about", "above", "after", "again", "against", "all", "am", "an", "and", "any", "are", "aren't", "as", "at",
             "be", "because", "been", "before", "being", "below", "between", "both", "but", "by", "can", "can't", "cannot",
@@ -50,6 +128,11 @@ class ApiSettings:
 
         self.NUM_RESULTS_WORDS = ["results", "recommendations", "show", "recommend"]
 
+        # Readership words; the LLM response cache only reuses a list for the same ones
+        self.AUDIENCE_WORDS = ["kids", "kid", "children", "childrens", "child", "toddlers", "toddler", "baby", "babies",
+                               "teen", "teens", "teenagers", "teenager", "ya", "young", "adult", "adults", "grownups",
+                               "beginner", "beginners", "boys", "girls", "men", "women"]
+
         self.YEAR_FILTER_WORDS = {
             "old": (1800, 0.2),
             "classic": (1900, 0.2),
@@ -0,0 +1,419 @@
+"""
+Asyncio variant of the backend_response /chat pipeline, for serving many chats per process.
+Runs on Quart (ASGI). The LLM call (AsyncOpenAI), KCLS availability scrapes, Open Library searches
+and description fetches are coroutines, run concurrently per book with per-call timeouts, so an
+in-flight chat costs a task instead of a worker thread.
+Each upstream host gets its own httpx.AsyncClient behind a semaphore of the same size, so requests
+over the limit wait on the semaphore instead of in httpx's pool, whose scheduling is quadratic in
+the number of queued requests. Streamed completions are read as raw server-sent events, which
+skips building an SDK model object per token.
+Prompting, card formatting, session history (chat_pipeline), the Open Library caches and the LLM
+response cache are shared with the synchronous backend, without importing its app.
+
+    hypercorn async_backend:app --bind 127.0.0.1:5001
+"""
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import httpx
+import openai
+from quart import Quart, request, jsonify
+
+import aiTest
+import logs
+import metrics
+import openlibrary
+import timing
+from apiSettings import ApiSettings
+from book_stream import BookArrayParser
+from cache import MISSING, AsyncCoalescingCache
+from chat_pipeline import (apply_ol_doc, build_prompt, fallback_book, format_books_info, load_prompt_encoder,
+                           messages_store, prompt_cache_key, session_id_of, stage_timeout,
+                           wants_full_history)
+from kcls_parser import KclsMatcher
+from startup import Startup
+
+settings = ApiSettings()
+logs.configure(settings.log_level)
+log = logging.getLogger(f'bookquest.{__name__}')
+
+app = Quart(__name__)
+timing.register(app)
+metrics.register(app)
+
+startup = Startup('async_backend')
+
+
+def initialize():
+    """Load the embedding model for aiTest.response_cache; until then every prompt goes to the LLM"""
+    aiTest.response_cache.encoder = load_prompt_encoder(startup)
+
+
+if settings.response_cache:
+    startup.start(initialize, lazy=settings.lazy_startup)
+
+# Availability per (title, author last name, media type code); concurrent chats share one fetch
+kcls_cache = AsyncCoalescingCache(maxsize=settings.kcls_cache_size if settings.upstream_caches else 0,
+                                  ttl=settings.kcls_cache_ttl, stale_ttl=settings.kcls_cache_stale_ttl,
+                                  refresh_timeout=settings.enrich_stage_timeout)
+metrics.watch_cache('kcls_async', kcls_cache)
+
+# Created on the serving event loop: 'openlibrary' and 'kcls' as (httpx.AsyncClient, asyncio.Semaphore),
+# 'openai' as openai.AsyncOpenAI
+clients = {}
+
+# Failed upstream calls: timeouts, transport and HTTP status errors, and bodies that are not JSON
+UPSTREAM_FAILURES = (httpx.HTTPError, json.JSONDecodeError, asyncio.TimeoutError)
+
+# Host label of each upstream in the metrics
+HOSTS = {'openlibrary': urlsplit(settings.openlibrary_url).hostname, 'kcls': urlsplit(settings.kcls_url).hostname}
+
+
+def build_client(limit):
+    client = httpx.AsyncClient(
+        timeout=httpx.Timeout(settings.http_read_timeout, connect=settings.http_connect_timeout),
+        limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+        headers={'User-Agent': settings.http_user_agent},
+        transport=httpx.AsyncHTTPTransport(retries=settings.http_retries),  # connection errors only
+    )
+    return client, asyncio.Semaphore(limit)
+
+
+@app.before_serving
+async def open_clients():
+    clients['openlibrary'] = build_client(settings.async_max_connections)
+    clients['kcls'] = build_client(settings.async_max_connections)
+    clients['openai'] = openai.AsyncOpenAI(api_key=openai.api_key, timeout=settings.llm_stream_timeout)
+
+
+@app.after_serving
+async def close_clients():
+    await clients.pop('openlibrary')[0].aclose()
+    await clients.pop('kcls')[0].aclose()
+    await clients.pop('openai').close()
+
+
+@asynccontextmanager
+async def upstream(name):
+    """The httpx client for upstream name, holding one of its connection slots; the time the
+    request holds it (and whether it raised) goes to the upstream metrics"""
+    client, slots = clients[name]
+    async with slots:
+        start = time.perf_counter()
+        try:
+            yield client
+        except Exception:
+            metrics.UPSTREAM_ERRORS.inc(host=HOSTS[name])
+            raise
+        finally:
+            metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - start, host=HOSTS[name])
+
+
+@app.after_request
+async def allow_cors(response):
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    return response
+
+
+async def create_response(user_msg, max_tokens=500):
+    response = await clients['openai'].chat.completions.create(
+        model="gpt-4.1",
+        messages=aiTest.completion_messages(user_msg),
+        max_tokens=max_tokens
+    )
+    return json.loads(response.choices[0].message.content)
+
+
+async def stream_response(user_msg, max_tokens=500, on_complete=None):
+    """aiTest.stream_response as an async generator (a failure before the first book is raised);
+    on_complete runs in a worker thread"""
+    parser = BookArrayParser()
+    books = []
+    finish_reason = None
+    try:
+        async with clients['openai'].chat.completions.with_streaming_response.create(
+            model="gpt-4.1",
+            messages=aiTest.completion_messages(user_msg),
+            max_tokens=max_tokens,
+            stream=True
+        ) as response:
+            async for line in response.iter_lines():
+                if not line.startswith('data:') or line == 'data: [DONE]':
+                    continue
+                choices = json.loads(line[len('data:'):]).get('choices')
+                if not choices:
+                    continue
+                finish_reason = choices[0].get('finish_reason') or finish_reason
+                for book in parser.feed(choices[0].get('delta', {}).get('content') or ''):
+                    if book.get('title'):
+                        books.append(dict(book))
+                        yield book
+    except (openai.OpenAIError, httpx.HTTPError, json.JSONDecodeError) as e:
+        metrics.UPSTREAM_ERRORS.inc(host=aiTest.OPENAI_HOST)
+        log.warning("LLM stream failed after %d books: %s", parser.parsed, e)
+        if not books:
+            raise
+    else:
+        if on_complete and books and finish_reason == 'stop' and not (parser.truncated or parser.errors):
+            await asyncio.to_thread(on_complete, books)
+    finally:
+        if parser.close() or parser.errors:
+            log.warning("LLM stream: %d books parsed, %d malformed or truncated", parser.parsed, parser.errors)
+
+
+async def update_kcls_availability(book, timeout=4):
+    """aiTest.update_kcls_availability: set availability, link, exist (and the KCLS title) on book"""
+    key = '|'.join(aiTest.kcls_query_parts(book))
+    with timing.stage('kcls'):
+        result = await kcls_cache.get_or_load(key, lambda timeout: fetch_kcls_availability(dict(book), timeout), timeout)
+
+    if result is None:  # KCLS unreachable, keep the search link and assume it exists
+        book['availability'] = False
+        book['link'] = aiTest.build_kcls_url(book)
+        book['exist'] = True
+        return
+
+    book.update(result)
+
+
+async def fetch_kcls_availability(book, timeout=4):
+    """Stream the KCLS search page for book through KclsMatcher; the KCLS_FIELDS, or None if the fetch failed"""
+    url = aiTest.build_kcls_url(book)
+    book['availability'] = False
+    book['link'] = url
+    book['exist'] = True
+
+    async def scrape():
+        matcher = KclsMatcher(book.get('title', ''))
+        async with upstream('kcls') as client, client.stream('GET', url, timeout=timeout) as response:
+            response.raise_for_status()
+            # stop reading at the first matching manifestation
+            async for chunk in response.aiter_bytes(16384):
+                match = matcher.feed(chunk)
+                if match:
+                    return match
+        return matcher.close()
+
+    try:
+        match = await asyncio.wait_for(scrape(), timeout)
+    except UPSTREAM_FAILURES as e:
+        log.warning("KCLS lookup failed url=%s error=%r", url, e)
+        return None
+    return aiTest.apply_kcls_match(book, match)
+
+
+async def search_docs(params, timeout):
+    if openlibrary.mirror is not None:
+        return await asyncio.to_thread(openlibrary.search_docs, params)
+    with timing.stage('openlibrary_search'):
+        async with upstream('openlibrary') as client:
+            response = await client.get(openlibrary.search_url(params), timeout=timeout)
+            response.raise_for_status()
+    return response.json().get('docs', [])
+
+
+# openlibrary's resolution and description caches read and write SQLite: they are used off the event loop
+async def resolve_openlibrary_docs(pairs, timeout):
+    """openlibrary.resolve_openlibrary_docs: all cache misses in one OR'ed search.json query"""
+    resolved, misses = await asyncio.to_thread(openlibrary.cached_resolutions, pairs)
+    if not misses:
+        return resolved
+    try:
+        docs = await asyncio.wait_for(search_docs(openlibrary.resolution_params(misses), timeout), timeout)
+    except UPSTREAM_FAILURES:
+        return resolved
+    return await asyncio.to_thread(openlibrary.store_resolutions, misses, docs, resolved)
+
+
+async def get_openlibrary_doc(title, author, timeout):
+    key = openlibrary.resolution_key(title, author)
+    doc = await asyncio.to_thread(openlibrary.resolution_cache.get, key)
+    if doc is MISSING:
+        try:
+            docs = await asyncio.wait_for(search_docs(openlibrary.doc_params(title, author), timeout), timeout)
+        except UPSTREAM_FAILURES:
+            return settings.default_doc
+        doc = await asyncio.to_thread(openlibrary.store_resolution, key, title, author, docs)
+    return doc or settings.default_doc
+
+
+async def fetch_book_description(work_key, timeout):
+    if not work_key:
+        return ''
+
+    description = await asyncio.to_thread(openlibrary.description_cache.get, work_key)
+    if description is not MISSING:
+        return description
+
+    if openlibrary.mirror is not None:
+        description = await asyncio.to_thread(openlibrary.mirror.description, work_key)
+        return await asyncio.to_thread(openlibrary.store_description, work_key, description)
+
+    async def download():
+        async with upstream('openlibrary') as client:
+            return await client.get(openlibrary.work_url(work_key), timeout=timeout)
+
+    try:
+        with timing.stage('description'):
+            response = await asyncio.wait_for(download(), timeout)
+        if response.status_code == 404:
+            description = ''
+        else:
+            response.raise_for_status()
+            description = openlibrary.parse_description(response.json())
+    except UPSTREAM_FAILURES:
+        return ''   # transient failure, try again next time
+    return await asyncio.to_thread(openlibrary.store_description, work_key, description)
+
+
+class TurnResolution:
+    """backend_response.TurnResolution on the event loop: a lookup of a book not sent yet sends every
+    book not sent yet as one resolve_openlibrary_docs task"""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._pending = {}  # resolution key -> (title, author) not sent yet
+        self._batches = {}  # resolution key -> task of the batch it was sent in
+
+    def add(self, title, author):
+        key = openlibrary.resolution_key(title, author)
+        if key not in self._batches:
+            self._pending[key] = (title, author)
+
+    def flush(self):
+        if not self._pending:
+            return
+        task = asyncio.ensure_future(resolve_openlibrary_docs(list(self._pending.values()), self.timeout))
+        for key in self._pending:
+            self._batches[key] = task
+        self._pending = {}
+
+    async def get(self, title, author, timeout):
+        """The doc, None (no match) or MISSING (not resolved: not added, batch failed or timed out, or missed)"""
+        key = openlibrary.resolution_key(title, author)
+        if key in self._pending:
+            self.flush()
+        task = self._batches.get(key)
+        if task is None:
+            return MISSING
+        try:
+            docs = await asyncio.wait_for(asyncio.shield(task), timeout)
+        except Exception:
+            return MISSING
+        return docs.get(key, MISSING)
+
+
+async def lookup_ol_doc(book, requested_title, resolved, deadline):
+    """backend_response.lookup_ol_doc; resolved is the turn's TurnResolution (or None)"""
+    ol_doc = await resolved.get(requested_title, book['author'], stage_timeout(deadline)) if resolved else MISSING
+    if ol_doc is None and openlibrary.normalize(book['title']) == openlibrary.normalize(requested_title):
+        return settings.default_doc
+    if ol_doc is MISSING or ol_doc is None:
+        ol_doc = await get_openlibrary_doc(book['title'], book['author'], stage_timeout(deadline))
+    return ol_doc
+
+
+async def enrich_book(book, resolved, deadline):
+    book = dict(book)
+    requested_title = book['title']
+    await update_kcls_availability(book, timeout=stage_timeout(deadline))
+    if not book.get('exist', True):
+        return book
+
+    ol_doc = await lookup_ol_doc(book, requested_title, resolved, deadline)
+
+    description = ''
+    if ol_doc.get('key') and time.monotonic() < deadline:
+        description = await fetch_book_description(ol_doc['key'], stage_timeout(deadline))
+
+    apply_ol_doc(book, ol_doc, description)
+    return book
+
+
+async def enrich_within_deadline(book, resolved=None, turn_deadline=None):
+    """enrich_book limited to settings.enrich_deadline from now (and to turn_deadline); default values
+    when it misses it"""
+    deadline = time.monotonic() + settings.enrich_deadline
+    if turn_deadline is not None:
+        deadline = min(deadline, turn_deadline)
+    try:
+        return await asyncio.wait_for(enrich_book(book, resolved, deadline), max(0, deadline - time.monotonic()))
+    except Exception:
+        return fallback_book(book)
+
+
+async def generate_and_enrich(messages):
+    """(books from the LLM for the latest turn of messages, their enriched cards in the same order); each
+    streamed book is enriched as it arrives. Near-duplicate prompts are answered from aiTest.response_cache."""
+    text, context = prompt_cache_key(messages)
+    cached = MISSING
+    if settings.response_cache:
+        # the prompt embedding runs on the model, off the event loop
+        cached = await asyncio.to_thread(aiTest.response_cache.get, text, context)
+
+    def remember(books):
+        if settings.response_cache:
+            aiTest.response_cache.set(text, books, context)
+
+    if cached is not MISSING:
+        generated = [dict(book) for book in cached]
+    elif settings.llm_streaming:
+        # the whole turn gets llm_stream_timeout + enrich_deadline; a stream still running then is abandoned
+        turn_deadline = time.monotonic() + settings.llm_stream_timeout + settings.enrich_deadline
+        resolved = TurnResolution(settings.enrich_stage_timeout)
+        generated, tasks = [], []
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(turn_deadline - time.monotonic()):
+                async for book in stream_response(build_prompt(messages), on_complete=remember):
+                    generated.append(book)
+                    resolved.add(book['title'], book['author'])
+                    tasks.append(asyncio.ensure_future(enrich_within_deadline(book, resolved, turn_deadline)))
+        except TimeoutError:
+            log.warning("turn deadline reached with the LLM still streaming, %d books out", len(tasks))
+        timing.record('llm', time.perf_counter() - start)
+        return generated, await asyncio.gather(*tasks)
+    else:
+        with timing.stage('llm'):
+            generated = await create_response(build_prompt(messages))
+        await asyncio.to_thread(remember, [dict(book) for book in generated])
+
+    resolved = TurnResolution(settings.enrich_stage_timeout)
+    for book in generated:
+        resolved.add(book['title'], book['author'])
+    resolved.flush()
+    tasks = [asyncio.ensure_future(enrich_within_deadline(book, resolved)) for book in generated]
+    return generated, await asyncio.gather(*tasks)
+
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    data = await request.get_json()
+    session_id = session_id_of(data)
+    message = data.get('message', '')
+    full_history = wants_full_history(data)
+
+    user_msg = {"role": "user", "content": message}
+    # the SQLite session backend reads and writes disk, off the event loop
+    messages = await asyncio.to_thread(messages_store.append, session_id, user_msg)
+
+    with timing.stage('llm_enrich'):
+        generated, books = await generate_and_enrich(messages)
+    books = [book for book in books if book.get('exist', True)]
+
+    assistant_msg = {"role": "assistant", "content": json.dumps(generated)}
+    messages = await asyncio.to_thread(messages_store.append, session_id, assistant_msg)
+
+    with timing.stage('render'):
+        response_message = f"<br>{format_books_info(books)}"
+    return jsonify({"message": response_message, "session_id": session_id,
+                    "messages": messages if full_history else [user_msg, assistant_msg]})
+
+
+if __name__ == "__main__":
+    app.run(port=5001, debug=True)
@@ -1,212 +1,472 @@
 #backend output- verion 1
 
-from flask import Flask, request, jsonify
+# Started before the other imports so the timing report covers them
+from startup import Startup
+
+startup = Startup('backend_response')
+
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import requests
+import openai
 import urllib.parse
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
 from apiSettings import ApiSettings
 import random
-import re
 
 
 import aiTest
+import logs
+import metrics
+import profiling
+import openlibrary
+import timing
+from openlibrary import fetch_book_description, get_openlibrary_doc
+from cache import MISSING
+from chat_pipeline import (apply_ol_doc, build_prompt, fallback_book, format_books_info, load_prompt_encoder,
+                           messages_store, prompt_cache_key, query_parser, session_id_of,
+                           stage_timeout, wants_full_history)
+from query_router import LOCAL, QueryRouter
 import json
 
 settings = ApiSettings()
+logs.configure(settings.log_level)
+log = logging.getLogger(f'bookquest.{__name__}')
+
+if settings.query_routing:
+    import testAPI  # the local search + ranking path; starts loading its model and catalog
 
 app = Flask(__name__)
 CORS(app)
+timing.register(app)
+metrics.register(app)
+profiling.register(app, settings, ('/chat', '/chat/stream'))
 
-# In-memory messages store: { session_id: [ {role, content}, ... ] }
-messages_store = {}
-
-def get_openlibrary_doc(title, author):
-
-    try:
-        # Define all fields to match Exhibit A and more
-        fields = (
-            "key,title,author_name,first_publish_year,number_of_pages_median,"
-            "ratings_average,ratings_count,cover_i"
-        )
-        # Construct URL with exact title and author
-        url = (
-            f"https://openlibrary.org/search.json?"
-            f"title={urllib.parse.quote(title)}&author={urllib.parse.quote(author)}"
-            f"&fields={fields}&limit=10"
-        )
-        # print(f"Request URL: {url}")  # Debug
-        
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        
-        total_found = data.get('numFound', 0)
-        if total_found == 0:
-            return settings.default_doc
-        
-        # Find the first doc with exact title and author match
-        for doc in data.get('docs', []):
-            if not doc.get('title'):
-                continue
-            if (doc.get('title').lower() == title.lower() and
-                any(author.lower() in a.lower() for a in doc.get('author_name', []))):
-                # print(f"Matched doc: {doc}")  # Debug
-                return doc
-        return settings.default_doc
-    
-    except requests.RequestException as e:
-        return f'Error fetching data: {str(e)}'
-    except Exception as e:
-        return f'Error parsing data: {str(e)}'
-
-
-def fetch_book_description(work_key):
-    try:
-        open_library_url = f"https://openlibrary.org{work_key}.json"
-        response = requests.get(open_library_url)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get('description', {}).get('value', '') if isinstance(data.get('description'), dict) else data.get('description', '')
-        return ''
-    except:
-        return ''
-    
-def generate_description(doc):
-    """Generate fallback description"""
-    desc = f"{doc.get('title')}. "
-    if doc.get('author_name'):
-        desc += f"Written by {', '.join(doc['author_name'])}. "
-    if doc.get('subject'):
-        desc += f"Subjects: {', '.join(doc['subject'][:5])}."
-    return desc
+# Shared worker pool for per-book KCLS/Open Library enrichment
+enrich_pool = ThreadPoolExecutor(max_workers=settings.enrich_workers, thread_name_prefix='enrich')
+
+# Decides per message between testAPI's local path and the LLM
+query_router = QueryRouter.from_settings(settings)
+
+
+def initialize():
+    """Load the embedding model for aiTest.response_cache; until then every prompt goes to the LLM"""
+    if settings.query_routing:
+        # testAPI already loads the model for the local path, share its query embeddings
+        with startup.phase('model_load'):
+            while not testAPI.startup.wait_ready(1):
+                if testAPI.startup.error:
+                    raise RuntimeError(testAPI.startup.error)
+        aiTest.response_cache.encoder = testAPI.query_embeddings.encode
+        return
+
+    aiTest.response_cache.encoder = load_prompt_encoder(startup)
+
+
+if settings.response_cache:
+    startup.mark('module_import')
+    startup.start(initialize, lazy=settings.lazy_startup)
 
 def generate_link(book, language):
     title = book['title']
     return f"<a href='https://kcls.bibliocommons.com/v2/search?query={urllib.parse.quote(title + ' ' + book['author'] + ' ' + (language.capitalize() if language != 'english' else ''))}&searchType=smart' target='_blank'>Search in KCLS</a>"
 
 
+def language_phrase(language):
+    if language != "english":
+        return f", available in {language.capitalize()}."
+    return "."
+
+
 def format_message(books, topics, language):
     if not books:
         return "Sorry, no books were found matching your query."
 
-    
-    lang_phrase = "."
-    if language != "english":
-        lang_phrase = f", available in {language.capitalize()}."
-    
     responses = [f"Try these {len(books)} books for your next read",
                  f"{len(books)} results found",
                  f"You may enjoy these {len(books)} books",
                  f"I recommend these {len(books)} books for you"
                  ]
-    return random.choice(responses) + lang_phrase
+    return random.choice(responses) + language_phrase(language)
+
+
+def format_stream_intro(language):
+    """The intro a streamed LLM answer starts with, before it is known how many cards will follow"""
+    return "Here are some books for your next read" + language_phrase(language)
+
+class TurnResolution:
+    """
+    Open Library resolutions of one chat turn's books, fetched in batches of one OR'ed search.json
+    query (openlibrary.resolve_openlibrary_docs). flush() sends every book added so far from the
+    pool; a lookup of a book not sent yet sends it, with the others not sent yet, from its own thread.
+    Streamed books are added as they arrive, so the ones that arrived while the first were at KCLS
+    share its query.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pending = {}  # resolution key -> (title, author) not sent yet
+        self._batches = {}  # resolution key -> Future of the batch it was sent in
+
+    def add(self, title, author):
+        key = openlibrary.resolution_key(title, author)
+        with self._lock:
+            if key not in self._batches:
+                self._pending[key] = (title, author)
+
+    def _take(self):
+        """The pending pairs and the Future their batch will set (caller holds the lock)"""
+        pairs, future = list(self._pending.values()), Future()
+        for key in self._pending:
+            self._batches[key] = future
+        self._pending = {}
+        return pairs, future
+
+    def _send(self, pairs, future):
+        try:
+            future.set_result(openlibrary.resolve_openlibrary_docs(pairs, timeout=self.timeout))
+        except Exception as e:
+            future.set_exception(e)
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            batch = self._take()
+        enrich_pool.submit(timing.bind(self._send), *batch)
+
+    def get(self, title, author, timeout):
+        """The doc, None (no match) or MISSING (not resolved: not added, batch failed or timed out, or missed)"""
+        key = openlibrary.resolution_key(title, author)
+        with self._lock:
+            batch = self._take() if key in self._pending else None
+            future = self._batches.get(key)
+        if batch:
+            self._send(*batch)
+        if future is None:
+            return MISSING
+        try:
+            return future.result(timeout=timeout).get(key, MISSING)
+        except Exception:
+            return MISSING
+
+
+def lookup_ol_doc(book, requested_title, resolved, deadline):
+    """Open Library doc for book, taken from the turn's batched resolution (a TurnResolution) when possible.
+    Falls back to a single search if there was no batch, it failed or did not match the book (a batch
+    miss is not cached), or KCLS renamed an unmatched book."""
+    ol_doc = resolved.get(requested_title, book['author'], stage_timeout(deadline)) if resolved else MISSING
+    if ol_doc is None and openlibrary.normalize(book['title']) == openlibrary.normalize(requested_title):
+        return settings.default_doc
+    if ol_doc is MISSING or ol_doc is None:
+        ol_doc = get_openlibrary_doc(book['title'], book['author'], timeout=stage_timeout(deadline))
+    if not isinstance(ol_doc, dict):  # error message from get_openlibrary_doc
+        ol_doc = settings.default_doc
+    return ol_doc
+
+
+def enrich_book(book, resolved, deadline):
+    """Run the KCLS, Open Library search and description stages for one book.
+    Works on a copy so a lookup that finishes after the deadline cannot touch the response."""
+    book = dict(book)
+    requested_title = book['title']
+    aiTest.update_kcls_availability(book, timeout=stage_timeout(deadline))
+    if not book.get('exist', True):
+        return book
+
+    ol_doc = lookup_ol_doc(book, requested_title, resolved, deadline)
+
+    description = ''
+    if ol_doc.get('key') and time.monotonic() < deadline:
+        description = fetch_book_description(ol_doc['key'], timeout=stage_timeout(deadline))
+
+    apply_ol_doc(book, ol_doc, description)
+    return book
+
+
+def iter_enriched_books(books):
+    """
+    Enrich books concurrently, yielding (index, book) as each one finishes.
+    books is a list, or an iterator yielding them as the LLM streams them (aiTest.stream_response);
+    each book is submitted as soon as it arrives and gets settings.enrich_deadline from then on, but
+    the whole turn gets no more than settings.llm_stream_timeout + enrich_deadline: after that, the
+    stream is abandoned and the books still out are yielded with default values, like any book that
+    misses its deadline. An error from the stream before its first book is raised.
+    """
+    # lookups log and time under this request
+    enrich = timing.bind(enrich_book)
+    streamed = not isinstance(books, list)
+    turn_deadline = time.monotonic() + settings.enrich_deadline + (settings.llm_stream_timeout if streamed else 0)
+    resolved = TurnResolution(settings.enrich_stage_timeout)
+    if not streamed:
+        # Resolve all title/author pairs up front (one search.json call for the cache misses)
+        for book in books:
+            resolved.add(book['title'], book['author'])
+        resolved.flush()
+
+    events = queue.Queue()
+    abandoned = threading.Event()
+
+    def feed():
+        try:
+            for i, book in enumerate(books):
+                if abandoned.is_set():
+                    break
+                resolved.add(book['title'], book['author'])
+                deadline = min(time.monotonic() + settings.enrich_deadline, turn_deadline)
+                future = enrich_pool.submit(enrich, book, resolved, deadline)
+                events.put(('book', i, book, future, deadline))
+                future.add_done_callback(lambda f, i=i: events.put(('done', i)))
+        except Exception as e:
+            events.put(('error', e))
+        finally:
+            events.put(('end',))
+
+    threading.Thread(target=feed, name='enrich-feed', daemon=True).start()
+
+    pending = {}    # index -> (book, future, deadline)
+    fed = False
+    error = None
+    while not fed or pending:
+        timeout = max(0, turn_deadline - time.monotonic()) if not fed else None
+        if pending:
+            timeout = max(0, min(deadline for _, _, deadline in pending.values()) - time.monotonic())
+        try:
+            event = events.get(timeout=timeout)
+        except queue.Empty:
+            now = time.monotonic()
+            if not fed and turn_deadline <= now:
+                log.warning("turn deadline reached with the LLM still streaming, %d books out", len(pending))
+                abandoned.set()
+                fed = True
+            for i in sorted(pending):
+                book, future, deadline = pending[i]
+                if deadline <= now:
+                    del pending[i]
+                    future.cancel()
+                    yield i, fallback_book(book)
+            continue
+
+        if event[0] == 'book':
+            _, i, book, future, deadline = event
+            if abandoned.is_set():
+                future.cancel()
+            else:
+                pending[i] = (book, future, deadline)
+        elif event[0] == 'done' and event[1] in pending:
+            book, future, _ = pending.pop(event[1])
+            yield event[1], future.result() if future.exception() is None else fallback_book(book)
+        elif event[0] == 'error':
+            error = event[1]
+        elif event[0] == 'end':
+            fed = True
+    if error is not None:
+        raise error
+
+
+def enrich_books(books):
+    """Enrich all books (a list or a stream) concurrently, keeping their original order.
+    Books KCLS does not carry are dropped, books that miss the deadline fall back to defaults."""
+    enriched = sorted(iter_enriched_books(books), key=lambda item: item[0])
+    return [book for _, book in enriched if book.get('exist', True)]
+
+
+def local_card(book, deadline):
+    """Book card for a book from the local path: it already has its Open Library fields, only KCLS is left"""
+    book = dict(book, media_type='book')
+    aiTest.update_kcls_availability(book, timeout=stage_timeout(deadline))
+    return book
+
+
+def recommend_locally(message):
+    """
+    Book cards for message from testAPI's local path (search, catalog candidates, semantic ranking)
+    with KCLS availability, or None while that path is still starting up or when it finds nothing
+    """
+    if not testAPI.startup.ready.is_set() or testAPI.startup.error:
+        return None
+    books, _ = testAPI.recommend_books(message)
+    if not books:
+        return None
+
+    deadline = time.monotonic() + settings.enrich_deadline
+    enrich = timing.bind(local_card)
+    futures = [enrich_pool.submit(enrich, book, deadline) for book in books]
+    cards = []
+    for book, future in zip(books, futures):
+        try:
+            cards.append(future.result(timeout=max(0, deadline - time.monotonic())))
+        except Exception:
+            future.cancel()
+            card = dict(book, media_type='book', availability=False, exist=True)
+            card['link'] = aiTest.build_kcls_url(card)
+            cards.append(card)
+    return [card for card in cards if card.get('exist', True)]
+
+
+def answer_locally(messages):
+    """
+    Book cards for the latest turn of messages from the local path when the router sends it there
+    (and that path finds books), else None for the LLM to answer. Follow-ups to an earlier answer
+    always go to the LLM, which sees the previous turn.
+    """
+    if not settings.query_routing:
+        return None
+    message = messages[-1].get('content', '')
+    with timing.stage('route'):
+        decision = query_router.route(message, follow_up=any(m.get('role') == 'assistant' for m in messages[:-1]))
+    log.info("route=%s confidence=%.2f latency_ms=%.3f reasons=%s", decision.route, decision.confidence,
+             decision.latency_ms, ','.join(decision.reasons) or '-')
+    if decision.route != LOCAL:
+        return None
+
+    with timing.stage('local'):
+        books = recommend_locally(message)
+    if books is None:
+        log.info("local path found no books, falling back to the LLM")
+    return books
+
+
+def local_history(books):
+    """What the session history keeps of a local answer: the same fields the LLM returns"""
+    return [{'title': book['title'], 'author': book['author'], 'media_type': book['media_type']} for book in books]
+
+
+def generate_books(messages, generated):
+    """
+    Books from the LLM for the latest turn of messages: a stream that yields each book as it is
+    parsed when settings.llm_streaming is on, else the complete list. Either way every book also
+    lands in generated.
+    A near-duplicate of an earlier prompt gets that prompt's books without calling the LLM.
+    """
+    text, context = prompt_cache_key(messages)
+    with timing.stage('response_cache'):
+        cached = aiTest.response_cache.get(text, context) if settings.response_cache else MISSING
+    if cached is not MISSING:
+        generated.extend(dict(book) for book in cached)
+        return list(generated)
+
+    def remember(books):
+        if settings.response_cache:
+            aiTest.response_cache.set(text, books, context)
+
+    prompt = build_prompt(messages)
+    if not settings.llm_streaming:
+        with timing.stage('llm'):
+            books = aiTest.create_response(prompt)
+        remember([dict(book) for book in books])
+        generated.extend(books)
+        return list(generated)
+
+    # the stream is consumed on the enrichment feed thread, which records into this request's stages
+    stages = timing.current()
+
+    def stream():
+        start = time.perf_counter()
+        try:
+            for book in aiTest.stream_response(prompt, on_complete=remember):
+                generated.append(book)
+                yield book
+        finally:
+            timing.record('llm', time.perf_counter() - start, stages)
+    return stream()
 
-def format_rating(average, count):
-    if average == 'Not rated':
-        return "Not rated"
-    
-    rating = float(average)
-    full_stars = round(rating)  # Recommended: rounding for fairness
-    empty_stars = 5 - full_stars
-    
-    return (
-        f"{'★' * full_stars}{'☆' * empty_stars} "
-        f"{rating:.1f}/5 ({int(count):,} ratings)"
-    )
-
-def get_availability_text(availability):
-    if availability:
-        return "Available"
-    return "All copies in use"
-
-
-def format_books_info(books, template_path='book_template.html'):
-    with open(template_path, 'r', encoding='utf-8') as f:
-        book_template = f.read()
-
-    book_info = ""
-
-    for book in books:
-        cover_img = ""
-        if book['cover_id']:
-            cover_img = f"<img src='https://covers.openlibrary.org/b/id/{book['cover_id']}-M.jpg' class='book-cover'>"
-
-        rating = format_rating(book['ratings_average'], book['ratings_count'])
-        availability_text = get_availability_text(book['availability'])
-
-        book_info += book_template.format(
-            cover_img=cover_img,
-            title=book['title'],
-            author=book['author'],
-            year=book['year'],
-            rating=rating,
-            description=book['description'],
-            link=book['link'],
-            media_type = book['media_type'],
-            availability = str(book['availability']),
-            availability_text=availability_text
-        )
-
-    return book_info
 
 @app.route('/chat', methods=['POST'])
 def chat():
     data = request.get_json()
     # support session-based history
-    session_id = data.get('session_id', 'default')
+    session_id = session_id_of(data)
     message = data.get('message', '')
+    full_history = wants_full_history(data)
     
-    # initialize messages for session if missing
-    messages = messages_store.get(session_id, [{"role": "system", "content": "You are an assistant that helps find books."}])
-    # append user message to history
-    messages.append({"role": "user", "content": message})
-
-    # Call the model but only send the last two turns to limit tokens
-    system_msg = messages[0] if messages and messages[0].get('role') == 'system' else None
-    last_two = messages[-2:]
-    send_parts = []
-    if system_msg:
-        send_parts.append(f"SYSTEM: {system_msg.get('content','')}")
-    for m in last_two:
-        role = m.get('role', 'user').upper()
-        send_parts.append(f"{role}: {m.get('content','')}")
-    composite_prompt = "\n".join(send_parts)
-
-    # aiTest.create_response expects a single string prompt
-    books = aiTest.create_response(composite_prompt)
+    # append user message to the session history (created with the system message if missing)
+    user_msg = {"role": "user", "content": message}
+    messages = messages_store.append(session_id, user_msg)
+
+    # Plain topical queries are answered by the local search + ranking path
+    books = answer_locally(messages)
+    if books is not None:
+        generated = local_history(books)
+    else:
+        # Call the model but only send the last two turns to limit tokens
+        # books are enriched as the model streams them
+        generated = []
+        with timing.stage('llm_enrich'):
+            books = enrich_books(generate_books(messages, generated))
+
     # store assistant reply in session history (store the JSON string)
-    assistant_text = json.dumps(books)
-    messages.append({"role": "assistant", "content": assistant_text})
-    messages_store[session_id] = messages
-    print(books)
+    assistant_text = json.dumps(generated)
+    assistant_msg = {"role": "assistant", "content": assistant_text}
+    messages = messages_store.append(session_id, assistant_msg)
+    log.debug("generated=%s", generated)
 
     #books = [{'title': 'Dune', 'subtitle': 'The epic saga of the desert planet Arrakis', 'author': 'Frank Herbert', 'media_type': 'book'}, {'title': 'Hyperion', 'subtitle': '', 'author': 'Dan Simmons', 'media_type': 'book'}]
 
-    for book in books:
-        print()
-        aiTest.update_kcls_availability(book)
-
-    books = [book for book in books if book.get('exist', True)]
-
-    for book in books:
-        author = book['author']
-        title = book['title']
-        ol_doc = get_openlibrary_doc(title, author)
-        print(ol_doc)
-        if ol_doc:
-            book['key'] = ol_doc.get('key')
-            book['cover_id'] = ol_doc.get('cover_i')
-            book['ratings_average'] = ol_doc.get('ratings_average', 0)
-            book['ratings_count'] = ol_doc.get('ratings_count', 0)
-            book['description'] = fetch_book_description(ol_doc.get('key')) or generate_description(ol_doc)
-            book['year'] = str(ol_doc.get('first_publish_year', 'Unknown')[0] if isinstance(ol_doc.get('first_publish_year'), tuple) else ol_doc.get('first_publish_year', 'Unknown'))
-        
-
-    
-    response_message = f"<br>{format_books_info(books)}"
-    return jsonify({"message": response_message, "session_id": session_id, "messages": messages})
+    with timing.stage('render'):
+        response_message = f"<br>{format_books_info(books)}"
+    return jsonify({"message": response_message, "session_id": session_id,
+                    "messages": messages if full_history else [user_msg, assistant_msg]})
+
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming variant of /chat, as NDJSON (one JSON object per line):
+    {"type": "intro", "message"} first, {"type": "book", "index", "html"} for each book card as soon
+    as its enrichment finishes (index is its position in the list), and finally {"type": "done",
+    "session_id", "messages"}. An LLM answer's first intro cannot count its cards yet, so a second
+    intro replacing it, with the count of cards sent, follows the last card.
+    If the LLM fails before its first book, the stream ends with {"type": "error", "message"} instead.
+    """
+    data = request.get_json()
+    session_id = session_id_of(data)
+    message = data.get('message', '')
+    full_history = wants_full_history(data)
+
+    def generate():
+        user_msg = {"role": "user", "content": message}
+        messages = messages_store.append(session_id, user_msg)
+        language = query_parser.parse(message).language
+
+        books = answer_locally(messages)
+        if books is not None:
+            # the local list is complete (and enriched, without the books KCLS does not carry) up front
+            generated = local_history(books)
+            yield json.dumps({"type": "intro", "message": format_message(books, None, language)}) + "\n"
+            enriched = enumerate(books)
+        else:
+            generated = []
+            yield json.dumps({"type": "intro", "message": format_stream_intro(language)}) + "\n"
+            enriched = iter_enriched_books(generate_books(messages, generated))
+        shown = []
+        try:
+            for index, book in enriched:
+                if book.get('exist', True):
+                    shown.append(book)
+                    yield json.dumps({"type": "book", "index": index, "html": format_books_info([book])}) + "\n"
+        except openai.OpenAIError:
+            # the LLM failed before its first book: no answer to keep in the session
+            yield json.dumps({"type": "error", "message": "Sorry, the book search is unavailable right now. Please try again."}) + "\n"
+            return
+        if books is None:
+            # only now is it known how many of the LLM's books KCLS carries
+            yield json.dumps({"type": "intro", "message": format_message(shown, None, language)}) + "\n"
+
+        assistant_msg = {"role": "assistant", "content": json.dumps(generated)}
+        messages = messages_store.append(session_id, assistant_msg)
+
+        yield json.dumps({"type": "done", "session_id": session_id,
+                          "messages": messages if full_history else [user_msg, assistant_msg]}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,105 @@
+"""
+Micro-benchmark: book card rendering, the original format_books_info (template read from disk per
+request, each card a full HTML document, += concatenation) vs book_cards.CardRenderer, cold
+(every card rendered) and warm (cards served from its cache). Reports render time and response
+size per request of --books cards.
+
+    python benchmarks/bench_book_cards.py [--books 5] [--number 2000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from book_cards import TEMPLATE_PATH, CardRenderer, format_rating, get_availability_text  # noqa: E402
+
+DOCUMENT = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8" />
+    <title>Book List</title>
+    <link rel="stylesheet" href="bookTemplateStyles.css">
+</head>
+<body>
+{card}
+</body>
+</html>
+"""
+
+
+def original_format_books_info(books, template_path):
+    """The original backend_response.format_books_info"""
+    with open(template_path, 'r', encoding='utf-8') as f:
+        book_template = f.read()
+
+    book_info = ""
+
+    for book in books:
+        cover_img = ""
+        if book['cover_id']:
+            cover_img = f"<img src='https://covers.openlibrary.org/b/id/{book['cover_id']}-M.jpg' class='book-cover'>"
+
+        rating = format_rating(book['ratings_average'], book['ratings_count'])
+        availability_text = get_availability_text(book['availability'])
+
+        book_info += book_template.format(
+            cover_img=cover_img,
+            title=book['title'],
+            author=book['author'],
+            year=book['year'],
+            rating=rating,
+            description=book['description'],
+            link=book['link'],
+            media_type=book['media_type'],
+            availability=str(book['availability']),
+            availability_text=availability_text
+        )
+
+    return book_info
+
+
+def make_books(n):
+    return [{
+        'key': f"/works/OL{1000 + i}W", 'title': f"The Book of Things {i}", 'author': "Ursula K. Le Guin",
+        'media_type': 'book', 'availability': i % 2 == 0, 'exist': True, 'year': str(1960 + i),
+        'link': f"https://kcls.bibliocommons.com/v2/record/S82C{3000000 + i}", 'cover_id': 8231856 + i,
+        'ratings_average': 4.1, 'ratings_count': 1234 + i,
+        'description': "An envoy is sent to a frozen world whose people can change gender, and must win "
+                       "the trust of two rival nations before his mission & his life run out. " * 3,
+    } for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=5)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(TEMPLATE_PATH, encoding='utf-8') as f:
+        fragment = f.read()
+    # the original template: the card fragment wrapped in a whole document
+    with tempfile.NamedTemporaryFile('w', suffix='.html', delete=False, encoding='utf-8') as f:
+        f.write(DOCUMENT.replace('{card}', fragment))
+        document_path = f.name
+
+    books = make_books(args.books)
+    renderer = CardRenderer()
+    cold = CardRenderer(cache_size=0)
+
+    runs = {
+        'original': lambda: original_format_books_info(books, document_path),
+        'cold': lambda: cold.render_all(books),
+        'cached': lambda: renderer.render_all(books),
+    }
+    print(f"{'renderer':>9} {'us/request':>11} {'bytes':>8}")
+    for name, run in runs.items():
+        seconds = min(timeit.repeat(run, number=args.number, repeat=5)) / args.number
+        print(f"{name:>9} {seconds * 1e6:11.1f} {len(run().encode('utf-8')):8d}")
+    os.unlink(document_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark: testAPI candidate fetching, the original pipeline (a description fetched serially for
+every search result, duplicates included) vs recommend_books (editions collapsed, candidates ranked
+on search metadata with BM25, descriptions fetched concurrently for at most description_fetch_budget
+of the shortlist), against the local
+Open Library stub. Reports outbound Open Library requests and latency per chat.
+
+    python benchmarks/bench_candidate_fetch.py [--chats 10] [--latency-ms 50]
+
+Embeddings come from a hashing bag-of-words model, so it runs without the sentence-transformers
+weights; each chat searches distinct terms, so no description is served from the cache.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import urllib.parse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from stub_upstreams import HashingModel, OpenLibraryStub, serve  # noqa: E402
+
+server = serve(OpenLibraryStub)
+os.environ.update(BOOKQUEST_OPENLIBRARY_URL=f"http://127.0.0.1:{server.server_port}",
+                  BOOKQUEST_CACHE_DIR=tempfile.mkdtemp(prefix='bookquest-bench-'),
+                  HF_HUB_OFFLINE='1')
+
+import http_client  # noqa: E402
+import testAPI  # noqa: E402
+from embeddings import EmbeddingStore, QueryEmbeddingCache  # noqa: E402
+from openlibrary import fetch_book_description  # noqa: E402
+
+
+def original_fetch(message):
+    """The original fetch_open_library_books and chat ranking: every doc gets a description, fetched
+    one after another; the top books' descriptions are fetched again after sorting"""
+    query = testAPI.parse_query(message)
+    url = (f"{testAPI.settings.openlibrary_url}/search.json?q={urllib.parse.quote(query.terms)}&sort=rating"
+           f"&limit={testAPI.settings.initial_fetch_limit}&language=eng"
+           f"&fields=title,author_name,first_publish_year,number_of_pages_median,subject,ratings_average,"
+           f"ratings_count,cover_i,key")
+    books = []
+    for doc in http_client.get(url).json().get('docs', []):
+        if not doc.get('title'):
+            continue
+        book = testAPI.format_book_data(doc)
+        book['description'] = fetch_book_description(doc.get('key')) or testAPI.generate_description(doc)
+        books.append(book)
+
+    top_books = testAPI.semantic_sort(books, message, query.year_data, top_k=query.num_books)
+    for book in top_books:
+        book['description'] = fetch_book_description(book['key']) or testAPI.generate_description(book)
+    return top_books, query
+
+
+def openlibrary_requests():
+    stats = http_client.host_stats().get("127.0.0.1", {})
+    return stats.get('requests', 0)
+
+
+def run(pipeline, chats, prefix):
+    counts, latencies = [], []
+    for n in range(chats):
+        before = openlibrary_requests()
+        start = time.perf_counter()
+        pipeline(f"{prefix} space opera {n}")
+        latencies.append(time.perf_counter() - start)
+        counts.append(openlibrary_requests() - before)
+    return np.mean(counts), np.percentile(latencies, 50) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--latency-ms', type=float, default=50, help="Open Library stub latency")
+    args = parser.parse_args()
+
+    OpenLibraryStub.latency = args.latency_ms / 1000
+    testAPI.model = HashingModel()
+    testAPI.embedding_store = EmbeddingStore(testAPI.settings.embedding_dir, 'hashing')
+    testAPI.query_embeddings = QueryEmbeddingCache(testAPI.model)
+
+    print(f"{testAPI.settings.initial_fetch_limit} search results, {testAPI.settings.num_books} books per chat, "
+          f"shortlist factor {testAPI.settings.shortlist_factor}, description budget {testAPI.settings.description_fetch_budget}")
+    print(f"{'pipeline':>10} {'OL requests/chat':>17} {'p50 ms':>8}")
+    for name, pipeline in (('original', original_fetch), ('two-phase', testAPI.recommend_books)):
+        requests_per_chat, p50 = run(pipeline, args.chats, name)
+        print(f"{name:>10} {requests_per_chat:17.1f} {p50:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark: hybrid_search retrieval over a synthetic catalog of --books books: BM25 alone, the
+embedding index alone and the fused HybridRetriever (exact, and over the approximate IVF
+embedding index), returning --candidates candidates.
+Reports index build time and p50/p99 query latency, and the recall of two planted groups of
+relevant books per query: books that share the query's words but not its meaning (found
+lexically) and books near its embedding that share none of its words (found semantically).
+
+    python benchmarks/bench_hybrid_search.py [--books 50000] [--queries 200] [--candidates 200]
+
+Embeddings are random unit vectors (planted books are placed near their query's vector), so it
+runs without the sentence-transformers weights.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from apiSettings import ApiSettings  # noqa: E402
+from hybrid_search import HybridRetriever  # noqa: E402
+from embeddings import VectorIndex  # noqa: E402
+
+DIM = 384
+PLANTED = 10    # relevant books of each kind per query
+
+
+def unit(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)).astype(np.float32)
+
+
+def make_catalog(n_books, n_queries, rng):
+    """Texts and vectors of the catalog, and per query: its text, vector and planted relevant books"""
+    vocabulary = np.array([f"w{i}" for i in range(20000)])
+    texts = [' '.join(rng.choice(vocabulary, 60)) for _ in range(n_books)]
+    vectors = unit(rng.standard_normal((n_books, DIM)))
+
+    queries = []
+    books = rng.permutation(n_books)
+    for q in range(n_queries):
+        words = [f"q{q}a", f"q{q}b"]
+        query_vector = unit(rng.standard_normal(DIM))
+        lexical = books[2 * PLANTED * q:2 * PLANTED * q + PLANTED]
+        semantic = books[2 * PLANTED * q + PLANTED:2 * PLANTED * (q + 1)]
+        for i in lexical:
+            texts[i] += f" {' '.join(words)}"
+        vectors[semantic] = unit(query_vector + 0.9 * unit(rng.standard_normal((PLANTED, DIM))))
+        queries.append((' '.join(words), query_vector, set(lexical), set(semantic)))
+    return texts, vectors, queries
+
+
+def evaluate(search, queries):
+    latencies, lexical_recall, semantic_recall = [], [], []
+    for text, vector, lexical, semantic in queries:
+        start = time.perf_counter()
+        found = set(search(text, vector).tolist())
+        latencies.append(time.perf_counter() - start)
+        lexical_recall.append(len(found & lexical) / len(lexical))
+        semantic_recall.append(len(found & semantic) / len(semantic))
+    return (np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000,
+            np.mean(lexical_recall), np.mean(semantic_recall))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--candidates', type=int, default=200)
+    args = parser.parse_args()
+
+    settings = ApiSettings()
+    texts, vectors, queries = make_catalog(args.books, args.queries, np.random.default_rng(0))
+
+    start = time.perf_counter()
+    retriever = HybridRetriever(texts, vectors, depth=settings.hybrid_depth, rrf_k=settings.rrf_k)
+    print(f"{args.books:,} books: hybrid index built in {time.perf_counter() - start:.1f}s")
+    bm25 = retriever.lexical
+    index = VectorIndex(vectors)
+    start = time.perf_counter()
+    approximate = HybridRetriever(texts, vectors, approximate=True, depth=settings.hybrid_depth, rrf_k=settings.rrf_k)
+    print(f"{args.books:,} books: hybrid index with IVF built in {time.perf_counter() - start:.1f}s")
+
+    k = args.candidates
+    runs = {
+        'bm25': lambda text, vector: bm25.search(text, k)[0],
+        'embedding': lambda text, vector: index.search(vector, k)[0],
+        'hybrid': lambda text, vector: retriever.search(text, vector, k)[0],
+        'hybrid-ivf': lambda text, vector: approximate.search(text, vector, k)[0],
+    }
+    print(f"{'retriever':>10} {'p50 ms':>8} {'p99 ms':>8} {'lexical recall':>15} {'semantic recall':>16}")
+    for name, search in runs.items():
+        p50, p99, lexical, semantic = evaluate(search, queries)
+        print(f"{name:>10} {p50:8.2f} {p99:8.2f} {lexical:15.2f} {semantic:16.2f}")
+
+
+if __name__ == '__main__':
+    main()
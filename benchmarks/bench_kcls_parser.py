@@ -0,0 +1,127 @@
+"""
+Benchmark: KCLS search page parsing, full BeautifulSoup tree vs the streaming kcls_parser.
+Runs both parsers over the KCLS search pages in benchmarks/fixtures/kcls and reports the CPU time
+per lookup and two memory figures: the peak Python heap (tracemalloc, which does not see lxml's
+libxml2 allocations) and the peak RSS growth of one lookup in a fresh subprocess, which does.
+The bundled pages reproduce BiblioCommons' search result markup at a typical page size; save real
+pages next to them and list them in FIXTURES.
+
+    python benchmarks/bench_kcls_parser.py [--repeat 20]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from kcls_parser import parse_kcls_page  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'kcls')
+
+# fixture file -> title asked for
+FIXTURES = {
+    'dune_book.html': 'dune',
+    'lightning_thief_ebook.html': 'the lightning thief',
+    'no_match.html': 'iron widow',
+}
+
+
+def parse_with_soup(html, title_lower):
+    """The previous aiTest.update_kcls_availability parsing: full tree, then walk it
+    (sibling lookup fixed to li so every result is visited, as the streaming parser does)"""
+    soup = BeautifulSoup(html, 'lxml')
+    info_block = soup.find('li', class_='row cp-search-result-item')
+    while info_block:
+        title_block = info_block.select_one('.title-content, span.title-content, .cp-title .title-content, h2 .title-content')
+        if title_block and title_block.get_text(strip=True):
+            info_title = title_block.get_text(strip=True).strip()
+            if info_title.lower() in title_lower or title_lower in info_title.lower():
+                for manifestation_block in info_block.find_all('div', class_='manifestation-item cp-manifestation-list-item row'):
+                    availability_block = manifestation_block.find('div', class_='manifestation-item-availability-block-wrap')
+                    if availability_block:
+                        status_span = availability_block.find('span', class_='cp-availability-status')
+                        if status_span:
+                            return status_span.get_text(strip=True).lower()
+        info_block = info_block.find_next_sibling('li', class_='cp-search-result-item')
+    return None
+
+
+def parse_streaming(html, title_lower):
+    match = parse_kcls_page(html, title_lower)
+    return match['status'] if match else None
+
+
+PARSERS = {'soup': parse_with_soup, 'streaming': parse_streaming}
+
+
+def max_rss_kb():
+    """Peak RSS of this process in KB"""
+    if os.path.exists('/proc/self/status'):
+        # Linux: ru_maxrss survives exec, so a child would start at its parent's peak; VmHWM does not
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 if sys.platform == 'darwin' else rss    # bytes on macOS
+
+
+def rss_growth(label, name, title):
+    """Peak RSS growth (KB) of one lookup, in a fresh process so earlier runs do not raise the peak"""
+    output = subprocess.run([sys.executable, __file__, '--rss', label, name, title],
+                            capture_output=True, text=True, check=True).stdout
+    return float(output)
+
+
+def measure(label, name, html, title, repeat):
+    parse = PARSERS[label]
+    start = time.process_time()
+    for _ in range(repeat):
+        result = parse(html, title)
+    cpu_ms = (time.process_time() - start) / repeat * 1000
+
+    tracemalloc.start()
+    parse(html, title)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, cpu_ms, peak / 1024, rss_growth(label, name, title)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--rss', nargs=3, metavar=('PARSER', 'FIXTURE', 'TITLE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.rss:
+        label, name, title = args.rss
+        with open(os.path.join(FIXTURE_DIR, name), 'rb') as f:
+            html = f.read()
+        baseline = max_rss_kb()
+        PARSERS[label](html, title)
+        print(max_rss_kb() - baseline)
+        return
+
+    print(f"{'fixture':32} {'size KB':>8} {'parser':>10} {'CPU ms':>8} {'py heap KB':>10} {'RSS KB':>8}  result")
+    for name, title in FIXTURES.items():
+        with open(os.path.join(FIXTURE_DIR, name), 'rb') as f:
+            html = f.read()
+
+        rows = {}
+        for label in PARSERS:
+            rows[label] = measure(label, name, html, title, args.repeat)
+            result, cpu_ms, heap_kb, rss_kb = rows[label]
+            print(f"{name:32} {len(html) / 1024:8.0f} {label:>10} {cpu_ms:8.2f} {heap_kb:10.0f} {rss_kb:8.0f}  {result}")
+
+        if rows['soup'][0] != rows['streaming'][0]:
+            print(f"  !! results differ for {name}")
+        print(f"{'':32} {'':8} {'saved':>10} {rows['soup'][1] - rows['streaming'][1]:8.2f} "
+              f"{rows['soup'][2] - rows['streaming'][2]:10.0f} {rows['soup'][3] - rows['streaming'][3]:8.0f}")
+
+
+if __name__ == '__main__':
+    main()
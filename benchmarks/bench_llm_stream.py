@@ -0,0 +1,64 @@
+"""
+Benchmark: blocking aiTest.create_response vs streamed aiTest.stream_response against the local
+OpenAI stub (benchmarks/stub_upstreams.py), so it runs offline. Reports time to the first book,
+time until the whole list is parsed, and time until every book is enriched when enrichment
+(simulated as --enrich-ms per book on a thread pool) starts as each book arrives.
+A last run truncates the completion mid-array and shows which books survive.
+
+    python benchmarks/bench_llm_stream.py [--token-ms 15] [--enrich-ms 800] [--runs 3]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from stub_upstreams import OpenAIStub, completion_text, serve  # noqa: E402
+
+
+def run(call, enrich_seconds, pool):
+    """(first book, list complete, all enriched) seconds for one call returning an iterable of books"""
+    start = time.perf_counter()
+    first = None
+    futures = []
+    for book in call("books like dune"):
+        if first is None:
+            first = time.perf_counter() - start
+        futures.append(pool.submit(time.sleep, enrich_seconds))
+    parsed = time.perf_counter() - start
+    wait(futures)
+    return first or parsed, parsed, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--token-ms', type=float, default=15)
+    parser.add_argument('--enrich-ms', type=float, default=800)
+    parser.add_argument('--num-books', type=int, default=5)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    server = serve(OpenAIStub, token_delay=args.token_ms / 1000, num_books=args.num_books)
+    os.environ['OPENAI_BASE_URL'] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault('OPENAI_API_KEY', 'stub')
+    import aiTest
+
+    pool = ThreadPoolExecutor(max_workers=args.num_books)
+    enrich = args.enrich_ms / 1000
+    print(f"{'mode':>9} {'first book s':>13} {'parsed s':>9} {'enriched s':>11}")
+    for mode, call in (('blocking', aiTest.create_response), ('streamed', aiTest.stream_response)):
+        results = [run(call, enrich, pool) for _ in range(args.runs)]
+        first, parsed, enriched = (min(column) for column in zip(*results))
+        print(f"{mode:>9} {first:13.3f} {parsed:9.3f} {enriched:11.3f}")
+
+    cut = len(completion_text(args.num_books)) * 2 // 3
+    server.RequestHandlerClass.truncate_after = cut
+    titles = [book['title'] for book in aiTest.stream_response("books like dune")]
+    print(f"truncated after {cut} chars: kept {len(titles)}/{args.num_books} books {titles}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
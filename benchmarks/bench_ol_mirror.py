@@ -0,0 +1,141 @@
+"""
+Benchmark: ol_mirror ingestion and search latency, on synthetic dumps in the Open Library dump
+format (authors, works, editions, ratings; gzipped) with --works works.
+Reports ingest rate, peak memory and mirror size, then p50/p99 latency of the search.json query
+shapes the backends send: keyword + language + sort=rating (terms from fixtures/queries.txt),
+exact title + author, and the OR'ed title/author batch, plus description lookups.
+
+    python benchmarks/bench_ol_mirror.py [--works 200000] [--queries 500]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ol_mirror  # noqa: E402
+from apiSettings import ApiSettings  # noqa: E402
+from bench_query_parser import load_corpus  # noqa: E402
+from query_parser import QueryParser  # noqa: E402
+
+LANGUAGES = ['eng'] * 6 + ['spa', 'fre', 'ger', 'jpn']
+
+
+def write_dump(path, lines):
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line + '\n')
+
+
+def record(record_type, key, data):
+    return f"{record_type}\t{key}\t1\t2024-01-01T00:00:00\t{json.dumps(data)}"
+
+
+def make_dumps(directory, n_works, vocabulary, seed=0):
+    """Authors, works, editions and ratings dumps for n_works works; returns their paths and some works"""
+    rng = random.Random(seed)
+    n_authors = max(1, n_works // 4)
+    authors = [f"{rng.choice(vocabulary).title()} {rng.choice(vocabulary).title()}" for _ in range(n_authors)]
+    works = []
+
+    def work_lines():
+        for i in range(n_works):
+            title = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(2, 5))).title()
+            author = rng.randrange(n_authors)
+            if i % 1000 == 0:
+                works.append((f"/works/OL{i}W", title, authors[author]))
+            yield record('/type/work', f"/works/OL{i}W", {
+                'key': f"/works/OL{i}W", 'title': title,
+                'authors': [{'author': {'key': f"/authors/OL{author}A"}, 'type': {'key': '/type/author_role'}}],
+                'subjects': [rng.choice(vocabulary).title() for _ in range(rng.randint(0, 6))],
+                'description': {'type': '/type/text', 'value': ' '.join(rng.choices(vocabulary, k=40))},
+                'covers': [rng.randrange(1, 10 ** 7)], 'first_publish_date': str(rng.randint(1900, 2024)),
+            })
+
+    def edition_lines():
+        for i in range(n_works):
+            for j in range(rng.randint(1, 3)):
+                yield record('/type/edition', f"/books/OL{i}_{j}M", {
+                    'works': [{'key': f"/works/OL{i}W"}], 'languages': [{'key': f"/languages/{rng.choice(LANGUAGES)}"}],
+                    'number_of_pages': rng.randint(80, 900), 'publish_date': str(rng.randint(1900, 2024)),
+                })
+
+    def rating_lines():
+        for i in range(n_works):
+            for _ in range(int(rng.paretovariate(1.2)) - 1):
+                yield f"/works/OL{i}W\t\t{rng.randint(1, 5)}\t2024-01-01"
+
+    paths = {name: os.path.join(directory, f"ol_dump_{name}.txt.gz") for name in ('authors', 'works', 'editions', 'ratings')}
+    write_dump(paths['authors'], (record('/type/author', f"/authors/OL{i}A", {'name': name}) for i, name in enumerate(authors)))
+    write_dump(paths['works'], work_lines())
+    write_dump(paths['editions'], edition_lines())
+    write_dump(paths['ratings'], rating_lines())
+    return paths, works
+
+
+def percentiles(run, items):
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        run(item)
+        latencies.append(time.perf_counter() - start)
+    return np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--works', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    settings = ApiSettings()
+    query_parser = QueryParser.from_settings(settings)
+    terms = [query_parser.parse(message).terms for message in load_corpus()]
+    vocabulary = sorted({word for t in terms for word in t.split()} |
+                        {f"word{i}" for i in range(2000)})
+
+    directory = tempfile.mkdtemp(prefix='bookquest-mirror-')
+    paths, works = make_dumps(directory, args.works, vocabulary)
+    dump_bytes = sum(os.path.getsize(path) for path in paths.values())
+
+    db = os.path.join(directory, 'ol_mirror.sqlite3')
+    start = time.monotonic()
+    conn = ol_mirror.connect(db)
+    for name in ('authors', 'works', 'editions'):
+        ol_mirror.ingest_dump(conn, paths[name])
+    ol_mirror.ingest_ratings(conn, paths['ratings'])
+    ol_mirror.finalize(conn)
+    ol_mirror.compact(conn)
+    conn.close()
+    elapsed = time.monotonic() - start
+    print(f"{args.works:,} works: dumps {dump_bytes / 1e6:.1f} MB gzipped, ingested in {elapsed:.1f}s "
+          f"({args.works / elapsed:,.0f} works/s), peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB, "
+          f"mirror {os.path.getsize(db) / 1e6:.1f} MB")
+
+    mirror = ol_mirror.OpenLibraryMirror(db)
+    rng = random.Random(1)
+    keyword = [{'q': rng.choice(terms), 'sort': 'rating', 'limit': settings.initial_fetch_limit, 'language': 'eng'}
+               for _ in range(args.queries)]
+    exact = [{'title': title, 'author': author, 'limit': 10} for _, title, author in rng.choices(works, k=args.queries)]
+    batch = [{'q': ' OR '.join(f'(title:"{title}" AND author:"{author}")' for _, title, author in rng.choices(works, k=5)),
+              'limit': 50} for _ in range(args.queries)]
+    keys = [key for key, _, _ in rng.choices(works, k=args.queries)]
+
+    print(f"{'query':>22} {'p50 ms':>8} {'p99 ms':>8} {'docs':>6}")
+    for name, run, items in (('keyword+lang+rating', mirror.search, keyword), ('title+author', mirror.search, exact),
+                             ('title/author batch', mirror.search, batch), ('description', mirror.description, keys)):
+        p50, p99 = percentiles(run, items)
+        docs = np.mean([len(run(item)['docs']) for item in items[:50]]) if run == mirror.search else 1
+        print(f"{name:>22} {p50:8.2f} {p99:8.2f} {docs:6.1f}")
+
+
+if __name__ == '__main__':
+    main()
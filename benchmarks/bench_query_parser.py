@@ -0,0 +1,128 @@
+"""
+Micro-benchmark: testAPI query parsing, the original parse_query (STOP_WORDS list scans, writes
+settings.num_books) vs query_parser.QueryParser, over the query corpus in fixtures/queries.txt.
+Checks both parse every query the same way, then runs the corpus from several threads at once
+and counts queries whose book count came out wrong.
+
+    python benchmarks/bench_query_parser.py [--number 200] [--threads 8]
+"""
+import argparse
+import os
+import sys
+import threading
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from apiSettings import ApiSettings  # noqa: E402
+from embeddings import normalize_query  # noqa: E402
+from query_parser import QueryParser  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'queries.txt')
+
+
+def load_corpus(path=CORPUS):
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def original_parse_query(message, settings):
+    """The original testAPI.parse_query, on the settings instance it is given"""
+    language = 'english'
+    search_terms = []
+    skip_indices = set()
+    year_data = settings.YEAR_FILTER_WORDS[-1]
+
+    words = normalize_query(message).split()
+
+    for i, word in enumerate(words):
+        if word in settings.LANGUAGE_CODES:
+            language = word
+            skip_indices.add(i)  # Don't include in search_terms
+
+        if word in settings.YEAR_FILTER_WORDS:
+            year_data = settings.YEAR_FILTER_WORDS[word]
+
+        elif word in settings.NUM_RESULTS_WORDS:
+            # Check neighboring digit
+            if (i > 0 and words[i - 1].isdigit()):
+                settings.num_books = int(words[i - 1])
+                skip_indices.update({i, i - 1})
+            elif (i < len(words) - 1 and words[i + 1].isdigit()):
+                settings.num_books = int(words[i + 1])
+                skip_indices.update({i, i + 1})
+            settings.num_books = min(max(settings.num_books, 3), 30)
+
+    search_terms = [
+        word for i, word in enumerate(words)
+        if i not in skip_indices and word not in settings.STOP_WORDS
+    ]
+
+    clean_query = ' '.join(search_terms)
+    return clean_query, language, year_data
+
+
+def original_num_books(message, settings):
+    """Book count the original code uses for message: settings.num_books right after parsing"""
+    original_parse_query(message, settings)
+    return settings.num_books
+
+
+def count_leaks(corpus, expected, threads, parse_num_books):
+    """Queries whose book count differs from expected when threads parse the corpus concurrently"""
+    wrong = []
+    barrier = threading.Barrier(threads)
+
+    def worker(offset):
+        barrier.wait()
+        for i in range(len(corpus)):
+            j = (i + offset) % len(corpus)
+            if parse_num_books(corpus[j]) != expected[j]:
+                wrong.append(j)
+
+    workers = [threading.Thread(target=worker, args=(n * 7,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return len(wrong)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    query_parser = QueryParser.from_settings(ApiSettings())
+
+    # Same terms, language and year; same book count as the original when it starts from the default
+    mismatches = 0
+    for message in corpus:
+        settings = ApiSettings()
+        original = original_parse_query(message, settings) + (settings.num_books,)
+        parsed = query_parser.parse(message)
+        mismatches += original != (parsed.terms, parsed.language, parsed.year_data, parsed.num_books)
+
+    shared = ApiSettings()
+    runs = {
+        'original': lambda: [original_parse_query(message, shared) for message in corpus],
+        'parser': lambda: [query_parser.parse(message) for message in corpus],
+    }
+    print(f"{len(corpus)} queries, {mismatches} parsed differently")
+    print(f"{'parser':>9} {'us/query':>9}")
+    for name, run in runs.items():
+        seconds = min(timeit.repeat(run, number=args.number, repeat=5)) / args.number
+        print(f"{name:>9} {seconds / len(corpus) * 1e6:9.2f}")
+
+    # Each query's own book count, then the same corpus from concurrent threads
+    expected = [query_parser.parse(message).num_books for message in corpus]
+    shared = ApiSettings()
+    print(f"wrong book counts with {args.threads} threads: "
+          f"original {count_leaks(corpus, expected, args.threads, lambda m: original_num_books(m, shared))}, "
+          f"parser {count_leaks(corpus, expected, args.threads, lambda m: query_parser.parse(m).num_books)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark: query_router.QueryRouter in front of backend_response /chat, against the local
+OpenAI, Open Library and KCLS stubs. Routes the query corpus in fixtures/queries.txt (share sent
+to the local path, routing latency), then posts every query to /chat as a first turn with routing
+off (everything goes to the LLM) and on, and reports p50/p99 chat latency per route.
+
+    python benchmarks/bench_query_router.py [--token-ms 15] [--latency-ms 50] [--threshold 0.6]
+
+Embeddings for the local path come from a hashing bag-of-words model, so it runs without the
+sentence-transformers weights. The LLM stub streams every list at --token-ms per token; with the
+real model, LLM answers take seconds and the gap is wider.
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from stub_upstreams import HashingModel, start_all, stub_environment  # noqa: E402
+
+servers = start_all(unique_books=True)
+os.environ.update(stub_environment(servers), BOOKQUEST_CACHE_DIR=tempfile.mkdtemp(prefix='bookquest-bench-'),
+                  HF_HUB_OFFLINE='1', BOOKQUEST_LAZY_STARTUP='0', BOOKQUEST_RESPONSE_CACHE='0',
+                  BOOKQUEST_QUERY_ROUTING='1')
+
+import backend_response  # noqa: E402
+import testAPI  # noqa: E402
+from bench_query_parser import load_corpus  # noqa: E402
+from embeddings import EmbeddingStore, QueryEmbeddingCache  # noqa: E402
+from query_router import LOCAL, QueryRouter  # noqa: E402
+from startup import Startup  # noqa: E402
+
+sessions = itertools.count()
+
+
+def initialize():
+    """testAPI.initialize with the hashing model and no catalog"""
+    testAPI.model = HashingModel()
+    testAPI.embedding_store = EmbeddingStore(testAPI.settings.embedding_dir, 'hashing')
+    testAPI.query_embeddings = QueryEmbeddingCache(testAPI.model)
+
+
+def post_chat(client, message):
+    """Seconds for one first-turn /chat"""
+    start = time.perf_counter()
+    response = client.post('/chat', json={'message': message, 'session_id': f"bench-{next(sessions)}"})
+    assert response.status_code == 200, response.status_code
+    return time.perf_counter() - start
+
+
+def percentiles(seconds):
+    return (np.percentile(seconds, 50) * 1000, np.percentile(seconds, 99) * 1000) if seconds else (0.0, 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--token-ms', type=float, default=15, help="OpenAI stub delay per streamed token")
+    parser.add_argument('--latency-ms', type=float, default=50, help="Open Library and KCLS stub latency")
+    parser.add_argument('--threshold', type=float, default=backend_response.settings.router_threshold)
+    args = parser.parse_args()
+
+    servers['openai'].RequestHandlerClass.token_delay = args.token_ms / 1000
+    for name in ('openlibrary', 'kcls'):
+        servers[name].RequestHandlerClass.latency = args.latency_ms / 1000
+    settings = backend_response.settings
+    settings.router_threshold = args.threshold
+    router = backend_response.query_router = QueryRouter.from_settings(settings)
+    testAPI.startup = Startup('testAPI')
+    testAPI.startup.start(initialize, lazy=False)
+
+    corpus = load_corpus()
+    decisions = [router.route(message) for message in corpus]
+    routing = [decision.latency_ms / 1000 for decision in decisions]
+    local = sum(decision.route == LOCAL for decision in decisions)
+    print(f"{len(corpus)} queries, threshold {args.threshold}: {local} ({local / len(corpus):.0%}) routed local, "
+          f"routing p50 {percentiles(routing)[0] * 1000:.0f} us, p99 {percentiles(routing)[1] * 1000:.0f} us")
+
+    client = backend_response.app.test_client()
+    print(f"{'routing':>8} {'route':>6} {'chats':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    for enabled in (False, True):
+        settings.query_routing = enabled
+        latencies = {LOCAL: [], 'llm': []}
+        for message, decision in zip(corpus, decisions):
+            latencies[decision.route if enabled else 'llm'].append(post_chat(client, message))
+        for route, seconds in latencies.items():
+            if seconds:
+                p50, p99 = percentiles(seconds)
+                print(f"{'on' if enabled else 'off':>8} {route:>6} {len(seconds):6d} {p50:8.1f} {p99:8.1f}")
+        p50, p99 = percentiles(latencies[LOCAL] + latencies['llm'])
+        print(f"{'on' if enabled else 'off':>8} {'all':>6} {len(corpus):6d} {p50:8.1f} {p99:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
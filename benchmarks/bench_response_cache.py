@@ -0,0 +1,89 @@
+"""
+Benchmark: the LLM response cache (aiTest.response_cache) in front of backend_response.generate_books,
+against the local OpenAI stub. Replays --requests first-turn chats drawn from fixtures/queries.txt
+with Zipf-like popularity, each reworded the way users retype a request (case, punctuation, filler
+words), with the cache off and on. Reports LLM calls, hit ratio and mean/p50/p99 time to the full
+book list.
+
+    python benchmarks/bench_response_cache.py [--requests 500] [--encoder hashing|minilm] [--threshold 0.9]
+
+--encoder minilm embeds prompts with all-MiniLM-L6-v2, as the backends do (needs the model weights);
+hashing uses a bag-of-words stand-in, which only matches rewordings that keep most of the words.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from stub_upstreams import HashingModel, OpenAIStub, serve  # noqa: E402
+
+server = serve(OpenAIStub, unique_books=True, token_delay=0.002)
+os.environ.update(OPENAI_BASE_URL=f"http://127.0.0.1:{server.server_port}/v1", OPENAI_API_KEY='stub',
+                  HF_HUB_OFFLINE='1', BOOKQUEST_LAZY_STARTUP='1')
+
+import aiTest  # noqa: E402
+import backend_response  # noqa: E402
+from bench_query_parser import load_corpus  # noqa: E402
+from cache import SemanticCache  # noqa: E402
+from embeddings import QueryEmbeddingCache  # noqa: E402
+from session_store import SYSTEM_MESSAGE  # noqa: E402
+
+PREFIXES = ['', '', 'please ', 'can you recommend ', 'i want ', 'looking for ']
+SUFFIXES = ['', '', '?', ' please', '!', ' thanks']
+
+
+def reword(message, rng):
+    message = rng.choice(PREFIXES) + message + rng.choice(SUFFIXES)
+    return message.upper() if rng.random() < 0.1 else message.lower() if rng.random() < 0.5 else message
+
+
+def workload(corpus, n, rng):
+    weights = 1 / np.arange(1, len(corpus) + 1)
+    order = rng.sample(corpus, len(corpus))
+    return [reword(message, rng) for message in rng.choices(order, weights=weights, k=n)]
+
+
+def replay(messages):
+    latencies = []
+    for message in messages:
+        start = time.perf_counter()
+        list(backend_response.generate_books([SYSTEM_MESSAGE, {'role': 'user', 'content': message}], []))
+        latencies.append(time.perf_counter() - start)
+    return np.mean(latencies) * 1000, np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--encoder', choices=['hashing', 'minilm'], default='hashing')
+    parser.add_argument('--threshold', type=float, default=backend_response.settings.response_cache_threshold)
+    args = parser.parse_args()
+
+    if args.encoder == 'minilm':
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer('all-MiniLM-L6-v2')
+    else:
+        model = HashingModel()
+    settings = backend_response.settings
+    messages = workload(load_corpus(), args.requests, random.Random(0))
+
+    print(f"{args.requests} requests, {len(set(messages))} distinct messages, encoder {args.encoder}, "
+          f"threshold {args.threshold}")
+    print(f"{'cache':>6} {'LLM calls':>10} {'hit ratio':>10} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for enabled in (False, True):
+        settings.response_cache = enabled
+        aiTest.response_cache = SemanticCache(QueryEmbeddingCache(model).encode, threshold=args.threshold,
+                                              maxsize=settings.response_cache_size, ttl=settings.response_cache_ttl)
+        mean, p50, p99 = replay(messages)
+        stats = aiTest.response_cache.stats()
+        calls = stats['misses'] if enabled else args.requests
+        print(f"{'on' if enabled else 'off':>6} {calls:10d} {stats['hit_ratio']:10.2f} {mean:8.1f} {p50:8.1f} {p99:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
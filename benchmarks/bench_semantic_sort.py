@@ -0,0 +1,90 @@
+"""
+Micro-benchmark: semantic_sort scoring, the original per-book loop vs scoring.score_books + top_k_indices.
+Uses random unit embeddings (384-d, like all-MiniLM-L6-v2) and Open Library-like metadata, so no
+model is needed. Checks that both produce the same ranking and reports the largest score difference.
+
+    python benchmarks/bench_semantic_sort.py [--sizes 30 300 3000] [--top-k 10]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from apiSettings import ApiSettings  # noqa: E402
+from scoring import score_books, top_k_indices  # noqa: E402
+
+settings = ApiSettings()
+
+
+def loop_sort(books, query_embedding, book_embeddings, year_data):
+    """The original testAPI.semantic_sort scoring loop and full sort"""
+    target_year, year_weight = year_data
+    scores = []
+    for i, book in enumerate(books):
+        semantic_score = np.dot(query_embedding, book_embeddings[i])
+        popularity = np.log1p(book.get('ratings_count', 0)) * book.get('ratings_average', 0)
+        pop_weight = settings.popularity_weight
+        book_year = int(book.get('year')) if book.get('year') and str(book.get('year')).isdigit() else None
+        if book_year:
+            year_score = 6 / (1 + 0.01 * abs(book_year - target_year))
+        else:
+            year_score = 0
+        total_score = (
+            (1 - pop_weight - year_weight) * semantic_score +
+            pop_weight * popularity +
+            year_weight * year_score
+        )
+        scores.append(total_score)
+
+    ranked = sorted(zip(scores, range(len(books))), key=lambda x: x[0], reverse=True)
+    return [i for _, i in ranked], np.array(scores)
+
+
+def vectorized_sort(books, query_embedding, book_embeddings, year_data, k):
+    scores = score_books(books, query_embedding, book_embeddings, year_data, settings.popularity_weight)
+    return list(top_k_indices(scores, k)), scores
+
+
+def make_candidates(n, rng):
+    books = []
+    for _ in range(n):
+        books.append({
+            'ratings_count': rng.choice([0, 0, 3, 25, 140, 2200, 51000]),
+            'ratings_average': round(rng.uniform(2.5, 4.8), 2),
+            'year': rng.choice(['Unknown', str(rng.randint(1850, 2025))]),
+        })
+    vectors = np.random.default_rng(n).standard_normal((n + 1, 384)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return books, vectors[0], vectors[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[30, 300, 3000])
+    parser.add_argument('--top-k', type=int, default=settings.num_books)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    year_data = settings.YEAR_FILTER_WORDS[-1]
+    print(f"{'candidates':>10} {'loop ms':>9} {'vector ms':>10} {'speedup':>8} {'max |diff|':>11}  same top-k")
+    for n in args.sizes:
+        books, query, embeddings = make_candidates(n, rng)
+        loop_order, loop_scores = loop_sort(books, query, embeddings, year_data)
+        vec_order, vec_scores = vectorized_sort(books, query, embeddings, year_data, args.top_k)
+
+        number = max(1, 3000 // n)
+        loop_ms = min(timeit.repeat(lambda: loop_sort(books, query, embeddings, year_data),
+                                    number=number, repeat=5)) / number * 1000
+        vec_ms = min(timeit.repeat(lambda: vectorized_sort(books, query, embeddings, year_data, args.top_k),
+                                   number=number, repeat=5)) / number * 1000
+        print(f"{n:10d} {loop_ms:9.3f} {vec_ms:10.3f} {loop_ms / vec_ms:7.1f}x "
+              f"{np.abs(loop_scores - vec_scores).max():11.2e}  {loop_order[:args.top_k] == vec_order}")
+
+
+if __name__ == '__main__':
+    main()
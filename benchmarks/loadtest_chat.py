@@ -0,0 +1,204 @@
+"""
+Load test: the /chat pipelines of the Flask backend (backend_response), the asyncio one
+(async_backend) and the search backend (testAPI), all pointed at the local upstream stubs
+(benchmarks/stub_upstreams.py), so it runs offline. Chats replay the query corpus in
+fixtures/queries.txt as is. The backends run with their Open Library / KCLS and LLM response caches
+off (BOOKQUEST_UPSTREAM_CACHES=0, BOOKQUEST_RESPONSE_CACHE=0), so caches do not hide the upstream
+latency; --warm leaves them on, so repeats are served from them.
+For each concurrency level, that many clients post chats back to back for --duration seconds;
+reports throughput, p50/p95/p99 latency, errors and the mean time per chat of each pipeline stage
+(from the backends' Server-Timing headers).
+
+    python benchmarks/loadtest_chat.py [--concurrency 10 50 200] [--duration 20] [--latency-ms 150]
+        [--fixtures benchmarks/fixtures/upstreams --queries 20] [--output run.json] [--baseline previous.json]
+
+--output saves the results as JSON; --baseline compares them with a saved run and exits with
+status 1 when throughput or a latency percentile got worse by more than --tolerance.
+With --fixtures the stubs replay recorded upstream responses (see stub_upstreams.py --record);
+benchmarks/fixtures/upstreams is a small recorded set covering the first 20 corpus queries.
+The backends load a hashing stand-in for the sentence-transformers model unless --model minilm.
+The Flask apps run on werkzeug's threaded server (one thread per connection); the async app on
+hypercorn with one worker.
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+STUBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_upstreams.py')
+
+sys.path.insert(0, ROOT)
+
+from bench_query_parser import load_corpus  # noqa: E402
+from timing import parse_server_timing  # noqa: E402
+
+# Python run by each backend process, and the path answering 200 once it can take chats
+BACKENDS = {
+    'flask': ("import backend_response; backend_response.app.run(port={port}, threaded=True)", '/chat'),
+    'async': ("import asyncio, async_backend; from hypercorn.asyncio import serve; from hypercorn.config import Config; "
+              "config = Config(); config.bind = ['127.0.0.1:{port}']; asyncio.run(serve(async_backend.app, config))",
+              '/chat'),
+    'testapi': ("import testAPI; testAPI.app.run(port={port}, threaded=True)", '/readyz'),
+}
+HASHING_MODEL = "import sys; sys.path.insert(0, 'benchmarks'); import stub_upstreams; stub_upstreams.install_hashing_model(); "
+METRICS = ('throughput', 'p50', 'p95', 'p99')
+
+
+def start(name, port, env, hashing):
+    code = (HASHING_MODEL if hashing else '') + BACKENDS[name][0].format(port=port)
+    return subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_listening(url, timeout=60, ready=False):
+    """Wait until url answers (with a 2xx when ready)"""
+    stop_at = time.monotonic() + timeout
+    while time.monotonic() < stop_at:
+        try:
+            response = httpx.get(url, timeout=1)
+            if not ready or response.is_success:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def run(url, messages, concurrency, duration):
+    counter = itertools.count()
+    latencies = []
+    stages = {}
+    errors = 0
+    stop_at = time.monotonic() + duration
+
+    async def client(http):
+        nonlocal errors
+        while time.monotonic() < stop_at:
+            n = next(counter)
+            start = time.perf_counter()
+            try:
+                response = await http.post(url, json={'message': messages(n), 'session_id': f"load-{n}",
+                                                      'full_history': False})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+                for name, ms in parse_server_timing(response.headers.get('Server-Timing')).items():
+                    stages[name] = stages.get(name, 0.0) + ms
+            except httpx.HTTPError:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as http:
+        start = time.monotonic()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.monotonic() - start
+
+    chats = len(latencies)
+    latencies = np.array(latencies or [np.nan]) * 1000
+    return {
+        'chats': chats, 'errors': errors, 'throughput': chats / elapsed,
+        'p50': np.percentile(latencies, 50), 'p95': np.percentile(latencies, 95), 'p99': np.percentile(latencies, 99),
+        'stages': {name: total / max(chats, 1) for name, total in stages.items()},
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print each result against the baseline run's; returns the regressions beyond tolerance"""
+    previous = {(result['backend'], result['concurrency']): result for result in baseline['results']}
+    regressions = []
+    print(f"\nvs baseline from {baseline.get('created', '?')}:")
+    print(f"{'backend':>8} {'clients':>7} " + ' '.join(f"{metric:>11}" for metric in METRICS))
+    for result in results:
+        old = previous.get((result['backend'], result['concurrency']))
+        if not old:
+            continue
+        cells = []
+        for metric in METRICS:
+            change = (result[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            worse = -change if metric == 'throughput' else change
+            if worse > tolerance:
+                regressions.append((result['backend'], result['concurrency'], metric, change))
+            cells.append(f"{change:+10.1%}{'!' if worse > tolerance else ' '}")
+        print(f"{result['backend']:>8} {result['concurrency']:7d} " + ' '.join(cells))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--latency-ms', type=float, default=150, help="Open Library / KCLS stub latency")
+    parser.add_argument('--token-ms', type=float, default=15, help="LLM stub delay per streamed delta")
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--fixtures', help="directory of recorded upstream responses for the stubs to replay")
+    parser.add_argument('--model', choices=['hashing', 'minilm'], default='hashing')
+    parser.add_argument('--queries', type=int, help="replay only the first N corpus queries (fixtures/upstreams has 20)")
+    parser.add_argument('--warm', action='store_true', help="keep the backends' caches on, so repeats get hits")
+    parser.add_argument('--output', help="save the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    corpus = load_corpus()[:args.queries]
+
+    def messages(n):
+        return corpus[n % len(corpus)]
+
+    stub_port = args.port
+    stubs = subprocess.Popen([sys.executable, STUBS, '--port', str(stub_port), '--token-ms', str(args.token_ms),
+                              '--latency-ms', str(args.latency_ms)]
+                             + (['--fixtures', args.fixtures] if args.fixtures else []),
+                             stdout=subprocess.DEVNULL)
+    env = dict(os.environ,
+               OPENAI_BASE_URL=f"http://127.0.0.1:{stub_port}/v1", OPENAI_API_KEY='stub',
+               BOOKQUEST_OPENLIBRARY_URL=f"http://127.0.0.1:{stub_port + 1}",
+               BOOKQUEST_KCLS_URL=f"http://127.0.0.1:{stub_port + 2}",
+               BOOKQUEST_CACHE_DIR=tempfile.mkdtemp(prefix='bookquest-loadtest-'))
+    if not args.warm:
+        env.update(BOOKQUEST_UPSTREAM_CACHES='0', BOOKQUEST_RESPONSE_CACHE='0')
+    processes = [stubs]
+    results = []
+    try:
+        wait_listening(f"http://127.0.0.1:{stub_port + 1}/")
+        print(f"{'backend':>8} {'clients':>7} {'chats/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}  stages (ms/chat)")
+        for i, name in enumerate(args.backends):
+            port = stub_port + 10 + i
+            backend = start(name, port, env, args.model == 'hashing')
+            processes.append(backend)
+            wait_listening(f"http://127.0.0.1:{port}{BACKENDS[name][1]}", ready=name == 'testapi')
+            for concurrency in args.concurrency:
+                result = asyncio.run(run(f"http://127.0.0.1:{port}/chat", messages, concurrency, args.duration))
+                results.append({'backend': name, 'concurrency': concurrency, **result})
+                stages = ', '.join(f"{stage} {ms:.0f}" for stage, ms in result['stages'].items())
+                print(f"{name:>8} {concurrency:7d} {result['throughput']:8.1f} {result['p50']:9.1f} "
+                      f"{result['p95']:9.1f} {result['p99']:9.1f} {result['errors']:7d}  {stages}")
+            backend.terminate()
+            backend.wait()
+    finally:
+        for process in processes:
+            process.terminate()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'created': datetime.datetime.now().isoformat(timespec='seconds'), 'config': vars(args),
+                       'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
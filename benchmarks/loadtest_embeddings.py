@@ -0,0 +1,109 @@
+"""
+Load test: query embedding latency and throughput with and without embeddings.MicroBatcher.
+Each concurrency level runs that many client threads calling encode() on distinct queries for
+--duration seconds, first directly on the shared SentenceTransformer, then through the batcher,
+and reports QPS and p50/p99 latency.
+
+    python benchmarks/loadtest_embeddings.py [--concurrency 1 4 16 64] [--duration 10]
+
+--simulate replaces the transformer with a stand-in whose forward pass costs a fixed overhead plus
+a per-sentence cost and runs one pass at a time, for machines without the model downloaded. It
+serializes the direct path completely, where the real model's concurrent passes can overlap (torch
+releases the GIL), so its speedups are an upper bound; quote real-model runs for the actual effect.
+"""
+import argparse
+import itertools
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from apiSettings import ApiSettings  # noqa: E402
+from embeddings import MODEL_NAME, MicroBatcher  # noqa: E402
+
+settings = ApiSettings()
+
+TOPICS = ["sci fi", "fantasy for teens", "cozy mysteries", "space opera", "historical fiction about rome",
+          "books like dune", "graphic novels", "spanish poetry", "true crime", "classic russian literature",
+          "dragons and magic schools", "hard science fiction", "romance set in paris", "ww2 memoirs"]
+
+
+class SimulatedModel:
+    """Forward pass = overhead_ms + per_item_ms * batch size, one pass at a time"""
+
+    def __init__(self, overhead_ms=8.0, per_item_ms=0.6, dim=384):
+        self.overhead = overhead_ms / 1000
+        self.per_item = per_item_ms / 1000
+        self.dim = dim
+        self._core = threading.Lock()
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, convert_to_tensor=False, **kwargs):
+        single = isinstance(texts, str)
+        n = 1 if single else len(texts)
+        with self._core:
+            time.sleep(self.overhead + self.per_item * n)
+        vectors = np.zeros((n, self.dim), dtype=np.float32)
+        return vectors[0] if single else vectors
+
+
+def run(encoder, concurrency, duration):
+    counter = itertools.count()
+    latencies = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client():
+        local = []
+        while time.monotonic() < stop_at:
+            # distinct text per call so nothing could be served from a cache
+            query = f"{TOPICS[next(counter) % len(TOPICS)]} {next(counter)}"
+            start = time.perf_counter()
+            encoder.encode(query, convert_to_tensor=False)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+
+    latencies = np.array(latencies) * 1000
+    return len(latencies) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--max-batch', type=int, default=settings.embedding_max_batch)
+    parser.add_argument('--max-wait-ms', type=float, default=settings.embedding_max_wait_ms)
+    parser.add_argument('--simulate', action='store_true')
+    args = parser.parse_args()
+
+    if args.simulate:
+        model = SimulatedModel()
+    else:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(MODEL_NAME)
+        model.encode("warmup")
+
+    batcher = MicroBatcher(model, args.max_batch, args.max_wait_ms)
+
+    print(f"{'clients':>7} {'mode':>9} {'QPS':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for concurrency in args.concurrency:
+        for mode, encoder in (('direct', model), ('batched', batcher)):
+            qps, p50, p99 = run(encoder, concurrency, args.duration)
+            print(f"{concurrency:7d} {mode:>9} {qps:9.1f} {p50:9.2f} {p99:9.2f}")
+    print(f"batcher: {batcher.stats()}")
+
+
+if __name__ == '__main__':
+    main()
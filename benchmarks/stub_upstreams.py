@@ -0,0 +1,432 @@
+"""
+Local stand-ins for the upstream services, for testing and load tests without network access.
+OpenAIStub answers POST /v1/chat/completions like the OpenAI API, streaming (SSE, one small
+delta every --token-ms) or not, with a JSON array of books drawn from BOOKS.
+OpenLibraryStub answers /search.json (title/author, the OR'ed batch query, or a keyword query whose
+--limit results repeat some works as other editions) and /works/<id>.json,
+KclsStub answers /v2/search with a BiblioCommons-like page holding the requested title; both
+after --latency-ms. HashingModel stands in for the sentence-transformers model.
+
+    python benchmarks/stub_upstreams.py [--port 8081] [--token-ms 15] [--latency-ms 150] [--truncate-after 0]
+    OPENAI_BASE_URL=http://127.0.0.1:8081/v1 OPENAI_API_KEY=stub \
+    BOOKQUEST_OPENLIBRARY_URL=http://127.0.0.1:8082 BOOKQUEST_KCLS_URL=http://127.0.0.1:8083 python backend_response.py
+
+--truncate-after N cuts the completion off after N characters, to exercise truncated arrays;
+--unique-books gives every distinct prompt its own titles, so nothing is served from caches.
+
+With --fixtures DIR, requests that were recorded into DIR/{openai,openlibrary,kcls}.jsonl are
+answered with the recorded response (after the same injected latency; completions are streamed
+at --token-ms), and only the others are made up. --record fills those files: requests missing
+from them are forwarded to the live services (OPENAI_API_KEY must hold a real key) and their
+responses appended, so pointing a backend at the stubs and replaying the query corpus records it.
+--record-offline records from a second, made-up set of stubs instead, to build fixtures without a key.
+fixtures/upstreams holds a small checked-in set: the first 20 corpus queries run through the three
+backends, recorded offline, with the KCLS pages for Dune and The Lightning Thief pointing at the
+pages in fixtures/kcls and the other KCLS pages stored without the stub's filler chrome. Its OpenAI
+and Open Library bodies are the stubs' own made-up answers; re-record with --record and a real key
+for live ones.
+"""
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+import sys
+import threading
+import time
+import types
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, parse_qs, urlencode, urlsplit
+
+import numpy as np
+
+BOOKS = [
+    {"title": "Dune", "author": "Frank Herbert", "media_type": "book"},
+    {"title": "Hyperion", "author": "Dan Simmons", "media_type": "book"},
+    {"title": "The Left Hand of Darkness", "author": "Ursula K. Le Guin", "media_type": "book"},
+    {"title": "Foundation", "author": "Isaac Asimov", "media_type": "book"},
+    {"title": "The Lightning Thief", "author": "Rick Riordan", "media_type": "ebook"},
+    {"title": "Project Hail Mary", "author": "Andy Weir", "media_type": "audiobook"},
+    {"title": "Neuromancer", "author": "William Gibson", "media_type": "book"},
+]
+
+
+LIVE_URLS = {
+    'openai': 'https://api.openai.com/v1',
+    'openlibrary': 'https://openlibrary.org',
+    'kcls': 'https://kcls.bibliocommons.com',
+}
+
+
+class Recordings:
+    """Recorded upstream responses, one JSON object per line of a .jsonl file:
+    {"key", "status", "content_type", "body"}, or "body_file" (relative to the .jsonl) instead of
+    "body" for large pages kept as files; responses recorded later are appended to it"""
+
+    def __init__(self, path):
+        self.path = path
+        self.responses = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        response = json.loads(line)
+                        if 'body_file' in response:
+                            with open(os.path.join(os.path.dirname(path), response['body_file']), encoding='utf-8') as body:
+                                response['body'] = body.read()
+                        self.responses[response['key']] = response
+
+    def __len__(self):
+        return len(self.responses)
+
+    def get(self, key):
+        return self.responses.get(key)
+
+    def add(self, key, status, content_type, body):
+        response = {'key': key, 'status': status, 'content_type': content_type, 'body': body}
+        with self.lock:
+            self.responses[key] = response
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(response) + '\n')
+        return response
+
+
+def request_key(path):
+    """Recording key of a GET request: its path with the query parameters sorted"""
+    url = urlsplit(path)
+    return f"{url.path}?{urlencode(sorted(parse_qsl(url.query, keep_blank_values=True)))}"
+
+
+def fetch_live(url, data=None, headers=None, timeout=60):
+    """(status, content type, body text) of a request to a live service"""
+    request = urllib.request.Request(url, data=data, headers={'User-Agent': 'BookQuest/1.0', **(headers or {})})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.headers.get('Content-Type', ''), response.read().decode('utf-8', 'replace')
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers.get('Content-Type', ''), e.read().decode('utf-8', 'replace')
+
+
+def completion_text(num_books=5, variant=''):
+    """The completion the model would send: a pretty-printed JSON array, like gpt-4.1 tends to.
+    A variant is appended to every title, so distinct prompts can get distinct (uncached) books."""
+    books = [dict(book, title=f"{book['title']} {variant}".strip()) for book in BOOKS[:num_books]]
+    return json.dumps(books, indent=2)
+
+
+def tokens(text, size=4):
+    """Split text into small deltas, roughly the size of real tokens"""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class OpenAIStub(BaseHTTPRequestHandler):
+    token_delay = 0.015     # seconds between streamed deltas
+    truncate_after = 0      # cut the completion off after this many characters (0 = never)
+    num_books = 5
+    unique_books = False    # distinct titles per prompt, so load tests are not served from caches
+    recordings = None   # Recordings of completions, replayed for the same model and messages
+    record_from = None  # live API base URL that recordings are filled from
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def recorded_text(self, body):
+        """The recorded completion for this model and messages (recorded now when record_from is set), or None"""
+        if self.recordings is None:
+            return None
+        key = hashlib.md5(json.dumps([body.get('model'), body.get('messages')], sort_keys=True).encode()).hexdigest()
+        response = self.recordings.get(key)
+        if response is None and self.record_from:
+            live = {name: value for name, value in body.items() if name not in ('stream', 'stream_options')}
+            status, content_type, text = fetch_live(
+                f"{self.record_from}/chat/completions", json.dumps(live).encode(),
+                {'Content-Type': 'application/json', 'Authorization': f"Bearer {os.getenv('OPENAI_API_KEY', '')}"})
+            if status != 200:
+                return None
+            response = self.recordings.add(key, status, 'text/plain',
+                                           json.loads(text)['choices'][0]['message']['content'])
+        return response['body'] if response else None
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        variant = ''
+        if self.unique_books:
+            prompt = body.get('messages', [{}])[-1].get('content', '')
+            variant = hashlib.md5(prompt.encode()).hexdigest()[:8]
+        text = self.recorded_text(body)
+        if text is None:
+            text = completion_text(self.num_books, variant)
+        if self.truncate_after:
+            text = text[:self.truncate_after]
+
+        if body.get('stream'):
+            self.stream(body, text)
+        else:
+            time.sleep(self.token_delay * len(tokens(text)))
+            self.send_json({
+                'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': int(time.time()),
+                'model': body.get('model', 'stub'),
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': text}}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(tokens(text)), 'total_tokens': 0},
+            })
+
+    def stream(self, body, text):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        def event(delta, finish_reason=None):
+            chunk = {'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': body.get('model', 'stub'),
+                     'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        try:
+            event({'role': 'assistant', 'content': ''})
+            for token in tokens(text):
+                time.sleep(self.token_delay)
+                event({'content': token})
+            event({}, 'length' if self.truncate_after else 'stop')
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def work_key(title):
+    return f"/works/OL{int(hashlib.md5(title.lower().encode()).hexdigest()[:6], 16)}W"
+
+
+class UpstreamStub(BaseHTTPRequestHandler):
+    latency = 0.15  # seconds before each response
+    recordings = None   # Recordings of responses, replayed for the same path and query
+    record_from = None  # live base URL that recordings are filled from
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def replay(self):
+        """Send the recorded response to this GET (recording it first when record_from is set);
+        False when there is none, for the stub to make one up"""
+        if self.recordings is None:
+            return False
+        key = request_key(self.path)
+        response = self.recordings.get(key)
+        if response is None and self.record_from:
+            response = self.recordings.add(key, *fetch_live(self.record_from + self.path))
+        if response is None:
+            return False
+        time.sleep(self.latency)
+        self.send_body(response['body'], response['content_type'], response['status'])
+        return True
+
+    def send_body(self, data, content_type, status=200):
+        data = data.encode() if isinstance(data, str) else data
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class OpenLibraryStub(UpstreamStub):
+    _pair = re.compile(r'title:"([^"]*)" AND author:"([^"]*)"')
+
+    @staticmethod
+    def doc(title, author):
+        seed = int(hashlib.md5(title.lower().encode()).hexdigest()[:8], 16)
+        return {'key': work_key(title), 'title': title, 'author_name': [author],
+                'first_publish_year': 1950 + seed % 70, 'number_of_pages_median': 200 + seed % 400,
+                'ratings_average': round(3 + (seed % 200) / 100, 2), 'ratings_count': seed % 5000,
+                'cover_i': seed % 10000000}
+
+    def keyword_docs(self, q, limit):
+        """limit results for a keyword search, a third of them other editions of earlier works
+        (the same work key, or the same title and author under another key)"""
+        docs = []
+        for i in range(limit):
+            if i % 3 == 2:
+                doc = dict(docs[i // 3])
+                if i % 2:
+                    doc['key'] = f"{doc['key'][:-1]}{i}W"
+            else:
+                doc = self.doc(f"{q.title()} Volume {i + 1}", f"Author {i % 7}")
+                doc['subject'] = [word.title() for word in q.split()] + ['Fiction', f"Theme {i % 5}"]
+            docs.append(doc)
+        return docs
+
+    def do_GET(self):
+        if self.replay():
+            return
+        time.sleep(self.latency)
+        url = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == '/search.json':
+            if 'q' in query:
+                pairs = self._pair.findall(query['q'])
+                if not pairs:
+                    docs = self.keyword_docs(query['q'], int(query.get('limit', 100)))
+                    self.send_body(json.dumps({'numFound': len(docs), 'docs': docs}), 'application/json')
+                    return
+            else:
+                pairs = [(query.get('title', ''), query.get('author', ''))]
+            self.send_body(json.dumps({'docs': [self.doc(title, author) for title, author in pairs if title]}),
+                           'application/json')
+        elif url.path.startswith('/works/'):
+            self.send_body(json.dumps({'key': url.path[:-len('.json')],
+                                       'description': {'type': '/type/text', 'value': 'A stub description. ' * 20}}),
+                           'application/json')
+        else:
+            self.send_body('{}', 'application/json', 404)
+
+
+KCLS_RESULT = """
+<li class="row cp-search-result-item"><div class="col-xs-12 cp-search-result-item-content">
+  <h2 class="cp-title"><a class="title-link" href="/v2/record/{record}"><span class="title-content">{title}</span></a></h2>
+  <div class="cp-manifestation-list"><div class="manifestation-item cp-manifestation-list-item row">
+    <div class="manifestation-item-format-info-wrap"><a class="manifestation-item-link" href="/v2/record/{record}">Book</a></div>
+    <div class="manifestation-item-availability-block-wrap"><div class="cp-availability-status-block">
+      <span class="cp-availability-status">{status}</span></div></div>
+  </div></div>
+</div></li>"""
+
+
+class KclsStub(UpstreamStub):
+    _title = re.compile(r'title:\(([^)]*)\)')
+    padding = 20000     # bytes of page chrome before the results, like the real pages' headers and scripts
+
+    def do_GET(self):
+        if self.replay():
+            return
+        time.sleep(self.latency)
+        query = parse_qs(urlsplit(self.path).query).get('query', [''])[0]
+        match = self._title.search(query)
+        title = match.group(1).title() if match else ''
+        record = work_key(title)[len('/works/'):]
+        status = 'Available' if len(title) % 2 else 'All copies in use'
+        chrome = '<nav>' + '<a class="cp-nav-link" href="/v2/x">Link</a>' * (self.padding // 45) + '</nav>'
+        results = KCLS_RESULT.format(record=record, title=html.escape(title), status=status) if title else ''
+        self.send_body(f'<html><head><title>Search</title></head><body>{chrome}'
+                       f'<ul class="results">{results}</ul></body></html>', 'text/html; charset=utf-8')
+
+
+class HashingModel:
+    """Normalized bag-of-words vectors from hashed words, standing in for the sentence transformer"""
+    dim = 256
+
+    def vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest()[:8], 16) % self.dim] += 1
+        return vector / (np.linalg.norm(vector) or 1)
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self.vector(texts)
+        return np.array([self.vector(text) for text in texts])
+
+
+def install_hashing_model():
+    """Make sentence_transformers.SentenceTransformer load a HashingModel, so the backends start
+    without the model weights (call before importing them)"""
+    module = types.ModuleType('sentence_transformers')
+    module.SentenceTransformer = lambda name, **kwargs: HashingModel()
+    sys.modules['sentence_transformers'] = module
+
+
+def serve(handler, port=0, **attributes):
+    """Start handler (with the given class attributes overridden) on a daemon thread; returns the server"""
+    handler = type(handler.__name__, (handler,), attributes)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_all(port=0, token_ms=15, latency_ms=150, fixtures=None, record=False, live_urls=None,
+              **openai_attributes):
+    """OpenAI, Open Library and KCLS stubs on port, port + 1 and port + 2 (or any free ports for 0),
+    replaying (and with record, recording from live_urls, by default the live services) the
+    responses in the fixtures directory"""
+    live_urls = live_urls or LIVE_URLS
+
+    def replay(name):
+        if not fixtures:
+            return {}
+        os.makedirs(fixtures, exist_ok=True)
+        return {'recordings': Recordings(os.path.join(fixtures, f"{name}.jsonl")),
+                'record_from': live_urls[name] if record else None}
+
+    return {
+        'openai': serve(OpenAIStub, port, token_delay=token_ms / 1000, **replay('openai'), **openai_attributes),
+        'openlibrary': serve(OpenLibraryStub, port + 1 if port else 0, latency=latency_ms / 1000,
+                             **replay('openlibrary')),
+        'kcls': serve(KclsStub, port + 2 if port else 0, latency=latency_ms / 1000, **replay('kcls')),
+    }
+
+
+def stub_environment(servers):
+    """Environment variables pointing the backends at the stubs"""
+    return {
+        'OPENAI_BASE_URL': f"http://127.0.0.1:{servers['openai'].server_port}/v1",
+        'OPENAI_API_KEY': 'stub',
+        'BOOKQUEST_OPENLIBRARY_URL': f"http://127.0.0.1:{servers['openlibrary'].server_port}",
+        'BOOKQUEST_KCLS_URL': f"http://127.0.0.1:{servers['kcls'].server_port}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--token-ms', type=float, default=15)
+    parser.add_argument('--num-books', type=int, default=5)
+    parser.add_argument('--truncate-after', type=int, default=0)
+    parser.add_argument('--latency-ms', type=float, default=150)
+    parser.add_argument('--unique-books', action='store_true', help="distinct titles per prompt (no cache hits)")
+    parser.add_argument('--fixtures', help="directory of recorded responses to replay")
+    parser.add_argument('--record', action='store_true', help="record responses missing from --fixtures from the live services")
+    parser.add_argument('--record-offline', action='store_true',
+                        help="record from a second set of stubs instead (made-up responses, no network or API key)")
+    args = parser.parse_args()
+
+    live_urls = None
+    if args.record_offline:
+        sources = start_all(token_ms=0, latency_ms=0, num_books=args.num_books)
+        live_urls = {'openai': f"http://127.0.0.1:{sources['openai'].server_port}/v1",
+                     **{name: f"http://127.0.0.1:{sources[name].server_port}" for name in ('openlibrary', 'kcls')}}
+    servers = start_all(args.port, args.token_ms, args.latency_ms, args.fixtures, args.record or args.record_offline,
+                        live_urls, num_books=args.num_books, truncate_after=args.truncate_after,
+                        unique_books=args.unique_books)
+    for name, server in servers.items():
+        recordings = server.RequestHandlerClass.recordings
+        print(f"{name} stub on http://127.0.0.1:{server.server_port}"
+              + (f", {len(recordings)} recorded responses" if recordings is not None else ''))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for server in servers.values():
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
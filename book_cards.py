@@ -0,0 +1,100 @@
+"""
+Book card rendering for the chat backends.
+The card fragment (book_template.html) is read and its fields checked once; str.format then fills
+it in C. Every field is HTML-escaped. Rendered cards are kept in an LRU keyed by book identity
+(work key, title, author, media type) plus its KCLS availability and link, and the shown Open Library
+fields (the description by its hash), so books recommended in many chats are rendered once,
+and a response is one join over its cards.
+"""
+import html
+import os
+import string
+
+from apiSettings import ApiSettings
+from cache import MISSING, LRUCache
+
+settings = ApiSettings()
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book_template.html')
+
+CARD_FIELDS = frozenset(('cover_img', 'title', 'author', 'year', 'rating', 'description', 'link',
+                         'media_type', 'availability', 'availability_text'))
+
+
+def format_rating(average, count):
+    if average == 'Not rated':
+        return "Not rated"
+
+    rating = float(average)
+    full_stars = round(rating)  # Recommended: rounding for fairness
+    empty_stars = 5 - full_stars
+
+    return (
+        f"{'★' * full_stars}{'☆' * empty_stars} "
+        f"{rating:.1f}/5 ({int(count):,} ratings)"
+    )
+
+def get_availability_text(availability):
+    if availability:
+        return "Available"
+    return "All copies in use"
+
+
+def card_key(book):
+    """Book identity and availability, plus the Open Library fields a card shows (they can differ for
+    the same work, e.g. a fallback description after a failed fetch), so a cached card is always exact.
+    The description is keyed by its 64-bit hash, so the cache does not hold every description twice."""
+    description = hash(book['description'] or '')
+    return (book.get('key'), book['title'], book['author'], book['media_type'], book['availability'],
+            book['link'], book['year'], book['ratings_average'], book['ratings_count'], book['cover_id'],
+            description)
+
+
+def card_fields(book):
+    """The template fields of book, escaped"""
+    cover_img = ""
+    if book['cover_id']:
+        cover_img = (f"<img src='https://covers.openlibrary.org/b/id/{html.escape(str(book['cover_id']))}-M.jpg' "
+                     f"class='book-cover'>")
+
+    escape = html.escape
+    return {
+        'cover_img': cover_img,
+        'title': escape(str(book['title'])),
+        'author': escape(str(book['author'])),
+        'year': escape(str(book['year'])),
+        'rating': escape(format_rating(book['ratings_average'], book['ratings_count'])),
+        'description': escape(str(book['description'] or '')),
+        'link': escape(str(book['link'])),
+        'media_type': escape(str(book['media_type'])),
+        'availability': escape(str(book['availability'])),
+        'availability_text': get_availability_text(book['availability']),
+    }
+
+
+class CardRenderer:
+    def __init__(self, template_path=TEMPLATE_PATH, cache_size=2000, cache_ttl=None):
+        with open(template_path, 'r', encoding='utf-8') as f:
+            self.template = f.read()
+
+        fields = {name for _, name, _, _ in string.Formatter().parse(self.template) if name}
+        if fields != CARD_FIELDS:
+            raise ValueError(f"{template_path} fields {sorted(fields)} do not match {sorted(CARD_FIELDS)}")
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def render(self, book):
+        key = card_key(book)
+        card = self.cache.get(key)
+        if card is MISSING:
+            card = self.template.format_map(card_fields(book))
+            self.cache.set(key, card)
+        return card
+
+    def render_all(self, books):
+        return ''.join([self.render(book) for book in books])
+
+    def stats(self):
+        return self.cache.stats()
+
+
+card_renderer = CardRenderer(cache_size=settings.card_cache_size, cache_ttl=settings.card_cache_ttl)
@@ -0,0 +1,78 @@
+"""
+Incremental parser for the LLM's JSON array of books.
+BookArrayParser is fed the completion text as it streams in and returns each top-level object
+as soon as its closing brace arrives, so enrichment can start while the model is still generating.
+It only tracks brace depth and strings, so code fences or chatter around the array are ignored,
+an object that fails to parse is skipped, and a truncated array keeps every complete book before it.
+"""
+import json
+
+
+class BookArrayParser:
+    def __init__(self):
+        self.depth = 0          # brace depth, 0 = between objects
+        self.in_string = False
+        self.escaped = False
+        self.current = []       # text of the object being read
+        self.parsed = 0
+        self.errors = 0
+
+    def feed(self, text):
+        """Books (dicts) completed by this piece of text"""
+        books = []
+        start = 0 if self.depth else None
+        for i, char in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = self.depth > 0
+            elif char == '{':
+                if self.depth == 0:
+                    start = i
+                self.depth += 1
+            elif char == '}' and self.depth:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.current.append(text[start:i + 1])
+                    start = None
+                    book = self._finish()
+                    if book is not None:
+                        books.append(book)
+
+        if start is not None:
+            self.current.append(text[start:])
+        return books
+
+    def _finish(self):
+        raw = ''.join(self.current)
+        self.current = []
+        try:
+            book = json.loads(raw)
+        except ValueError:
+            self.errors += 1
+            return None
+        if not isinstance(book, dict):
+            self.errors += 1
+            return None
+        self.parsed += 1
+        return book
+
+    @property
+    def truncated(self):
+        """True if the text ended inside an object"""
+        return self.depth > 0
+
+    def close(self):
+        """Drop an unfinished object; returns True if there was one"""
+        truncated = self.truncated
+        if truncated:
+            self.errors += 1
+        self.depth = 0
+        self.in_string = self.escaped = False
+        self.current = []
+        return truncated
@@ -0,0 +1,427 @@
+"""
+Small caching building blocks shared by the backends.
+LRUCache is a thread-safe in-process LRU with per-entry TTL, SQLiteCache is an on-disk key/value
+tier with TTL (values stored as JSON), and TieredCache puts the former in front of the latter.
+CoalescingCache adds stale-while-revalidate and lets concurrent callers share one in-flight load;
+AsyncCoalescingCache does the same for coroutines. SemanticCache matches texts by embedding
+similarity instead of equality.
+Every cache counts hits and misses so the hit ratio can be reported.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+MISSING = object()  # sentinel for "not cached", so None/'' can be cached as negative results
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with an optional default TTL (seconds)"""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at or None, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[0] is not None and entry[0] <= time.time()):
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SQLiteCache:
+    """On-disk key/value cache with TTL; one table per cache inside a shared SQLite file"""
+
+    def __init__(self, path, table, ttl=None):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                f"(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def get(self, key, default=MISSING):
+        value, _ = self.get_entry(key, default)
+        return value
+
+    def get_entry(self, key, default=MISSING):
+        """(value, expires_at or None); (default, None) when missing or expired"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= time.time()):
+                if row is not None:
+                    with self._conn:
+                        self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.misses += 1
+                return default, None
+            self.hits += 1
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+
+    def purge_expired(self):
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                               (time.time(),))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class TieredCache:
+    """In-process LRU in front of an on-disk tier; disk hits are promoted into memory for what is
+    left of their disk TTL (at most the memory tier's), so short-lived negative entries stay short"""
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=MISSING):
+        value = self.memory.get(key)
+        if value is not MISSING or self.disk is None:
+            return default if value is MISSING else value
+
+        value, expires_at = self.disk.get_entry(key)
+        if value is MISSING:
+            return default
+        ttl = None
+        if expires_at is not None:
+            ttl = max(expires_at - time.time(), 0.001)
+            if self.memory.ttl:
+                ttl = min(ttl, self.memory.ttl)
+        self.memory.set(key, value, ttl=ttl)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.memory.set(key, value, ttl=ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl=ttl)
+
+    def stats(self):
+        memory = self.memory.stats()
+        disk = self.disk.stats() if self.disk is not None else {'hits': 0, 'misses': memory['misses']}
+        lookups = memory['hits'] + memory['misses']
+        return {
+            'memory_hits': memory['hits'],
+            'disk_hits': disk['hits'],
+            'misses': disk['misses'],
+            'hit_ratio': (memory['hits'] + disk['hits']) / lookups if lookups else 0.0,
+            'memory_size': memory['size'],
+        }
+
+
+class CoalescingCache:
+    """In-process LRU with TTL, stale-while-revalidate and request coalescing.
+    Within ttl an entry is a hit; for stale_ttl seconds after that it is still served while one
+    background load refreshes it. Concurrent misses for the same key wait on a single load.
+    loader is called with a timeout: the missing caller's own, or refresh_timeout for background
+    refreshes. A loader returning None means "failed": it is handed back to the callers but not
+    cached; a caller that waits on another's load past its own timeout gets None as well."""
+
+    def __init__(self, maxsize=1024, ttl=60, stale_ttl=0, refresh_timeout=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_timeout = refresh_timeout
+        self._data = OrderedDict()  # key -> (stored_at, value)
+        self._inflight = {}     # key -> Future of the running load
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_serves = 0
+        self.coalesced = 0
+        self.refreshes = 0
+
+    def get_or_load(self, key, loader, timeout=None):
+        with self._lock:
+            entry, age = self._lookup(key)
+            if entry and age < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if entry and age < self.ttl + self.stale_ttl:
+                self._data.move_to_end(key)
+                self.stale_serves += 1
+                if key not in self._inflight:
+                    self.refreshes += 1
+                    future = self._inflight[key] = Future()
+                    threading.Thread(target=self._load, args=(key, loader, future, self.refresh_timeout),
+                                     daemon=True).start()
+                return entry[1]
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                is_leader = False
+            else:
+                self.misses += 1
+                future = self._inflight[key] = Future()
+                is_leader = True
+
+        if is_leader:
+            self._load(key, loader, future, timeout)
+            return future.result()
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return None
+
+    def _load(self, key, loader, future, timeout):
+        try:
+            value = loader(timeout)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            self._store(key, value)
+            self._inflight.pop(key, None)
+        future.set_result(value)
+
+    def _lookup(self, key):
+        """(entry, age) of key, or (None, None)"""
+        entry = self._data.get(key)
+        return entry, (time.time() - entry[0] if entry else None)
+
+    def _store(self, key, value):
+        if value is not None:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.stale_serves + self.misses + self.coalesced
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'stale_serves': self.stale_serves,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'refreshes': self.refreshes,
+            'hit_ratio': (self.hits + self.stale_serves) / lookups if lookups else 0.0,
+        }
+
+
+class AsyncCoalescingCache(CoalescingCache):
+    """CoalescingCache for asyncio: loader is a coroutine function and loads run as tasks on the
+    event loop. Waiters are shielded, so one caller timing out does not cancel the shared load."""
+
+    async def get_or_load(self, key, loader, timeout=None):
+        entry, age = self._lookup(key)
+        if entry and age < self.ttl:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        if entry and age < self.ttl + self.stale_ttl:
+            self._data.move_to_end(key)
+            self.stale_serves += 1
+            if key not in self._inflight:
+                self.refreshes += 1
+                self._inflight[key] = asyncio.ensure_future(self._load_async(key, loader, self.refresh_timeout))
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), timeout)
+            except asyncio.TimeoutError:
+                return None
+        self.misses += 1
+        task = self._inflight[key] = asyncio.ensure_future(self._load_async(key, loader, timeout))
+        return await asyncio.shield(task)
+
+    async def _load_async(self, key, loader, timeout):
+        try:
+            value = await loader(timeout)
+        finally:
+            self._inflight.pop(key, None)
+        self._store(key, value)
+        return value
+
+
+class SemanticCache:
+    """
+    LRU cache with TTL whose lookups match by meaning: get(text) returns the value stored for the most
+    similar earlier text if their embeddings are at least threshold cosine-similar. Entries only match
+    within the same context (whatever else decides the value): slots are filtered by hash(context),
+    and the best one's stored context must also be equal. Repeats of a stored
+    text need no embedding. encoder maps a text to a vector; get and set of one text both encode it,
+    so it should cache (embeddings.QueryEmbeddingCache.encode). Until it is set every get misses.
+    """
+
+    def __init__(self, encoder=None, threshold=0.9, maxsize=1000, ttl=None):
+        self.encoder = encoder
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # slot -> (context, text, expires_at or None, value), LRU first
+        self._exact = {}    # (context, text) -> slot
+        self._vectors = None    # (maxsize, dim) unit rows, allocated by the first set
+        self._contexts = np.zeros(maxsize, dtype=np.int64)  # hash(context) per slot
+        self._live = np.zeros(maxsize, dtype=bool)
+        self._free = list(range(maxsize - 1, -1, -1))
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _embed(self, text):
+        vector = np.asarray(self.encoder(text), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _drop(self, slot):
+        context, text, _, _ = self._entries.pop(slot)
+        del self._exact[(context, text)]
+        self._live[slot] = False
+        self._free.append(slot)
+
+    def _hit(self, slot):
+        entry = self._entries[slot]
+        if entry[2] is not None and entry[2] <= time.time():
+            self._drop(slot)
+            return MISSING
+        self._entries.move_to_end(slot)
+        self.hits += 1
+        return entry[3]
+
+    def get(self, text, context='', default=MISSING):
+        with self._lock:
+            slot = self._exact.get((context, text))
+            if slot is not None:
+                value = self._hit(slot)
+                if value is not MISSING:
+                    self.exact_hits += 1
+                    return value
+            if self.encoder is None or not self._entries:
+                self.misses += 1
+                return default
+
+        vector = self._embed(text)
+        with self._lock:
+            similarity = self._vectors @ vector
+            similarity[~self._live | (self._contexts != hash(context))] = -np.inf
+            slot = int(np.argmax(similarity))
+            matched = similarity[slot] >= self.threshold and self._entries[slot][0] == context
+            value = self._hit(slot) if matched else MISSING
+            if value is MISSING:
+                self.misses += 1
+                return default
+            return value
+
+    def set(self, text, value, context='', ttl=None):
+        if self.encoder is None:
+            return
+        vector = self._embed(text)
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.maxsize, len(vector)), dtype=np.float32)
+            slot = self._exact.get((context, text))
+            if slot is None:
+                if not self._free:
+                    self._drop(next(iter(self._entries)))
+                    self.evictions += 1
+                slot = self._free.pop()
+            self._vectors[slot] = vector
+            self._contexts[slot] = hash(context)
+            self._live[slot] = True
+            self._entries[slot] = (context, text, expires_at, value)
+            self._entries.move_to_end(slot)
+            self._exact[(context, text)] = slot
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'exact_hits': self.exact_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
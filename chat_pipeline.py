@@ -0,0 +1,140 @@
+"""
+The parts of the /chat pipeline shared by backend_response (Flask, threads) and async_backend
+(Quart, asyncio): session history, prompts and their response cache key, book card fields and
+rendering, and the embedding model behind the response cache. Importing it starts no app, pool or
+model load, so each backend only pays for its own.
+"""
+import json
+import os
+import re
+import time
+import uuid
+
+import aiTest
+import metrics
+from apiSettings import ApiSettings
+from book_cards import card_renderer
+from embeddings import MicroBatcher, QueryEmbeddingCache, normalize_query
+from query_parser import QueryParser
+from session_store import SessionStore, SQLiteSessionBackend
+
+settings = ApiSettings()
+
+# Bounded messages store: { session_id: [ {role, content}, ... ] }, optionally persisted to SQLite
+messages_store = SessionStore(
+    max_messages=settings.session_max_messages,
+    max_sessions=settings.session_max_sessions,
+    idle_ttl=settings.session_idle_ttl,
+    memory_budget=settings.session_memory_budget,
+    backend=SQLiteSessionBackend(os.path.join(settings.cache_dir, 'sessions.sqlite3'))
+    if settings.session_backend == 'sqlite' else None,
+)
+
+# Language and year filter of a message, for the response cache key
+query_parser = QueryParser.from_settings(settings)
+
+
+def generate_description(doc):
+    """Generate fallback description"""
+    desc = f"{doc.get('title')}. "
+    if doc.get('author_name'):
+        desc += f"Written by {', '.join(doc['author_name'])}. "
+    if doc.get('subject'):
+        desc += f"Subjects: {', '.join(doc['subject'][:5])}."
+    return desc
+
+
+def format_books_info(books):
+    """The book cards of books, rendered by book_cards.card_renderer"""
+    return card_renderer.render_all(books)
+
+
+def stage_timeout(deadline):
+    """Timeout for the next stage: the per-stage limit, capped by what is left of the deadline"""
+    return max(0.1, min(settings.enrich_stage_timeout, deadline - time.monotonic()))
+
+
+def session_id_of(data):
+    """The request's session_id, or a new one (returned with the answer) when it has none, so clients
+    that send none each get their own history instead of sharing one"""
+    return str(data.get('session_id') or uuid.uuid4().hex)
+
+
+def wants_full_history(data):
+    """The request's full_history flag as a bool, settings.return_full_history when absent;
+    JSON strings count like the environment flags do ("0", "false", "no", "off" are off)"""
+    value = data.get('full_history', settings.return_full_history)
+    if isinstance(value, str):
+        return value.strip().lower() not in ('', '0', 'false', 'no', 'off')
+    return bool(value)
+
+
+def apply_ol_doc(book, ol_doc, description=''):
+    """Copy the Open Library fields used by the book card onto book"""
+    book['key'] = ol_doc.get('key')
+    book['cover_id'] = ol_doc.get('cover_i')
+    book['ratings_average'] = ol_doc.get('ratings_average', 0)
+    book['ratings_count'] = ol_doc.get('ratings_count', 0)
+    book['description'] = description or generate_description({**ol_doc, 'title': ol_doc.get('title') or book['title']})
+    book['year'] = str(ol_doc.get('first_publish_year', 'Unknown')[0] if isinstance(ol_doc.get('first_publish_year'), tuple) else ol_doc.get('first_publish_year', 'Unknown'))
+
+
+def fallback_book(book):
+    """Book card for a lookup that missed the deadline: default_doc values and no availability"""
+    book = dict(book)
+    book['availability'] = False
+    book['exist'] = True
+    book['link'] = aiTest.build_kcls_url(book)
+    apply_ol_doc(book, settings.default_doc)
+    return book
+
+
+def build_prompt(messages):
+    """Composite prompt for aiTest.create_response: the system message and the last two turns"""
+    system_msg = messages[0] if messages and messages[0].get('role') == 'system' else None
+    last_two = messages[-2:]
+    send_parts = []
+    if system_msg:
+        send_parts.append(f"SYSTEM: {system_msg.get('content','')}")
+    for m in last_two:
+        role = m.get('role', 'user').upper()
+        send_parts.append(f"{role}: {m.get('content','')}")
+    return "\n".join(send_parts)
+
+
+AUDIENCE_WORDS = frozenset(settings.AUDIENCE_WORDS)
+
+
+def prompt_cache_key(messages):
+    """
+    (text, context) aiTest.response_cache matches a chat turn on: the normalized user message, and
+    the rest of what the LLM sees (system message, and for a follow-up the previous answer) plus the
+    message's numbers ("5 books" vs "10 books"), language and year filter (QueryParser) and
+    readership words ("for kids" vs "for adults"), which must match exactly. A first turn leaves the
+    session's history out, so it matches the same prompt from any session.
+    """
+    text = normalize_query(messages[-1].get('content', ''))
+    numbers = re.findall(r'\d+', text)
+    parsed = query_parser.parse(text)
+    audience = sorted(AUDIENCE_WORDS.intersection(text.split()))
+    previous = messages[-2:-1] if any(m.get('role') == 'assistant' for m in messages[:-1]) else []
+    return text, json.dumps([messages[:1], previous, numbers, parsed.language, parsed.year_data, audience])
+
+
+def load_prompt_encoder(startup):
+    """Load the sentence-transformers model and return the cached (and batched) query encoder that
+    aiTest.response_cache embeds prompts with; timed as startup's import and model_load phases"""
+    with startup.phase('import'):
+        from sentence_transformers import SentenceTransformer
+
+    with startup.phase('model_load'):
+        model = SentenceTransformer('all-MiniLM-L6-v2')
+
+    # Concurrent requests share batched forward passes for their prompt embeddings
+    encoder = model
+    if settings.embedding_batching:
+        encoder = MicroBatcher(model, settings.embedding_max_batch, settings.embedding_max_wait_ms,
+                               settings.embedding_batch_timeout)
+    query_embeddings = QueryEmbeddingCache(encoder, maxsize=settings.query_cache_size)
+    metrics.watch_cache('query_embedding', query_embeddings)
+    return query_embeddings.encode
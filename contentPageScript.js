@@ -12,6 +12,10 @@ document.addEventListener("DOMContentLoaded", () => {
     const promptContainer = document.querySelector(".promptContainer");
 
     let isFirstMessage = true;
+    /* One chat history per page, so the backend does not mix this user's turns with anyone else's */
+    const sessionId = window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : Date.now().toString(36) + Math.random().toString(36).slice(2);
 
     function autoResize() {
         /* Automatically resizes the input field based on content length */
@@ -19,6 +23,66 @@ document.addEventListener("DOMContentLoaded", () => {
         userInput.style.height = Math.min(userInput.scrollHeight, 150) + 'px';
     }
 
+    const ERROR_TEXT = "Sorry, something went wrong while searching for books. Please try again.";
+
+    function handleStreamEvent(event, aiMessage, booksContainer) {
+        /* Applies one NDJSON line from /chat/stream: the intro text, a book card, an error, or the end of the reply */
+        if (event.type === "intro" || event.type === "error") {
+            aiMessage.textContent = event.message;
+        } else if (event.type === "book") {
+            /* Cards arrive in the order they finish; keep them in the order the books were recommended */
+            const card = document.createElement("div");
+            card.dataset.index = event.index;
+            card.innerHTML = event.html; // Use innerHTML to render HTML content
+            const next = Array.from(booksContainer.children).find(el => Number(el.dataset.index) > event.index);
+            booksContainer.insertBefore(card, next || null);
+        } else if (event.type === "done") {
+            console.log("Response data:", event);
+        }
+        chatLog.scrollTop = chatLog.scrollHeight; // Scroll to the bottom
+    }
+
+    async function readBookStream(response, aiMessage) {
+        /* Reads the newline-delimited JSON body of /chat/stream as it arrives; throws if the request
+           failed or the stream ended without its "done" or "error" line */
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        const booksContainer = document.createElement("div");
+        booksContainer.classList.add("aiMessage");
+        chatLog.appendChild(booksContainer);
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        let ended = false;
+        const apply = line => {
+            const event = JSON.parse(line);
+            ended = ended || event.type === "done" || event.type === "error";
+            handleStreamEvent(event, aiMessage, booksContainer);
+        };
+        while (true) {
+            const { done, value } = await reader.read();
+            buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+            const lines = buffer.split("\n");
+            buffer = lines.pop();
+            for (const line of lines) {
+                if (line.trim()) {
+                    apply(line);
+                }
+            }
+            if (done) {
+                break;
+            }
+        }
+        if (buffer.trim()) {
+            apply(buffer);
+        }
+        if (!ended) {
+            throw new Error("Stream ended early");
+        }
+    }
+
     userInput.addEventListener('input', autoResize);
     autoResize();
 
@@ -54,26 +118,17 @@ document.addEventListener("DOMContentLoaded", () => {
             autoResize();
             chatLog.scrollTop = chatLog.scrollHeight;
 
-            /* Send user input to backend and process response */
-            fetch('http://127.0.0.1:5000/chat', {
+            /* Send user input to backend and render each book card as soon as it is streamed back */
+            fetch('http://127.0.0.1:5000/chat/stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ message: userMessageText })
-            })
-            .then(response => response.json())
-            .then(data => {
-                console.log("Response data:", data);
-                
-                /* Display AI-generated response from the backend */
-                const aiMessage = document.createElement("div");
-                aiMessage.classList.add("aiMessage");
-                aiMessage.innerHTML = data.message; // Use innerHTML to render HTML content
-                chatLog.appendChild(aiMessage);
-                chatLog.scrollTop = chatLog.scrollHeight; // Scroll to the bottom
+                body: JSON.stringify({ message: userMessageText, session_id: sessionId })
             })
+            .then(response => readBookStream(response, aiMessage))
             .catch(error => {
-                /* Log any errors that occur during the fetch request */
+                /* Replace the placeholder so the reply does not hang on "Searching for books..." */
                 console.error('Error:', error);
+                aiMessage.textContent = ERROR_TEXT;
             });
         }
     });
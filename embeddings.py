@@ -0,0 +1,390 @@
+"""
+Persistent sentence embeddings for book descriptions and a top-k vector index over them.
+EmbeddingStore keeps one memory-mapped matrix per model (float32, or int8 with a per-row scale),
+keyed by Open Library work key. Only descriptions it has not seen yet (or whose text changed)
+are encoded, in batches, so a request usually only pays for encoding its query.
+VectorIndex serves cosine top-k over a matrix, exactly (one NumPy matmul) or approximately
+(an inverted-file index over k-means clusters, probing the closest few).
+QueryEmbeddingCache keeps recent query embeddings in an LRU keyed by the normalized query text,
+so repeated queries skip the transformer forward pass. MicroBatcher merges the single-query encodes
+of concurrent requests into one batched forward pass.
+"""
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:     # Windows: a store must have a single writer process
+    fcntl = None
+
+import numpy as np
+
+from apiSettings import ApiSettings
+from cache import MISSING, LRUCache
+
+settings = ApiSettings()
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+
+_punctuation = re.compile(r'[^\w\s]')
+
+
+def normalize_query(message):
+    """Lowercase, punctuation stripped, single-spaced: the normalization parse_query applies"""
+    return ' '.join(_punctuation.sub('', message).lower().split())
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def quantize_rows(vectors):
+    """Symmetric per-row int8 quantization: (int8 rows, float32 scales)"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class EmbeddingStore:
+    """
+    Safe to share between threads and between worker processes using the same directory. Readers
+    use an immutable snapshot (key -> row map plus the memmaps covering those rows), replaced whole
+    after every change. Writers hold an exclusive lock on the .lock file (fcntl; without it, as on
+    Windows, a store must have a single writer process). They first read the keys other processes
+    appended, then take their row numbers from the size of the vector file.
+    """
+
+    def __init__(self, directory, model_name=MODEL_NAME, quantize=False):
+        self.model_name = model_name
+        self.quantize = quantize
+        self.dim = None
+        os.makedirs(directory, exist_ok=True)
+
+        base = os.path.join(directory, model_name.replace('/', '_') + ('.int8' if quantize else '.f32'))
+        self.vectors_path = base + '.bin'
+        self.scales_path = base + '.scales.bin'
+        self.keys_path = base + '.keys.jsonl'
+        self.lock_path = base + '.lock'
+
+        self._lock = threading.Lock()
+        self._snapshot = ({}, None, None)   # (key -> (row, text hash), vectors, scales)
+        self._keys_offset = 0
+        self._keys_inode = None
+        with self._lock, self._file_lock(exclusive=True):
+            self._sync()
+            rows, vectors, _ = self._snapshot
+            if vectors is not None and len(vectors) >= 64 and len(vectors) - len(rows) > len(vectors) // 4:
+                self._compact()
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Read the keys appended since the last sync, by any process, and publish a new snapshot"""
+        try:
+            stat = os.stat(self.keys_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._keys_inode or stat.st_size < self._keys_offset:
+            rows, self._keys_offset, self._keys_inode = {}, 0, stat.st_ino    # new or compacted file
+        elif stat.st_size == self._keys_offset:
+            return
+        else:
+            rows = dict(self._snapshot[0])
+        with open(self.keys_path, 'rb') as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        data = data[:data.rfind(b'\n') + 1]   # a line still being written waits for the next sync
+        for line in data.splitlines():
+            entry = json.loads(line)
+            if 'dim' in entry:
+                self.dim = entry['dim']
+                continue
+            rows[entry['key']] = (entry['row'], entry['hash'])
+        self._keys_offset += len(data)
+        self._publish(rows)
+
+    def _publish(self, rows):
+        count = max((row for row, _ in rows.values()), default=-1) + 1
+        vectors = scales = None
+        if count:
+            dtype = np.int8 if self.quantize else np.float32
+            vectors = np.memmap(self.vectors_path, dtype=dtype, mode='r', shape=(count, self.dim))
+            if self.quantize:
+                scales = np.memmap(self.scales_path, dtype=np.float32, mode='r', shape=(count,))
+        self._snapshot = (rows, vectors, scales)
+
+    def __len__(self):
+        return len(self._snapshot[0])
+
+    def _append(self, keys, hashes, vectors):
+        """Persist vectors for keys; the caller holds self._lock"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._file_lock(exclusive=True):
+            self._sync()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.keys_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'dim': self.dim, 'model': self.model_name}) + '\n')
+
+            # rows a crash left without keys are overwritten; scales are written first, so never lag
+            row_bytes = self.dim * (1 if self.quantize else 4)
+            start = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+            if self.quantize:
+                rows, scales = quantize_rows(vectors)
+                with open(self.scales_path, 'ab') as f:
+                    f.truncate(start * 4)
+                    f.write(scales.tobytes())
+            else:
+                rows = vectors
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(start * row_bytes)
+                f.write(rows.tobytes())
+
+            # keys are written after their vectors, so a crash never leaves a key without a row
+            with open(self.keys_path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps({'key': key, 'row': start + i, 'hash': digest}) + '\n'
+                             for i, (key, digest) in enumerate(zip(keys, hashes)))
+            self._sync()
+
+    def _compact(self):
+        """Rewrite the files with only the current row of each key (changed texts leave their old rows behind)"""
+        rows, vectors, scales = self._snapshot
+        keys = list(rows)
+        old = np.array([rows[key][0] for key in keys], dtype=np.int64)
+        if self.quantize:
+            with open(self.scales_path + '.tmp', 'wb') as f:
+                f.write(np.asarray(scales[old]).tobytes())
+        with open(self.vectors_path + '.tmp', 'wb') as f:
+            f.write(np.asarray(vectors[old]).tobytes())
+        with open(self.keys_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'dim': self.dim, 'model': self.model_name}) + '\n')
+            f.writelines(json.dumps({'key': key, 'row': i, 'hash': rows[key][1]}) + '\n' for i, key in enumerate(keys))
+        if self.quantize:
+            os.replace(self.scales_path + '.tmp', self.scales_path)
+        os.replace(self.vectors_path + '.tmp', self.vectors_path)
+        os.replace(self.keys_path + '.tmp', self.keys_path)
+        self._sync()
+
+    @staticmethod
+    def _missing(rows, keys, hashes):
+        missing = {}
+        for i, (key, digest) in enumerate(zip(keys, hashes)):
+            known = rows.get(key)
+            if known is None or known[1] != digest:
+                missing.setdefault(key, i)
+        return missing
+
+    def rows(self, keys):
+        """float32 vectors for the given keys, from one snapshot"""
+        rows, vectors, scales = self._snapshot
+        if not len(keys):
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        row_ids = [rows[key][0] for key in keys]
+        out = np.asarray(vectors[row_ids], dtype=np.float32)
+        if self.quantize:
+            out *= np.asarray(scales[row_ids])[:, None]
+        return out
+
+    def embed(self, model, items):
+        """
+        Embeddings for (key, text) items as a float32 (n, dim) array, in item order.
+        Items without a key are keyed by their text. Unseen or changed texts are encoded in batches
+        of settings.embedding_batch_size and persisted.
+        """
+        keys, hashes = [], []
+        for key, text in items:
+            digest = text_hash(text)
+            keys.append(key or f"text:{digest}")
+            hashes.append(digest)
+
+        if self._missing(self._snapshot[0], keys, hashes):
+            with self._lock:
+                with self._file_lock(exclusive=False):
+                    self._sync()
+                # another thread or process may have added them meanwhile
+                missing = self._missing(self._snapshot[0], keys, hashes)
+                if missing:
+                    todo = list(missing.items())
+                    vectors = model.encode([items[i][1] for _, i in todo], batch_size=settings.embedding_batch_size,
+                                           convert_to_numpy=True)
+                    self._append([key for key, _ in todo], [hashes[i] for _, i in todo], vectors)
+
+        return self.rows(keys)
+
+
+class VectorIndex:
+    """Cosine top-k over the rows of a matrix, exact or via an inverted-file (IVF) approximation"""
+
+    def __init__(self, vectors, approximate=False, n_lists=None, n_probe=None):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.vectors = vectors / norms
+        self.approximate = approximate and len(vectors) > 256
+        if self.approximate:
+            self.n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+            self.n_probe = n_probe or max(1, self.n_lists // 8)
+            self._build_lists()
+
+    def _build_lists(self, iterations=10):
+        rng = np.random.default_rng(0)
+        centroids = self.vectors[rng.choice(len(self.vectors), self.n_lists, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(self.vectors @ centroids.T, axis=1)
+            for c in range(self.n_lists):
+                members = self.vectors[assignment == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assignment == c) for c in range(self.n_lists)]
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, query, k):
+        """(indices, scores) of the k most similar rows, best first"""
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        if self.approximate:
+            probe = np.argsort(-(self.centroids @ query))[:self.n_probe]
+            candidates = np.concatenate([self.lists[c] for c in probe])
+            scores = self.vectors[candidates] @ query
+        else:
+            candidates = np.arange(len(self.vectors))
+            scores = self.vectors @ query   # no gather: indexing by candidates would copy the whole matrix
+        k = min(k, len(candidates))
+        if k <= 0:
+            return np.array([], dtype=int), np.array([], dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return candidates[top], scores[top]
+
+
+class MicroBatcher:
+    """
+    Batches encode() calls from concurrent threads: the first query waits up to max_wait_ms for
+    others (at most max_batch_size in total), then all of them go through one model.encode call on
+    a single worker thread and each caller gets its own row back. A caller whose batch has not come
+    back within timeout seconds, or that finds the worker dead, encodes its query directly.
+    Has the single-sentence model.encode signature, so it can stand in for the model.
+    """
+
+    def __init__(self, model, max_batch_size=32, max_wait_ms=5, timeout=2.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.encoded = 0
+        self.fallbacks = 0
+        self._worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._worker.start()
+
+    def encode(self, text, convert_to_tensor=False, **kwargs):
+        if self._worker.is_alive():
+            future = Future()
+            self._queue.put((text, future))
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                future.cancel()     # dropped from its batch unless that already started
+        self.fallbacks += 1
+        return self.model.encode(text, convert_to_tensor=convert_to_tensor, **kwargs)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        batch = []
+        try:
+            while True:
+                # callers that timed out and cancelled are left out
+                batch = [(text, future) for text, future in self._collect() if future.set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+                try:
+                    vectors = self.model.encode([text for text, _ in batch], batch_size=len(batch),
+                                                convert_to_numpy=True)
+                except Exception as e:
+                    for _, future in batch:
+                        future.set_exception(e)
+                    continue
+
+                self.batches += 1
+                self.encoded += len(batch)
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+        except BaseException as e:
+            # the worker is dying: fail its batch and everything queued, instead of leaving callers to time out
+            error = RuntimeError("embedding batcher stopped")
+            error.__cause__ = e
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            while True:
+                try:
+                    _, future = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(error)
+            raise
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'encoded': self.encoded,
+            'fallbacks': self.fallbacks,
+            'avg_batch_size': self.encoded / self.batches if self.batches else 0.0,
+        }
+
+
+class QueryEmbeddingCache:
+    """LRU of float32 query embeddings keyed by normalized query text; model may be a MicroBatcher.
+    A miss encodes the query as the user wrote it ("sci-fi", not the key "scifi"), so caching does not
+    change the embedding; queries differing only in case, punctuation or spacing share the first one's."""
+
+    def __init__(self, model, maxsize=4096):
+        self.model = model
+        self.cache = LRUCache(maxsize=maxsize)
+
+    def encode(self, query):
+        key = normalize_query(query)
+        embedding = self.cache.get(key)
+        if embedding is MISSING:
+            embedding = np.asarray(self.model.encode(query, convert_to_tensor=False), dtype=np.float32)
+            embedding.setflags(write=False)     # shared between requests
+            self.cache.set(key, embedding)
+        return embedding
+
+    def stats(self):
+        return self.cache.stats()
@@ -61,4 +61,5 @@ def create_response2(user_msg, max_tokens=500):
     return json.loads(response.choices[0].message.content)
 
 
-print(create_response("Recommend some science fiction books."))
+if __name__ == "__main__":
+    print(create_response("Recommend some science fiction books."))
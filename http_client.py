@@ -0,0 +1,132 @@
+"""
+Shared HTTP client for outbound calls to Open Library and KCLS.
+One pooled requests.Session keeps connections alive per host, applies default connect/read
+timeouts and retries transient 5xx/429 responses with exponential backoff and jitter.
+Per-host counters (requests, errors, retries, latency, reused connections) are exposed by host_stats()
+and as the bookquest_upstream_* metrics.
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+from apiSettings import ApiSettings
+
+settings = ApiSettings()
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_stats_lock = threading.Lock()
+_host_stats = {}
+
+
+def _host_entry(host):
+    entry = _host_stats.get(host)
+    if entry is None:
+        entry = _host_stats[host] = {
+            'requests': 0,
+            'errors': 0,
+            'retries': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+        }
+    return entry
+
+
+class CountingAdapter(HTTPAdapter):
+    """HTTPAdapter that records per-host latency, retries and connection reuse"""
+
+    def send(self, request, **kwargs):
+        host = urlsplit(request.url).hostname or ''
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.RequestException:
+            self._record(host, time.perf_counter() - start, retries=0, error=True)
+            raise
+
+        history = response.raw.retries.history if getattr(response.raw, 'retries', None) else ()
+        self._record(host, time.perf_counter() - start, retries=len(history),
+                     error=response.status_code >= 500)
+        return response
+
+    def _record(self, host, elapsed, retries, error):
+        metrics.UPSTREAM_SECONDS.observe(elapsed, host=host)
+        if error:
+            metrics.UPSTREAM_ERRORS.inc(host=host)
+        if retries:
+            metrics.UPSTREAM_RETRIES.inc(retries, host=host)
+        with _stats_lock:
+            entry = _host_entry(host)
+            entry['requests'] += 1
+            entry['errors'] += int(error)
+            entry['retries'] += retries
+            entry['latency_total'] += elapsed
+            entry['latency_max'] = max(entry['latency_max'], elapsed)
+
+    def connection_counts(self):
+        """{host: (connections opened, requests sent)} from urllib3's per-pool counters"""
+        counts = {}
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened, sent = counts.get(pool.host, (0, 0))
+            counts[pool.host] = (opened + pool.num_connections, sent + pool.num_requests)
+        return counts
+
+
+def build_session(pool_size=None, retries=None):
+    pool_size = pool_size or settings.http_pool_size
+    retries = settings.http_retries if retries is None else retries
+
+    retry = Retry(
+        total=retries,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        backoff_factor=settings.http_backoff_factor,
+        backoff_jitter=settings.http_backoff_jitter,
+        raise_on_status=False,
+    )
+    adapter = CountingAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = settings.http_user_agent
+    return session
+
+
+session = build_session()
+
+
+def get(url, timeout=None, **kwargs):
+    """GET through the shared session; timeout defaults to (connect, read) from ApiSettings"""
+    if timeout is None:
+        timeout = (settings.http_connect_timeout, settings.http_read_timeout)
+    return session.get(url, timeout=timeout, **kwargs)
+
+
+def host_stats():
+    """Snapshot of the per-host counters"""
+    counts = {}
+    for adapter in set(session.adapters.values()):
+        if isinstance(adapter, CountingAdapter):
+            for host, (opened, sent) in adapter.connection_counts().items():
+                prev_opened, prev_sent = counts.get(host, (0, 0))
+                counts[host] = (prev_opened + opened, prev_sent + sent)
+
+    with _stats_lock:
+        stats = {}
+        for host, entry in _host_stats.items():
+            opened, sent = counts.get(host, (0, 0))
+            stats[host] = dict(entry)
+            stats[host]['latency_avg'] = entry['latency_total'] / entry['requests'] if entry['requests'] else 0.0
+            stats[host]['connections_opened'] = opened
+            stats[host]['connections_reused'] = max(0, sent - opened)
+        return stats
@@ -0,0 +1,110 @@
+"""
+Hybrid lexical + semantic retrieval over the local catalog (settings.catalog_path).
+BM25Index is an in-memory inverted index over title, subjects and description. Every posting
+already holds its BM25 weight, so a query is one scatter-add per term into a score array.
+HybridRetriever runs it next to the embedding VectorIndex and fuses both rankings with reciprocal
+rank fusion: a book near the top of either list surfaces, even when the other one misses it.
+"""
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from embeddings import VectorIndex
+from scoring import top_k_indices
+
+_word = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return _word.findall(text.lower())
+
+
+def load_catalog(path):
+    """Books with a description from a JSON list of {key, title, description, ...} (Open Library search
+    docs plus their description, as ol_mirror.py exports them); [] when there is no catalog file"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [book for book in json.load(f) if book.get('description')]
+
+
+def catalog_text(book):
+    """Text BM25 indexes for a catalog book: title, subjects and description"""
+    return ' '.join([book.get('title', ''), ' '.join(book.get('subject', [])), book.get('description', '')])
+
+
+class BM25Index:
+    """Okapi BM25 top-k over a list of texts"""
+
+    def __init__(self, texts, k1=1.2, b=0.75):
+        self.size = len(texts)
+        postings = defaultdict(lambda: ([], []))
+        lengths = np.zeros(self.size, dtype=np.float32)
+        for i, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[i] = sum(counts.values())
+            for term, tf in counts.items():
+                docs, tfs = postings[term]
+                docs.append(i)
+                tfs.append(tf)
+
+        # per-document length normalization, folded into each posting's weight below
+        norms = k1 * (1 - b + b * lengths / (lengths.mean() if self.size else 1.0))
+        self.postings = {}
+        for term, (docs, tfs) in postings.items():
+            docs = np.array(docs, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = math.log(1 + (self.size - len(docs) + 0.5) / (len(docs) + 0.5))
+            self.postings[term] = (docs, (idf * tfs * (k1 + 1) / (tfs + norms[docs])).astype(np.float32))
+
+    def __len__(self):
+        return self.size
+
+    def search(self, query, k):
+        """(indices, scores) of the k best-matching texts, best first; texts sharing no term are left out"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in self.postings:
+                docs, weights = self.postings[term]
+                scores[docs] += weights     # a term occurs once per document's postings
+        matched = np.flatnonzero(scores)
+        top = matched[top_k_indices(scores[matched], k)]
+        return top, scores[top]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """(indices, fused scores), best first, of the union of several rankings (indices, best first);
+    each index scores the sum of 1 / (k + rank) over the rankings it appears in"""
+    rankings = [np.asarray(ranking, dtype=np.int64) for ranking in rankings]
+    if not sum(len(ranking) for ranking in rankings):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    ids = np.concatenate(rankings)
+    contributions = np.concatenate([1.0 / (k + np.arange(1, len(ranking) + 1)) for ranking in rankings])
+    unique, inverse = np.unique(ids, return_inverse=True)
+    fused = np.bincount(inverse, weights=contributions)
+    order = top_k_indices(fused)
+    return unique[order], fused[order]
+
+
+class HybridRetriever:
+    """BM25 and embedding rankings of the same books, each depth deep, fused with RRF"""
+
+    def __init__(self, texts, vectors, approximate=False, depth=500, rrf_k=60):
+        self.lexical = BM25Index(texts)
+        self.semantic = VectorIndex(vectors, approximate=approximate)
+        self.depth = depth
+        self.rrf_k = rrf_k
+
+    def __len__(self):
+        return len(self.lexical)
+
+    def search(self, query, query_embedding, k):
+        """(indices, fused scores) of the k best books for the query text and its embedding"""
+        lexical, _ = self.lexical.search(query, self.depth)
+        semantic, _ = self.semantic.search(query_embedding, self.depth)
+        indices, scores = reciprocal_rank_fusion([lexical, semantic], self.rrf_k)
+        return indices[:k], scores[:k]
@@ -0,0 +1,121 @@
+"""
+Streaming parser for KCLS (BiblioCommons) search result pages.
+Instead of building a BeautifulSoup tree of the whole page, the response is fed chunk by chunk into
+an lxml HTMLPullParser. Only the cp-search-result-item blocks are inspected, each finished block is
+cleared from the tree, and parsing stops at the first manifestation whose title matches.
+KclsMatcher is the push-style core, for callers that receive the page asynchronously.
+"""
+from lxml import etree
+
+KCLS_BASE_URL = "https://kcls.bibliocommons.com"
+
+
+def titles_match(info_title, title):
+    info_title = info_title.lower()
+    return info_title in title or title in info_title
+
+
+def _classes(elem):
+    return elem.get('class', '').split()
+
+
+class KclsMatcher:
+    """
+    Push-style matcher: feed() the chunks (bytes) of a KCLS search page as they arrive and stop as
+    soon as it returns the first manifestation of a search result whose title matches title.
+    """
+
+    def __init__(self, title):
+        self.title = title.lower().strip()
+        self.parser = etree.HTMLPullParser(events=('start', 'end'))
+        self.result = None      # current cp-search-result-item: {'title', 'matched'}
+        self.manifestation = None   # current manifestation item inside it
+
+    def feed(self, chunk):
+        """The match (title, link, status, available) once it has been read, else None"""
+        if not chunk:
+            return None
+        self.parser.feed(chunk)
+        return self._handle(self.parser.read_events())
+
+    def close(self):
+        """End of the page: a match in its last bytes, else None"""
+        try:
+            self.parser.close()
+        except etree.XMLSyntaxError:    # empty document
+            return None
+        return self._handle(self.parser.read_events())
+
+    def _handle(self, events):
+        for event, elem in events:
+            if not isinstance(elem.tag, str):
+                continue
+            classes = _classes(elem)
+
+            if event == 'start':
+                if 'cp-search-result-item' in classes:
+                    self.result = {'title': None, 'matched': False}
+                elif (self.result is not None and self.manifestation is None and 'manifestation-item' in classes
+                      and 'cp-manifestation-list-item' in classes):
+                    self.manifestation = {'elem': elem, 'link': None, 'status': None, 'in_block': False}
+                elif self.manifestation is not None and 'manifestation-item-availability-block-wrap' in classes:
+                    self.manifestation['in_block'] = True
+                continue
+
+            result = self.result
+            if result is None:
+                continue
+            manifestation = self.manifestation
+
+            if result['title'] is None and 'title-content' in classes:
+                info_title = ''.join(elem.itertext()).strip()
+                if info_title:
+                    result['title'] = info_title
+                    result['matched'] = titles_match(info_title, self.title)
+
+            elif manifestation is not None:
+                if elem.tag == 'a' and 'manifestation-item-link' in classes and elem.get('href'):
+                    manifestation['link'] = KCLS_BASE_URL + elem.get('href')
+                elif 'manifestation-item-availability-block-wrap' in classes:
+                    manifestation['in_block'] = False
+                elif manifestation['in_block'] and 'cp-availability-status' in classes:
+                    manifestation['status'] = ''.join(elem.itertext()).strip().lower()
+                elif elem is manifestation['elem']:
+                    self.manifestation = None
+                    if result['matched'] and manifestation['status'] is not None:
+                        return {
+                            'title': result['title'],
+                            'link': manifestation['link'],
+                            'status': manifestation['status'],
+                            'available': "available" in manifestation['status'] and "not" not in manifestation['status'],
+                        }
+
+            if 'cp-search-result-item' in classes:
+                self.result = None
+                self.manifestation = None
+                # drop the finished block and everything before it to keep the tree small
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        return None
+
+
+def find_kcls_match(chunks, title):
+    """
+    Stream the chunks (bytes) of a KCLS search page and return the first manifestation of a
+    search result whose title matches title, as a dict with title, link, status and available.
+    Returns None when no result matches.
+    """
+    matcher = KclsMatcher(title)
+    for chunk in chunks:
+        match = matcher.feed(chunk)
+        if match:
+            return match
+    return matcher.close()
+
+
+def parse_kcls_page(html, title, chunk_size=16384):
+    """find_kcls_match over an in-memory page (str or bytes)"""
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+    return find_kcls_match((html[i:i + chunk_size] for i in range(0, len(html), chunk_size)), title)
@@ -0,0 +1,35 @@
+"""
+Leveled logging for the backends, replacing print(). Lines are key=value pairs prefixed with the
+level, logger and the current request's ID (timing.request_id()), e.g.
+    2025-01-29 10:00:00,000 INFO bookquest.chat request_id=3f9c2a1b route=local confidence=0.88
+Loggers are module-level (logging.getLogger('bookquest.<module>')) and messages use %-style
+arguments, so a disabled level costs one isEnabledFor check and no formatting.
+"""
+import logging
+
+import timing
+
+FORMAT = '%(asctime)s %(levelname)s %(name)s request_id=%(request_id)s %(message)s'
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = timing.request_id()
+        return True
+
+
+_handler = None
+
+
+def configure(level='INFO'):
+    """Send the bookquest.* loggers to stderr at level (the handler is added once per process)"""
+    global _handler
+    logger = logging.getLogger('bookquest')
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    if _handler is None:
+        _handler = logging.StreamHandler()
+        _handler.addFilter(RequestIdFilter())
+        _handler.setFormatter(logging.Formatter(FORMAT))
+        logger.addHandler(_handler)
+        logger.propagate = False
+    return logger
@@ -0,0 +1,137 @@
+"""
+Prometheus metrics for the chat pipeline, served at /metrics in the text exposition format.
+Counters and histograms keep one value per label set behind a lock, so recording is a dict update.
+Cache hit/miss counters are read from the caches' stats() when scraped (watch_cache), instead of
+being counted a second time on every lookup.
+"""
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+_caches = {}    # name -> object with stats()
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Metric(ABC):
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}   # label values -> value
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self):
+        """(sample name, labels, value) of every label set"""
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, 'le': format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+STAGE_SECONDS = Histogram('bookquest_stage_seconds', "Time spent in each pipeline stage", ['stage'])
+REQUEST_SECONDS = Histogram('bookquest_request_seconds', "Time to answer a request (to the first byte when streamed)",
+                            ['path', 'status'])
+UPSTREAM_SECONDS = Histogram('bookquest_upstream_request_seconds', "Outbound request time per upstream host", ['host'])
+UPSTREAM_ERRORS = Counter('bookquest_upstream_errors_total', "Failed outbound requests (errors and 5xx) per upstream host",
+                          ['host'])
+UPSTREAM_RETRIES = Counter('bookquest_upstream_retries_total', "Retried outbound requests per upstream host", ['host'])
+
+
+def watch_cache(name, cache):
+    """Export the hit, miss and size counts of cache.stats() under cache=name (replacing an earlier one)"""
+    _caches[name] = cache
+
+
+def cache_counts(stats):
+    """(hits, misses, entries or None) from the stats() of any of the cache classes"""
+    hits = sum(stats.get(field, 0) for field in ('hits', 'memory_hits', 'disk_hits', 'stale_serves'))
+    return hits, stats.get('misses', 0), stats.get('size', stats.get('memory_size'))
+
+
+def cache_families():
+    counts = {name: cache_counts(cache.stats()) for name, cache in list(_caches.items())}
+    families = (('bookquest_cache_hits_total', 'counter', "Cache lookups answered from the cache", 0),
+                ('bookquest_cache_misses_total', 'counter', "Cache lookups that had to load the value", 1),
+                ('bookquest_cache_entries', 'gauge', "Entries held in memory", 2))
+    for name, kind, documentation, field in families:
+        samples = [(name, {'cache': cache}, values[field]) for cache, values in counts.items() if values[field] is not None]
+        yield name, kind, documentation, samples
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    families = [(metric.name, metric.type, metric.documentation, metric.samples()) for metric in REGISTRY]
+    lines = []
+    for name, kind, documentation, samples in families + list(cache_families()):
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{sample}{format_labels(labels)} {format_value(value)}" for sample, labels, value in samples)
+    return '\n'.join(lines) + '\n'
+
+
+def register(app):
+    """Serve render() at /metrics on a Flask or Quart app"""
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return app.response_class(render(), content_type=CONTENT_TYPE)
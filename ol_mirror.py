@@ -0,0 +1,414 @@
+"""
+Local mirror of the Open Library data dumps (https://openlibrary.org/developers/dumps), so searches
+and work descriptions are answered without a round-trip to openlibrary.org.
+
+    python ol_mirror.py ol_dump_authors.txt.gz ol_dump_works.txt.gz ol_dump_editions.txt.gz \
+        --ratings ol_dump_ratings.txt.gz [--db .cache/ol_mirror.sqlite3] [--compact]
+
+The dumps are streamed line by line (gzipped or not; the all-types dump works too) into an SQLite
+file in batches, so memory stays flat however large they are. Editions (languages, page counts,
+publish years, covers) and ratings are then aggregated per work, and an FTS5 index is built over
+title, author and subjects. FTS rowids follow the rating order, so a keyword search sorted by rating
+walks the index in order and stops at the limit instead of sorting every match.
+
+OpenLibraryMirror answers the search.json queries the backends send (title + author, the OR'ed
+title/author batch, keyword + language + sort=rating) and work descriptions. openlibrary.py uses it
+instead of the live API when settings.openlibrary_source is 'mirror'.
+--export-catalog writes the best-rated works with a description as the catalog hybrid_search
+indexes (settings.catalog_path).
+"""
+import argparse
+import gzip
+import itertools
+import json
+import os
+import re
+import sqlite3
+import statistics
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS works (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    title TEXT NOT NULL,
+    author_keys TEXT NOT NULL,      -- JSON list of /authors/ keys
+    subjects TEXT NOT NULL,         -- JSON list
+    description TEXT NOT NULL,
+    cover_id INTEGER,
+    first_publish_year INTEGER,
+    -- set by finalize()
+    author_names TEXT,              -- JSON list
+    languages TEXT,                 -- ' eng fre ', padded so instr() matches whole codes
+    pages_median INTEGER,
+    ratings_average REAL,
+    ratings_count INTEGER,
+    rating_rank INTEGER             -- position in rating order, also the FTS rowid
+);
+CREATE TABLE IF NOT EXISTS authors (key TEXT PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS editions (
+    key TEXT PRIMARY KEY,
+    work_key TEXT NOT NULL,
+    languages TEXT NOT NULL,        -- space-separated codes
+    pages INTEGER,
+    year INTEGER,
+    cover_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS ratings (work_key TEXT NOT NULL, rating INTEGER NOT NULL);
+"""
+
+# Bayesian prior for the rating order (rated works first): works with few ratings are pulled towards RATING_PRIOR_MEAN
+RATING_PRIOR_MEAN = 3.0
+RATING_PRIOR_WEIGHT = 5
+
+_year = re.compile(r'\b(\d{4})\b')
+_token = re.compile(r'\w+')
+_pair = re.compile(r'title:"([^"]*)" AND author:"([^"]*)"')
+
+
+def default_path():
+    from apiSettings import ApiSettings
+    return ApiSettings().openlibrary_mirror_path
+
+
+def text_value(value):
+    """Plain text of a dump field that is either a string or a {type, value} object"""
+    if isinstance(value, dict):
+        value = value.get('value', '')
+    return value if isinstance(value, str) else ''
+
+
+def first_year(text):
+    match = _year.search(text_value(text))
+    return int(match.group(1)) if match else None
+
+
+def first_cover(covers):
+    """First real cover id (deleted covers are -1)"""
+    return next((c for c in covers or () if isinstance(c, int) and c > 0), None)
+
+
+def ref_key(ref, field):
+    """Key of a {field: {key}} reference, or of the older {field: key} form"""
+    value = ref.get(field) if isinstance(ref, dict) else None
+    if isinstance(value, dict):
+        value = value.get('key')
+    return value if isinstance(value, str) else None
+
+
+def open_dump(path):
+    return gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') else open(path, encoding='utf-8')
+
+
+def dump_records(path):
+    """(type, key, JSON text) per line of a dump: type, key, revision, last modified, JSON, tab-separated"""
+    with open_dump(path) as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t', 4)
+            if len(parts) == 5:
+                yield parts[0], parts[1], parts[4]
+
+
+def work_row(key, data):
+    title = data.get('title')
+    if not title:
+        return None
+    authors = [k for k in (ref_key(a, 'author') for a in data.get('authors') or ()) if k]
+    subjects = [s for s in data.get('subjects') or () if isinstance(s, str)]
+    return (key, title, json.dumps(authors), json.dumps(subjects), text_value(data.get('description')),
+            first_cover(data.get('covers')), first_year(data.get('first_publish_date')))
+
+
+def edition_row(key, data):
+    works = data.get('works') or ()
+    work_key = ref_key({'work': works[0]}, 'work') if works else None
+    if not work_key:
+        return None
+    languages = [k.rsplit('/', 1)[-1] for k in (ref_key({'l': l}, 'l') for l in data.get('languages') or ()) if k]
+    pages = data.get('number_of_pages')
+    return (key, work_key, ' '.join(languages), pages if isinstance(pages, int) and pages > 0 else None,
+            first_year(data.get('publish_date')), first_cover(data.get('covers')))
+
+
+def author_row(key, data):
+    name = data.get('name')
+    return (key, name) if isinstance(name, str) and name else None
+
+
+INSERTS = {
+    '/type/work': (work_row, "INSERT OR REPLACE INTO works (key, title, author_keys, subjects, description, "
+                             "cover_id, first_publish_year) VALUES (?, ?, ?, ?, ?, ?, ?)"),
+    '/type/edition': (edition_row, "INSERT OR REPLACE INTO editions VALUES (?, ?, ?, ?, ?, ?)"),
+    '/type/author': (author_row, "INSERT OR REPLACE INTO authors VALUES (?, ?)"),
+}
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+def connect(path):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")     # a failed build is simply re-run
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def ingest_dump(conn, path, batch_size=10000):
+    """Stream the works, editions and authors of one dump into conn; returns {type: rows stored}"""
+    counts = dict.fromkeys(INSERTS, 0)
+    pending = {record_type: [] for record_type in INSERTS}
+    start = time.monotonic()
+
+    def flush(record_type):
+        with conn:
+            conn.executemany(INSERTS[record_type][1], pending[record_type])
+        counts[record_type] += len(pending[record_type])
+        pending[record_type].clear()
+
+    for n, (record_type, key, text) in enumerate(dump_records(path), 1):
+        if record_type in INSERTS:
+            row = INSERTS[record_type][0](key, json.loads(text))
+            if row:
+                pending[record_type].append(row)
+                if len(pending[record_type]) >= batch_size:
+                    flush(record_type)
+        if n % 1000000 == 0:
+            print(f"{path}: {n:,} lines, {n / (time.monotonic() - start):,.0f}/s")
+    for record_type in INSERTS:
+        flush(record_type)
+    return counts
+
+
+def ingest_ratings(conn, path, batch_size=10000):
+    """Replace the ratings with those of a ratings dump (work key, edition key, rating, date per line)"""
+    def rows():
+        with open_dump(path) as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) >= 3 and parts[2].isdigit():
+                    yield parts[0], int(parts[2])
+
+    with conn:
+        conn.execute("DELETE FROM ratings")
+    count = 0
+    for batch in batched(rows(), batch_size):
+        with conn:
+            conn.executemany("INSERT INTO ratings VALUES (?, ?)", batch)
+        count += len(batch)
+    return count
+
+
+def edition_totals(conn):
+    """(languages, median pages, earliest year, cover, work key) per work, from its editions in key order"""
+    rows = conn.execute("SELECT work_key, languages, pages, year, cover_id FROM editions ORDER BY work_key")
+    for work_key, group in itertools.groupby(rows, key=lambda row: row[0]):
+        languages, pages, years, cover_id = set(), [], [], None
+        for _, edition_languages, edition_pages, year, edition_cover in group:
+            languages.update(edition_languages.split())
+            if edition_pages:
+                pages.append(edition_pages)
+            if year:
+                years.append(year)
+            cover_id = cover_id or edition_cover
+        yield (f" {' '.join(sorted(languages))} " if languages else None,
+               int(statistics.median(pages)) if pages else None, min(years) if years else None,
+               cover_id, work_key)
+
+
+def finalize(conn, batch_size=10000):
+    """Aggregate authors, editions and ratings into works, then rebuild the rating order and FTS index"""
+    with conn:
+        conn.execute("CREATE INDEX IF NOT EXISTS editions_work ON editions (work_key)")
+        conn.execute("""
+            UPDATE works SET author_names = (
+                SELECT json_group_array(name) FROM (
+                    SELECT a.name FROM json_each(works.author_keys) j JOIN authors a ON a.key = j.value
+                    ORDER BY j.key))""")
+
+    for batch in batched(edition_totals(conn), batch_size):
+        with conn:
+            conn.executemany("""
+                UPDATE works SET languages = ?, pages_median = ?,
+                    first_publish_year = coalesce(min(first_publish_year, ?3), first_publish_year, ?3),
+                    cover_id = coalesce(cover_id, ?4)
+                WHERE key = ?5""", batch)
+
+    with conn:
+        conn.execute("UPDATE works SET ratings_average = NULL, ratings_count = NULL")
+        conn.execute("""
+            UPDATE works SET ratings_average = round(t.average, 2), ratings_count = t.count
+            FROM (SELECT work_key, avg(rating) AS average, count(*) AS count FROM ratings GROUP BY work_key) t
+            WHERE t.work_key = works.key""")
+        conn.execute("DROP INDEX IF EXISTS works_rating_rank")
+        conn.execute(f"""
+            UPDATE works SET rating_rank = r.rank
+            FROM (SELECT id, row_number() OVER (ORDER BY ratings_count IS NULL,
+                    (coalesce(ratings_average, 0) * coalesce(ratings_count, 0) + {RATING_PRIOR_MEAN * RATING_PRIOR_WEIGHT})
+                    / (coalesce(ratings_count, 0) + {RATING_PRIOR_WEIGHT}) DESC, coalesce(ratings_count, 0) DESC, id
+                  ) AS rank FROM works) r
+            WHERE r.id = works.id""")
+        conn.execute("CREATE UNIQUE INDEX works_rating_rank ON works (rating_rank)")
+
+        # contentless: the index holds no copy of the text, rows are read back from works
+        conn.execute("DROP TABLE IF EXISTS works_fts")
+        conn.execute("CREATE VIRTUAL TABLE works_fts USING fts5(title, author, subject, content='', "
+                     "tokenize='unicode61 remove_diacritics 2')")
+        conn.execute("""
+            INSERT INTO works_fts (rowid, title, author, subject)
+            SELECT rating_rank, title,
+                   (SELECT group_concat(value, ' ') FROM json_each(coalesce(author_names, '[]'))),
+                   (SELECT group_concat(value, ' ') FROM json_each(subjects))
+            FROM works""")
+        conn.execute("INSERT INTO works_fts (works_fts) VALUES ('optimize')")
+    conn.execute("ANALYZE")
+
+
+def compact(conn):
+    """Drop the edition and rating staging tables (a later ingest needs the full dumps again) and shrink the file"""
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS editions")
+        conn.execute("DROP TABLE IF EXISTS ratings")
+        conn.execute("DROP TABLE IF EXISTS authors")
+    conn.execute("VACUUM")
+
+
+def export_catalog(conn, path, size):
+    """Write the size best-rated works that have a description as a JSON list of search docs plus
+    their description; returns the number written"""
+    rows = conn.execute(f"SELECT {OpenLibraryMirror.DOC_COLUMNS}, w.description FROM works w "
+                        f"WHERE w.description != '' ORDER BY w.rating_rank LIMIT ?", (size,))
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for row in rows:
+            doc = doc_from_row(row[:-1])
+            doc['description'] = row[-1]
+            f.write((',\n' if count else '\n') + json.dumps(doc))
+            count += 1
+        f.write('\n]\n')
+    return count
+
+
+def phrase(text):
+    """FTS5 phrase matching the words of text in order"""
+    tokens = _token.findall(text.lower())
+    return '"' + ' '.join(tokens) + '"' if tokens else None
+
+
+def doc_from_row(row, fields=None):
+    """search.json doc for a works row; missing values are left out, as Open Library does"""
+    key, title, author_names, year, pages, subjects, average, count, cover_id, languages = row
+    doc = {
+        'key': key, 'title': title, 'author_name': json.loads(author_names or '[]'),
+        'first_publish_year': year, 'number_of_pages_median': pages, 'subject': json.loads(subjects),
+        'ratings_average': average, 'ratings_count': count, 'cover_i': cover_id,
+        'language': (languages or '').split(),
+    }
+    return {name: value for name, value in doc.items()
+            if value not in (None, []) and (fields is None or name in fields)}
+
+
+class OpenLibraryMirror:
+    """Read-only queries against a mirror built by this module; one connection per thread"""
+
+    DOC_COLUMNS = ("w.key, w.title, w.author_names, w.first_publish_year, w.pages_median, w.subjects, "
+                   "w.ratings_average, w.ratings_count, w.cover_id, w.languages")
+
+    def __init__(self, path, count_limit=10000):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No Open Library mirror at {path}; build one with ol_mirror.py")
+        self.path = path
+        self.count_limit = count_limit  # numFound is counted up to this many matches
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True,
+                                                      check_same_thread=False)
+        return conn
+
+    def search(self, params):
+        """search.json-shaped {'numFound', 'docs'} for the q / title / author / language / sort / limit /
+        fields parameters the backends send"""
+        limit = int(params.get('limit', 100))
+        fields = set(params['fields'].split(',')) if params.get('fields') else None
+        if 'q' in params:
+            pairs = _pair.findall(params['q'])
+            if pairs:
+                match = self._pairs_match(pairs)
+            else:
+                match = ' '.join(f'"{token}"' for token in _token.findall(params['q'].lower()))
+        else:
+            match = self._pairs_match([(params.get('title', ''), params.get('author', ''))])
+        if not match:
+            return {'numFound': 0, 'docs': []}
+
+        where = "works_fts MATCH ?"
+        args = [match]
+        if params.get('language'):
+            where += " AND instr(w.languages, ?)"
+            args.append(f" {params['language']} ")
+        order = "f.rowid" if params.get('sort') == 'rating' else "f.rank"
+
+        conn = self._conn()
+        rows = conn.execute(f"SELECT {self.DOC_COLUMNS} FROM works_fts f JOIN works w ON w.rating_rank = f.rowid "
+                            f"WHERE {where} ORDER BY {order} LIMIT ?", args + [limit]).fetchall()
+        found = conn.execute(f"SELECT count(*) FROM (SELECT 1 FROM works_fts f JOIN works w ON w.rating_rank = f.rowid "
+                             f"WHERE {where} LIMIT ?)", args + [self.count_limit]).fetchone()[0]
+        return {'numFound': found, 'docs': [doc_from_row(row, fields) for row in rows]}
+
+    @staticmethod
+    def _pairs_match(pairs):
+        clauses = []
+        for title, author in pairs:
+            title, author = phrase(title), phrase(author)
+            if title:
+                clauses.append(f"(title : {title} AND author : {author})" if author else f"(title : {title})")
+        return ' OR '.join(clauses)
+
+    def description(self, work_key):
+        """Description of a work, '' if it has none or is not in the mirror"""
+        row = self._conn().execute("SELECT description FROM works WHERE key = ?", (work_key,)).fetchone()
+        return row[0] if row else ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('dumps', nargs='*', help="works / editions / authors (or all-types) dump files")
+    parser.add_argument('--ratings', help="ratings dump file")
+    parser.add_argument('--db', default=None, help="mirror file (default: settings.openlibrary_mirror_path)")
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--compact', action='store_true', help="drop staging tables and VACUUM when done")
+    parser.add_argument('--export-catalog', metavar='PATH', help="write the hybrid_search catalog here")
+    parser.add_argument('--catalog-size', type=int, default=50000)
+    args = parser.parse_args()
+
+    path = args.db or default_path()
+    conn = connect(path)
+    start = time.monotonic()
+    for dump in args.dumps:
+        counts = ingest_dump(conn, dump, args.batch_size)
+        print(f"{dump}: " + ', '.join(f"{n:,} {t.rsplit('/', 1)[-1]}s" for t, n in counts.items() if n))
+    if args.ratings:
+        print(f"{args.ratings}: {ingest_ratings(conn, args.ratings, args.batch_size):,} ratings")
+    if args.dumps or args.ratings:
+        finalize(conn, args.batch_size)
+    if args.compact:
+        compact(conn)
+    if args.export_catalog:
+        print(f"{args.export_catalog}: {export_catalog(conn, args.export_catalog, args.catalog_size):,} books")
+    works = conn.execute("SELECT count(*) FROM works").fetchone()[0]
+    conn.close()
+    print(f"{path}: {works:,} works, {os.path.getsize(path) / 1e6:,.1f} MB, built in {time.monotonic() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+Open Library lookups shared by backend_response and testAPI.
+Work descriptions are cached by work key: an in-process LRU in front of an SQLite tier with a TTL.
+Works without a description are cached too (with a shorter TTL) so they are not re-fetched either.
+Title+author resolutions are cached the same way, keyed by the normalized (title, author) pair,
+and the misses of one chat turn are resolved with a single OR'ed search.json query (only its
+matches are cached: a pair it missed gets its own search, whose "no match" is cached).
+With settings.openlibrary_source = 'mirror', searches and descriptions come from the local dump
+mirror (ol_mirror.py) instead of openlibrary.org.
+"""
+import os
+import re
+import urllib.parse
+
+import requests
+
+import http_client
+import metrics
+import timing
+from apiSettings import ApiSettings
+from cache import MISSING, LRUCache, SQLiteCache, TieredCache
+
+settings = ApiSettings()
+
+description_cache = TieredCache(
+    LRUCache(maxsize=settings.description_cache_size if settings.upstream_caches else 0,
+             ttl=settings.description_cache_ttl),
+    SQLiteCache(os.path.join(settings.cache_dir, 'openlibrary.sqlite3'), 'descriptions',
+                ttl=settings.description_cache_ttl) if settings.upstream_caches else None,
+)
+
+resolution_cache = TieredCache(
+    LRUCache(maxsize=settings.resolution_cache_size if settings.upstream_caches else 0,
+             ttl=settings.resolution_cache_ttl),
+    SQLiteCache(os.path.join(settings.cache_dir, 'openlibrary.sqlite3'), 'resolutions',
+                ttl=settings.resolution_cache_ttl) if settings.upstream_caches else None,
+)
+
+metrics.watch_cache('description', description_cache)
+metrics.watch_cache('resolution', resolution_cache)
+
+mirror = None
+if settings.openlibrary_source == 'mirror':
+    from ol_mirror import OpenLibraryMirror
+    mirror = OpenLibraryMirror(settings.openlibrary_mirror_path)
+
+SEARCH_FIELDS = (
+    "key,title,author_name,first_publish_year,number_of_pages_median,"
+    "ratings_average,ratings_count,cover_i"
+)
+
+_non_word = re.compile(r'[^\w\s]')
+_spaces = re.compile(r'\s+')
+
+
+def normalize(text):
+    return _spaces.sub(' ', _non_word.sub('', (text or '').lower())).strip()
+
+
+def resolution_key(title, author):
+    return f"{normalize(title)}|{normalize(author)}"
+
+
+def match_doc(docs, title, author):
+    """First doc whose title equals title and whose authors include author (normalized)"""
+    title = normalize(title)
+    author = normalize(author)
+    for doc in docs:
+        if not doc.get('title'):
+            continue
+        if (normalize(doc['title']) == title and
+                any(author in normalize(a) for a in doc.get('author_name', []))):
+            return doc
+    return None
+
+
+def search_url(params):
+    return f"{settings.openlibrary_url}/search.json?{urllib.parse.urlencode(params)}"
+
+
+def work_url(work_key):
+    return f"{settings.openlibrary_url}{work_key}.json"
+
+
+def search(params, timeout=None):
+    """search.json response for params, from the mirror when there is one"""
+    with timing.stage('openlibrary_search'):
+        if mirror is not None:
+            return mirror.search(params)
+        response = http_client.get(search_url(params), timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+def search_docs(params, timeout=None):
+    return search(params, timeout=timeout).get('docs', [])
+
+
+def cached_resolutions(pairs):
+    """({resolution_key: doc or None} for cached pairs, {resolution_key: (title, author)} for the misses)"""
+    resolved = {}
+    misses = {}
+    for title, author in pairs:
+        key = resolution_key(title, author)
+        doc = resolution_cache.get(key)
+        if doc is MISSING:
+            misses[key] = (title, author)
+        else:
+            resolved[key] = doc
+    return resolved, misses
+
+
+def resolution_params(misses):
+    """search.json parameters resolving all missed pairs in one OR'ed query"""
+    clauses = []
+    for title, author in misses.values():
+        title = title.replace('"', '').replace('\\', '')
+        author = author.replace('"', '').replace('\\', '')
+        clauses.append(f'(title:"{title}" AND author:"{author}")')
+    return {'q': ' OR '.join(clauses), 'fields': SEARCH_FIELDS, 'limit': 10 * len(misses)}
+
+
+def store_resolutions(misses, docs, resolved):
+    """Match the missed pairs against the docs of a batched query, cache and add the matches to resolved.
+    Unmatched pairs are left out, not cached as None: their doc may just have been crowded out of the
+    shared result list, so they get their own search (get_openlibrary_doc)."""
+    for key, (title, author) in misses.items():
+        doc = match_doc(docs, title, author)
+        if doc:
+            resolution_cache.set(key, doc)
+            resolved[key] = doc
+    return resolved
+
+
+def store_resolution(key, title, author, docs):
+    """Match one pair against the docs of its own search and cache the result, None included"""
+    doc = match_doc(docs, title, author)
+    resolution_cache.set(key, doc, ttl=None if doc else settings.resolution_negative_ttl)
+    return doc
+
+
+def resolve_openlibrary_docs(pairs, timeout=None):
+    """Resolve (title, author) pairs to search docs (None when nothing matched).
+    Cached pairs cost nothing; all misses go out as one OR'ed search.json query.
+    Returns {resolution_key: doc or None}; pairs the query did not match or whose search failed are left out."""
+    resolved, misses = cached_resolutions(pairs)
+    if not misses:
+        return resolved
+
+    try:
+        docs = search_docs(resolution_params(misses), timeout=timeout)
+    except (requests.RequestException, ValueError):
+        return resolved
+
+    return store_resolutions(misses, docs, resolved)
+
+
+def doc_params(title, author):
+    """search.json parameters for an exact title and author search"""
+    return {'title': title, 'author': author, 'fields': SEARCH_FIELDS, 'limit': 10}
+
+
+def get_openlibrary_doc(title, author, timeout=None):
+    key = resolution_key(title, author)
+    doc = resolution_cache.get(key)
+    if doc is MISSING:
+        try:
+            # Exact title and author search
+            docs = search_docs(doc_params(title, author), timeout=timeout)
+        except requests.RequestException as e:
+            return f'Error fetching data: {str(e)}'
+        except Exception as e:
+            return f'Error parsing data: {str(e)}'
+
+        doc = store_resolution(key, title, author, docs)
+
+    return doc or settings.default_doc
+
+
+def download_book_description(work_key, timeout=None):
+    """Fetch the description of a work; raises on network errors, returns '' if the work has none"""
+    if mirror is not None:
+        return mirror.description(work_key)
+    response = http_client.get(work_url(work_key), timeout=timeout)
+    if response.status_code == 404:
+        return ''
+    response.raise_for_status()
+    return parse_description(response.json())
+
+
+def parse_description(data):
+    """Description text of a work JSON document (a plain string or a {type, value} object)"""
+    return data.get('description', {}).get('value', '') if isinstance(data.get('description'), dict) else data.get('description', '')
+
+
+def fetch_book_description(work_key, timeout=None):
+    if not work_key:
+        return ''
+
+    description = description_cache.get(work_key)
+    if description is not MISSING:
+        return description
+    return load_description(work_key, timeout=timeout)
+
+
+def load_description(work_key, timeout=None):
+    """Download, cache and return the description of a work, skipping the cache lookup"""
+    try:
+        with timing.stage('description'):
+            description = download_book_description(work_key, timeout=timeout)
+    except (requests.RequestException, ValueError):
+        return ''  # transient failure, try again next time
+
+    return store_description(work_key, description)
+
+
+def store_description(work_key, description):
+    ttl = None if description else settings.description_negative_ttl
+    description_cache.set(work_key, description, ttl=ttl)
+    return description
@@ -0,0 +1,266 @@
+"""
+On-demand sampling profiler for live Flask workers.
+A profiled request gets a sampler thread that reads its stack, and the stacks of pool threads
+working for it (timing.bind), from sys._current_frames() every settings.profile_interval_ms.
+Nothing is traced, so unprofiled requests pay one random() call and profiled ones a fixed cost
+per sample. A settings.profile_sample_rate fraction of the profiled paths (/chat, /chat/stream,
+/api/search) is profiled, plus any request carrying X-Profile: <settings.admin_token>. A streamed
+response is sampled until its body has been sent, not just until its headers are.
+Each profile is written to settings.profile_dir as collapsed stacks ("frame;frame;frame count"
+per line, root first), the input of flamegraph.pl, speedscope and inferno, and indexed in
+profiles.jsonl. With settings.admin_token set, the app serves (to X-Admin-Token: <token>):
+    /admin/profiles             recent profiles, newest first
+    /admin/profiles/<name>      one profile's collapsed stacks
+    /admin/profiles/report      hot functions over recent profiles (self and total samples)
+"""
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import timing
+
+_profile = ContextVar('profile', default=None)
+_labels = {}    # code object -> frame label
+_unsafe = re.compile(r'[^\w-]')
+_lock = threading.Lock()
+
+
+def frame_label(code):
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+    return label
+
+
+def collapse(frame):
+    """The stack of frame as "root;...;leaf" frame labels"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Profile:
+    """Stack samples of a set of threads, taken every interval seconds until stop()"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.threads = {threading.get_ident()}
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.threads):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[collapse(frame)] += 1
+                    self.samples += 1
+
+
+@contextmanager
+def attached():
+    """Sample the current thread as part of the current request's profile, if it has one"""
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    profile.threads.add(thread_id)
+    try:
+        yield
+    finally:
+        profile.threads.discard(thread_id)
+
+
+timing.bound_call_hooks.append(attached)
+
+
+class ProfileStore:
+    """Collapsed-stack files in a directory, indexed in profiles.jsonl; only the newest keep are kept"""
+
+    def __init__(self, directory, keep=200):
+        self.directory = directory
+        self.keep = keep
+        self.index_path = os.path.join(directory, 'profiles.jsonl')
+
+    @staticmethod
+    def name(request_id):
+        return f"{time.strftime('%Y%m%dT%H%M%S')}-{_unsafe.sub('', request_id)[:32]}"
+
+    def save(self, profile, name, request_id, path, status):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, f"{name}.collapsed"), 'w', encoding='utf-8') as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in profile.stacks.most_common())
+        entry = {'name': name, 'request_id': request_id, 'path': path, 'status': status,
+                 'duration_ms': round(profile.elapsed * 1000, 1), 'samples': profile.samples,
+                 'created': time.time()}
+        with _lock:
+            entries = self.entries() + [entry]
+            for old in entries[:-self.keep]:
+                try:
+                    os.remove(os.path.join(self.directory, f"{old['name']}.collapsed"))
+                except FileNotFoundError:
+                    pass
+            if len(entries) > self.keep:
+                # rewrite the index without the removed profiles
+                entries = entries[-self.keep:]
+                with open(self.index_path, 'w', encoding='utf-8') as f:
+                    f.writelines(json.dumps(e) + '\n' for e in entries)
+            else:
+                with open(self.index_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry) + '\n')
+        return name
+
+    def entries(self):
+        """Index entries, oldest first"""
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def stacks(self, name):
+        """{stack: count} of a saved profile, or None"""
+        path = os.path.join(self.directory, f"{_unsafe.sub('', name)}.collapsed")
+        if not os.path.exists(path):
+            return None
+        stacks = Counter()
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                stacks[stack] += int(count)
+        return stacks
+
+    def report(self, limit=50, path=None, top=30):
+        """Hot functions over the newest limit profiles (of path): samples with the function on top of
+        the stack (self) and anywhere in it (total), as counts and shares of all samples"""
+        entries = [e for e in self.entries() if path is None or e['path'] == path][-limit:]
+        own, total, samples = Counter(), Counter(), 0
+        for entry in entries:
+            for stack, count in (self.stacks(entry['name']) or {}).items():
+                frames = stack.split(';')
+                own[frames[-1]] += count
+                for frame in set(frames):
+                    total[frame] += count
+                samples += count
+        return {
+            'profiles': len(entries),
+            'samples': samples,
+            'functions': [{'function': function, 'self': count, 'self_share': round(count / samples, 4),
+                           'total': total[function], 'total_share': round(total[function] / samples, 4)}
+                          for function, count in own.most_common(top)],
+        }
+
+
+class SampledBody:
+    """A streamed response body that keeps its request's profile running (and bind()-ed work attached
+    to it) while it is sent, then stops and saves the profile once it is exhausted or closed"""
+
+    def __init__(self, body, profile, save):
+        self.body = body
+        self.profile = profile
+        self.save = save
+
+    def __iter__(self):
+        _profile.set(self.profile)
+        try:
+            yield from self.body
+        finally:
+            _profile.set(None)
+            self._finish()
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self._finish()
+
+    def _finish(self):
+        profile, self.profile = self.profile, None
+        if profile is not None:
+            self.save(profile.stop())
+
+
+def register(app, settings, paths):
+    """Profile requests to paths on a Flask app (as sampled or asked for), and serve the admin endpoints
+    when settings.admin_token is set. Register after timing.register, so profiles are saved under the
+    request's ID before the request is logged."""
+    from flask import abort, jsonify, request
+
+    store = ProfileStore(settings.profile_dir, settings.profile_keep)
+    token = settings.admin_token
+
+    def authorized(value):
+        return bool(token) and hmac.compare_digest(value or '', token)
+
+    @app.before_request
+    def start_profile():
+        if request.path not in paths:
+            return
+        if random.random() < settings.profile_sample_rate or authorized(request.headers.get('X-Profile')):
+            _profile.set(Profile(settings.profile_interval_ms / 1000).start())
+
+    @app.after_request
+    def save_profile(response):
+        profile = _profile.get()
+        if profile is not None:
+            _profile.set(None)
+            request_id, path, status = timing.request_id(), request.path, response.status_code
+            name = store.name(request_id)
+            response.headers['X-Profile-Name'] = name
+            if response.is_streamed:
+                response.response = SampledBody(response.response, profile,
+                                                lambda profile: store.save(profile, name, request_id, path, status))
+            else:
+                store.save(profile.stop(), name, request_id, path, status)
+        return response
+
+    if not token:
+        return
+
+    def admin():
+        if not authorized(request.headers.get('X-Admin-Token')):
+            abort(404)
+
+    @app.route('/admin/profiles', methods=['GET'])
+    def list_profiles():
+        admin()
+        return jsonify(store.entries()[::-1][:request.args.get('limit', 100, type=int)])
+
+    @app.route('/admin/profiles/report', methods=['GET'])
+    def profile_report():
+        admin()
+        return jsonify(store.report(request.args.get('limit', 50, type=int), request.args.get('path')))
+
+    @app.route('/admin/profiles/<name>', methods=['GET'])
+    def get_profile(name):
+        admin()
+        stacks = store.stacks(name)
+        if stacks is None:
+            abort(404)
+        return app.response_class(''.join(f"{stack} {count}\n" for stack, count in stacks.most_common()),
+                                  mimetype='text/plain')
@@ -0,0 +1,74 @@
+"""
+Request-scoped parsing of search messages for testAPI.
+QueryParser is built once from ApiSettings into frozensets and dicts that are never written after
+construction, and parse() returns a new ParsedQuery per request instead of writing settings, so
+one parser can be shared by threads (and pickled to worker processes).
+Words come from embeddings.normalize_query (one precompiled regex), the same normalization the
+query embedding cache uses.
+"""
+from dataclasses import dataclass
+
+from embeddings import normalize_query
+
+
+@dataclass(frozen=True)
+class ParsedQuery:
+    terms: str      # search terms: the normalized message without stop, language and count words
+    language: str   # a LANGUAGE_CODES key
+    year_data: tuple    # (target year, year weight) from YEAR_FILTER_WORDS
+    num_books: int  # books to return
+
+
+@dataclass(frozen=True)
+class QueryParser:
+    stop_words: frozenset
+    language_codes: dict
+    year_filters: dict
+    default_year: tuple
+    num_results_words: frozenset
+    default_num_books: int
+    min_books: int = 3
+    max_books: int = 30
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            stop_words=frozenset(settings.STOP_WORDS),
+            language_codes=dict(settings.LANGUAGE_CODES),
+            year_filters={word: data for word, data in settings.YEAR_FILTER_WORDS.items() if word != -1},
+            default_year=settings.YEAR_FILTER_WORDS[-1],
+            num_results_words=frozenset(settings.NUM_RESULTS_WORDS),
+            default_num_books=settings.num_books,
+        )
+
+    def parse(self, message):
+        language = 'english'
+        year_data = self.default_year
+        num_books = self.default_num_books
+        skip_indices = set()
+
+        words = normalize_query(message).split()
+
+        for i, word in enumerate(words):
+            if word in self.language_codes:
+                language = word
+                skip_indices.add(i)  # Don't include in search terms
+
+            if word in self.year_filters:
+                year_data = self.year_filters[word]
+
+            elif word in self.num_results_words:
+                # Check neighboring number ("5 results", "show 20")
+                if i > 0 and words[i - 1].isdecimal():
+                    num_books = int(words[i - 1])
+                    skip_indices.update({i, i - 1})
+                elif i < len(words) - 1 and words[i + 1].isdecimal():
+                    num_books = int(words[i + 1])
+                    skip_indices.update({i, i + 1})
+                num_books = min(max(num_books, self.min_books), self.max_books)
+
+        terms = ' '.join(
+            word for i, word in enumerate(words)
+            if i not in skip_indices and word not in self.stop_words
+        )
+        return ParsedQuery(terms, language, year_data, num_books)
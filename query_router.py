@@ -0,0 +1,82 @@
+"""
+Routing of chat messages between the local retrieval + ranking path (testAPI.recommend_books: no
+LLM call, bound by search latency) and the LLM (aiTest).
+Plain topical or keyword requests ("fantasy books in spanish", "10 classic mysteries") go local.
+Conversational, comparative or vague ones ("something like the hunger games", "what should I read
+after Harry Potter?") and follow-ups to an earlier answer go to the LLM, which can use the context.
+Each message is scored on a few word features; the weights act as log-odds against the local path.
+Like QueryParser, a QueryRouter is immutable after construction and shared by threads.
+"""
+import math
+import time
+from dataclasses import dataclass
+
+from embeddings import normalize_query
+from query_parser import QueryParser
+
+LOCAL = 'local'
+LLM = 'llm'
+
+# Log-odds each feature adds against the local path
+FEATURE_WEIGHTS = {
+    'follow_up': 4.0,   # refers to the conversation so far
+    'no_terms': 4.0,    # nothing left to search for once stop words are dropped
+    'reference': 3.0,   # compares with or follows on from another book
+    'question': 2.0,
+    'vague': 1.5,
+    'personal': 1.0,    # talks about the reader ("I loved", "my son")
+    'long': 0.75,   # per search term beyond max_terms
+}
+
+REFERENCE_WORDS = frozenset(['like', 'similar', 'after', 'than', 'alike', 'reminds', 'same', 'except', 'instead'])
+QUESTION_WORDS = frozenset(['what', 'which', 'who', 'whom', 'why', 'how', 'should', 'could', 'would', 'can',
+                            'is', 'are', 'do', 'does', 'any', 'where', 'when'])
+VAGUE_WORDS = frozenset(['something', 'anything', 'good', 'best', 'great', 'favorite', 'favourite', 'interesting',
+                         'nice', 'cool', 'suggest', 'suggestions', 'ideas', 'mood', 'feel', 'feeling'])
+PERSONAL_WORDS = frozenset(['i', 'im', 'ive', 'id', 'me', 'my', 'mine', 'we', 'our', 'us', 'you', 'your'])
+
+
+@dataclass(frozen=True)
+class RouteDecision:
+    route: str          # LOCAL or LLM
+    confidence: float   # probability of the chosen route under the router's scoring (0.5-1)
+    reasons: tuple      # features that counted against the local path
+    latency_ms: float   # time spent routing
+
+
+@dataclass(frozen=True)
+class QueryRouter:
+    parser: QueryParser
+    threshold: float = 0.6  # min probability of the local path to take it
+    max_terms: int = 5
+    bias: float = 2.0   # log-odds for the local path of a message with no features
+
+    @classmethod
+    def from_settings(cls, settings, parser=None):
+        return cls(parser=parser or QueryParser.from_settings(settings), threshold=settings.router_threshold,
+                   max_terms=settings.router_max_terms)
+
+    def features(self, message, follow_up=False):
+        """{feature: count} of the FEATURE_WEIGHTS features present in message"""
+        words = normalize_query(message).split()
+        terms = self.parser.parse(message).terms.split()
+        found = {
+            'follow_up': int(follow_up),
+            'no_terms': int(not terms),
+            'reference': int(any(word in REFERENCE_WORDS for word in words)),
+            'question': int('?' in message or bool(words) and words[0] in QUESTION_WORDS),
+            'vague': int(any(word in VAGUE_WORDS for word in words)),
+            'personal': int(any(word in PERSONAL_WORDS for word in words)),
+            'long': max(0, len(terms) - self.max_terms),
+        }
+        return {name: count for name, count in found.items() if count}
+
+    def route(self, message, follow_up=False):
+        """RouteDecision for message; follow_up is whether it continues a conversation with earlier answers"""
+        start = time.perf_counter()
+        features = self.features(message, follow_up)
+        log_odds = self.bias - sum(FEATURE_WEIGHTS[name] * count for name, count in features.items())
+        p_local = 1 / (1 + math.exp(-log_odds))
+        route = LOCAL if p_local >= self.threshold else LLM
+        return RouteDecision(route, p_local if route == LOCAL else 1 - p_local, tuple(features),
+                             (time.perf_counter() - start) * 1000)
@@ -0,0 +1,62 @@
+"""
+Vectorized candidate scoring for testAPI.semantic_sort.
+The semantic, popularity and year features of all candidates are packed into NumPy arrays and
+combined in one weighted expression; top_k_indices then selects the best k with argpartition
+instead of sorting every candidate.
+"""
+import numpy as np
+
+
+def parse_year(year):
+    return int(year) if year and str(year).isdigit() else 0
+
+
+def score_books(books, query_embedding, book_embeddings, year_data, pop_weight):
+    """
+    Weighted score per book, same formula as the original per-book loop:
+    (1 - pop_weight - year_weight) * semantic + pop_weight * popularity + year_weight * year closeness
+    """
+    # Semantic match: dot product of each description embedding with the query
+    semantic = np.asarray(book_embeddings) @ np.asarray(query_embedding)
+    return combine_scores(books, semantic, year_data, pop_weight)
+
+
+def combine_scores(books, relevance, year_data, pop_weight):
+    """score_books' formula with any per-book relevance (in [0, 1], like a cosine) as the semantic part"""
+    target_year, year_weight = year_data
+    semantic = np.asarray(relevance, dtype=np.float64)
+
+    # Popularity: log of the rating count times the average rating
+    counts = np.array([book.get('ratings_count', 0) for book in books], dtype=np.float64)
+    averages = np.array([book.get('ratings_average', 0) for book in books], dtype=np.float64)
+    popularity = np.log1p(counts) * averages
+
+    # Year closeness: closer years get higher score, 0 when unknown
+    years = np.array([parse_year(book.get('year')) for book in books], dtype=np.float64)
+    year_score = np.where(years > 0, 6 / (1 + 0.01 * np.abs(years - target_year)), 0.0)
+
+    return (
+        (1 - pop_weight - year_weight) * semantic +
+        pop_weight * popularity +
+        year_weight * year_score
+    )
+
+
+def top_k_indices(scores, k=None):
+    """
+    Indices of the k highest scores, best first. Ties keep their original order, exactly like
+    sorted(..., reverse=True) over all candidates would.
+    """
+    scores = np.asarray(scores)
+    n = len(scores)
+    if k is None or k >= n:
+        candidates = np.arange(n)
+    elif k <= 0:
+        return np.array([], dtype=int)
+    else:
+        # everything scoring at least the k-th best, so ties at the boundary are resolved by position
+        kth_best = scores[np.argpartition(-scores, k - 1)[:k]].min()
+        candidates = np.flatnonzero(scores >= kth_best)
+
+    order = candidates[np.lexsort((candidates, -scores[candidates]))]
+    return order if k is None else order[:k]
@@ -7,19 +7,34 @@ It uses the 'all-MiniLM-L6-v2' model from the Sentence Transformers library to e
 and compares them using cosine similarity.
 """
 
+# Started before the other imports so the timing report covers them
+from startup import Startup, not_ready_response, register_health_routes
+
+startup = Startup('server')
+
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from sentence_transformers import SentenceTransformer, util
-import torch
+
+from apiSettings import ApiSettings
+from embeddings import EmbeddingStore, MicroBatcher, QueryEmbeddingCache, VectorIndex
+from hybrid_search import HybridRetriever, catalog_text, load_catalog
+import logs
+import metrics
+import profiling
+import timing
+
+settings = ApiSettings()
+logs.configure(settings.log_level)
 
 app = Flask(__name__)
 CORS(app)
+register_health_routes(app, startup)
+timing.register(app)
+metrics.register(app)
+profiling.register(app, settings, ('/api/search',))
 
-# Initialize the model
-model = SentenceTransformer('all-MiniLM-L6-v2')
-
-# Sample book data (fake data)
-books = [
+# Sample book data (fake data), used when there is no catalog file
+sample_books = [
     {"title": "Understanding AI", "description": "A comprehensive guide to artificial intelligence and its applications."},
     {"title": "Adventures in Space", "description": "A thrilling journey through the cosmos with astronauts."},
     {"title": "Mystery of the Lost Island", "description": "A gripping tale of adventure and mystery on a deserted island."},
@@ -27,12 +42,59 @@ books = [
     {"title": "The Art of Data Science", "description": "A detailed exploration of data analysis and machine learning techniques."},
 ]
 
-# Encode book descriptions into embeddings
-book_descriptions = [book["description"] for book in books]
-book_embeddings = model.encode(book_descriptions, convert_to_tensor=True)
+# Set by initialize()
+model = None
+books = []
+book_index = None
+query_embeddings = None
+
+
+def warmup():
+    """Dummy encode so the first real query does not pay for lazy torch/tokenizer setup"""
+    query_embeddings.encode("warmup")
+
+
+def initialize():
+    global model, books, book_index, query_embeddings
+
+    with startup.phase('import'):
+        from sentence_transformers import SentenceTransformer
+
+    with startup.phase('model_load'):
+        model = SentenceTransformer('all-MiniLM-L6-v2')
+
+    with startup.phase('catalog_encode'):
+        # Only books not in the embedding store are encoded
+        books = load_catalog(settings.catalog_path) or sample_books
+        embedding_store = EmbeddingStore(settings.embedding_dir, 'all-MiniLM-L6-v2', quantize=settings.embedding_quantize)
+        book_embeddings = embedding_store.embed(model, [(book.get('key'), book["description"]) for book in books])
+        if settings.hybrid_search:
+            # BM25 over title, subjects and description next to the embeddings, fused by rank
+            book_index = HybridRetriever([catalog_text(book) for book in books], book_embeddings,
+                                         approximate=settings.search_approximate,
+                                         depth=settings.hybrid_depth, rrf_k=settings.rrf_k)
+        else:
+            book_index = VectorIndex(book_embeddings, approximate=settings.search_approximate)
+
+    # Concurrent requests share batched forward passes for their query embeddings
+    query_encoder = model
+    if settings.embedding_batching:
+        query_encoder = MicroBatcher(model, settings.embedding_max_batch, settings.embedding_max_wait_ms,
+                                     settings.embedding_batch_timeout)
+    query_embeddings = QueryEmbeddingCache(query_encoder, maxsize=settings.query_cache_size)
+
+    with startup.phase('warmup'):
+        warmup()
+
+
+startup.mark('module_import')
+startup.start(initialize, lazy=settings.lazy_startup)
 
 @app.route('/api/search', methods=['POST'])
 def search_books():
+    if not startup.wait_ready(settings.ready_timeout):
+        return not_ready_response(startup)
+
     try:
         # Get data from the incoming request
         data = request.get_json()
@@ -40,17 +102,18 @@ def search_books():
         top_k = data.get('top_k', 3)  # Default to top 3 results if top_k not specified
 
         # Encode the query into embedding
-        query_embedding = model.encode(query, convert_to_tensor=True)
-
-        # Compute cosine similarity between the query and book descriptions
-        similarity_scores = util.pytorch_cos_sim(query_embedding, book_embeddings)[0]
+        query_embedding = query_embeddings.encode(query)
 
-        # Get the top-k results based on similarity
-        top_results = torch.topk(similarity_scores, k=min(top_k, len(books)))
+        # Get the top-k books by cosine similarity between the query and book descriptions
+        # (hybrid: fused with their BM25 rank; the scores are then fused RRF scores)
+        if settings.hybrid_search:
+            top_indices, top_scores = book_index.search(query, query_embedding, top_k)
+        else:
+            top_indices, top_scores = book_index.search(query_embedding, top_k)
 
         # Prepare the results to return in JSON format
         results = []
-        for score, idx in zip(top_results.values, top_results.indices):
+        for score, idx in zip(top_scores, top_indices):
             results.append({
                 "title": books[idx]["title"],
                 "description": books[idx]["description"],
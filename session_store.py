@@ -0,0 +1,170 @@
+"""
+Bounded, thread-safe chat session store for backend_response.
+Each session keeps its system message plus at most max_messages recent turns. Sessions are evicted
+least-recently-used when there are too many of them or the total size of their messages exceeds the
+memory budget, and dropped entirely once idle for idle_ttl seconds. An optional backend persists
+sessions (e.g. SQLiteSessionBackend) so they survive restarts; memory then acts as its LRU front.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+SYSTEM_MESSAGE = {"role": "system", "content": "You are an assistant that helps find books."}
+
+
+def message_size(message):
+    return len(message.get('content', '')) + len(message.get('role', ''))
+
+
+class SQLiteSessionBackend:
+    """Persists each session's messages as a JSON row in a local SQLite file"""
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(session_id TEXT PRIMARY KEY, messages TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+
+    def load(self, session_id):
+        """(messages, last_used) or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT messages, last_used FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def save(self, session_id, messages, last_used):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, messages, last_used) VALUES (?, ?, ?)",
+                (session_id, json.dumps(messages), last_used),
+            )
+
+    def delete(self, session_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge_idle(self, older_than):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE last_used < ?", (older_than,))
+
+
+class SessionStore:
+    def __init__(self, max_messages=20, max_sessions=1000, idle_ttl=3600, memory_budget=16 * 1024 * 1024,
+                 backend=None):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.memory_budget = memory_budget
+        self.backend = backend
+        self._sessions = OrderedDict()  # session_id -> {'messages', 'last_used', 'size'}
+        self._size = 0
+        self._lock = threading.RLock()
+        self._last_purge = time.time()
+        self.evictions = 0
+        self.expirations = 0
+
+    def _load(self, session_id, now):
+        entry = self._sessions.get(session_id)
+        if entry is None and self.backend is not None:
+            stored = self.backend.load(session_id)
+            if stored is not None:
+                messages, last_used = stored
+                entry = {'messages': messages, 'last_used': last_used,
+                         'size': sum(message_size(m) for m in messages)}
+                self._sessions[session_id] = entry
+                self._size += entry['size']
+
+        if entry is not None and now - entry['last_used'] > self.idle_ttl:
+            self._drop(session_id, persisted=True)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            entry = {'messages': [dict(SYSTEM_MESSAGE)], 'last_used': now, 'size': message_size(SYSTEM_MESSAGE)}
+            self._sessions[session_id] = entry
+            self._size += entry['size']
+
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def _drop(self, session_id, persisted=False):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._size -= entry['size']
+        if persisted and self.backend is not None:
+            self.backend.delete(session_id)
+
+    def _trim(self, entry):
+        """Keep the system message plus the newest max_messages messages"""
+        messages = entry['messages']
+        has_system = bool(messages) and messages[0].get('role') == 'system'
+        head = messages[:1] if has_system else []
+        body = messages[1:] if has_system else messages
+        if len(body) > self.max_messages:
+            entry['messages'] = head + body[-self.max_messages:]
+            old_size = entry['size']
+            entry['size'] = sum(message_size(m) for m in entry['messages'])
+            self._size += entry['size'] - old_size
+
+    def _evict(self, keep):
+        """Evict least recently used sessions (never keep) until within max_sessions and the memory budget"""
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions and self._size <= self.memory_budget:
+                break
+            if session_id == keep:
+                continue
+            self._drop(session_id)
+            self.evictions += 1
+
+    def get(self, session_id):
+        """Copy of the session's messages, starting with the system message"""
+        with self._lock:
+            return list(self._load(session_id, time.time())['messages'])
+
+    def append(self, session_id, *messages):
+        """Append messages to the session and return a copy of its (capped) history"""
+        now = time.time()
+        with self._lock:
+            entry = self._load(session_id, now)
+            entry['messages'].extend(messages)
+            added = sum(message_size(m) for m in messages)
+            entry['size'] += added
+            self._size += added
+            entry['last_used'] = now
+            self._trim(entry)
+            history = list(entry['messages'])
+            self._evict(keep=session_id)
+            if self.backend is not None:
+                self.backend.save(session_id, history, now)
+        if now - self._last_purge > 60:
+            self._last_purge = now
+            self.purge_idle()
+        return history
+
+    def purge_idle(self):
+        """Drop sessions idle for longer than idle_ttl (memory and backend)"""
+        cutoff = time.time() - self.idle_ttl
+        with self._lock:
+            for session_id in [sid for sid, entry in self._sessions.items() if entry['last_used'] < cutoff]:
+                self._drop(session_id)
+                self.expirations += 1
+            if self.backend is not None:
+                self.backend.purge_idle(cutoff)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'bytes': self._size,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,92 @@
+"""
+Fast cold start for the Flask apps.
+Startup runs an app's heavy initialization (imports, model load, catalog embeddings, warmup) in a
+background thread so the worker can answer /healthz immediately, flips /readyz to 200 once it is
+done, and keeps a per-phase timing report. With lazy=False the same initializer runs inline.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import jsonify
+
+log = logging.getLogger(f'bookquest.{__name__}')
+
+
+class Startup:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.phases = {}    # phase -> seconds, in the order they ran
+        self.ready = threading.Event()
+        self.error = None
+        self._finished = threading.Event()  # set once initialization succeeded or failed
+        self._thread = None
+
+    def mark(self, name):
+        """Record name as the time since startup began"""
+        self.phases[name] = time.perf_counter() - self.started
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+
+    def start(self, initializer, lazy=True):
+        """Run initializer in the background (lazy) or right away"""
+        if lazy:
+            self._thread = threading.Thread(target=self._run, args=(initializer,), name=f'{self.name}-init',
+                                            daemon=True)
+            self._thread.start()
+        else:
+            self._run(initializer)
+
+    def _run(self, initializer):
+        try:
+            initializer()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            log.error("%s failed to start: %s", self.name, self.error)
+            self._finished.set()
+            return
+        self.mark('total')
+        self.ready.set()
+        self._finished.set()
+        log.info("%s ready: %s", self.name, ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items()))
+
+    def wait_ready(self, timeout=None):
+        """Whether initialization finished within timeout; False right away once it has failed"""
+        self._finished.wait(timeout)
+        return self.ready.is_set()
+
+    def report(self):
+        return {
+            'app': self.name,
+            'ready': self.ready.is_set(),
+            'error': self.error,
+            'uptime': round(time.perf_counter() - self.started, 3),
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+        }
+
+
+def register_health_routes(app, startup):
+    """/healthz: the process is up. /readyz: initialization finished (503 until then)."""
+
+    @app.route('/healthz', methods=['GET'])
+    def healthz():
+        return jsonify({'status': 'ok'})
+
+    @app.route('/readyz', methods=['GET'])
+    def readyz():
+        report = startup.report()
+        return jsonify(report), (200 if report['ready'] else 503)
+
+
+def not_ready_response(startup):
+    report = startup.report()
+    message = 'Service failed to start.' if startup.error else 'Service is starting, try again shortly.'
+    return jsonify({'error': message, 'startup': report}), 503
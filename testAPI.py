@@ -7,39 +7,112 @@
  The API then returns a response containing the formatted book information or an error message if no books are found.
  Link Query with API
 """
+# Started before the other imports so the timing report covers them
+from startup import Startup, not_ready_response, register_health_routes
+
+startup = Startup('testAPI')
+
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import requests
 import urllib.parse
+import logging
+import math
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-from sentence_transformers import SentenceTransformer
 import numpy as np
 from numpy.linalg import norm
 
 from apiSettings import ApiSettings
+from cache import MISSING
 import random
-import re
-
-import openai
 
-import aiTest
+from embeddings import EmbeddingStore, MicroBatcher, QueryEmbeddingCache
+from hybrid_search import BM25Index, HybridRetriever, catalog_text, load_catalog
+from scoring import combine_scores, score_books, top_k_indices
+import logs
+import metrics
+import profiling
+import openlibrary
+import timing
+from openlibrary import normalize
+from query_parser import QueryParser
 
 # Load environment variables
 load_dotenv()
-openai.api_key = os.getenv('OPENAI_API_KEY')
 
 settings = ApiSettings()
+logs.configure(settings.log_level)
+log = logging.getLogger(f'bookquest.{__name__}')
+query_parser = QueryParser.from_settings(settings)
+
+# Concurrent description fetches for the shortlist
+description_pool = ThreadPoolExecutor(max_workers=settings.enrich_workers, thread_name_prefix='descriptions')
 
 app = Flask(__name__)
 CORS(app)
+register_health_routes(app, startup)
+timing.register(app)
+metrics.register(app)
+profiling.register(app, settings, ('/chat',))
+
+# Set by initialize()
+model = None
+embedding_store = None
+query_embeddings = None
+catalog = []
+catalog_retriever = None
+
+
+def warmup():
+    """Dummy encode so the first real query does not pay for lazy torch/tokenizer setup"""
+    query_embeddings.encode("warmup")
+
+
+def initialize():
+    global model, embedding_store, query_embeddings, catalog, catalog_retriever
+
+    with startup.phase('import'):
+        from sentence_transformers import SentenceTransformer
+
+    with startup.phase('model_load'):
+        model = SentenceTransformer('all-MiniLM-L6-v2')
+
+    with startup.phase('catalog_load'):
+        # Memory-maps the description embeddings cached by earlier runs
+        embedding_store = EmbeddingStore(settings.embedding_dir, 'all-MiniLM-L6-v2', quantize=settings.embedding_quantize)
 
-# One-time model init
-model = SentenceTransformer('all-MiniLM-L6-v2')
+    with startup.phase('catalog_index'):
+        # Local candidates next to the Open Library search; description embeddings are shared with semantic_sort
+        catalog = load_catalog(settings.catalog_path) if settings.hybrid_search else []
+        if catalog:
+            vectors = embedding_store.embed(model, [(book.get('key'), book['description']) for book in catalog])
+            catalog_retriever = HybridRetriever([catalog_text(book) for book in catalog], vectors,
+                                                approximate=settings.search_approximate,
+                                                depth=settings.hybrid_depth, rrf_k=settings.rrf_k)
+
+    # Concurrent requests share batched forward passes for their query embeddings
+    query_encoder = model
+    if settings.embedding_batching:
+        query_encoder = MicroBatcher(model, settings.embedding_max_batch, settings.embedding_max_wait_ms,
+                                     settings.embedding_batch_timeout)
+    query_embeddings = QueryEmbeddingCache(query_encoder, maxsize=settings.query_cache_size)
+    metrics.watch_cache('query_embedding', query_embeddings)
+
+    with startup.phase('warmup'):
+        warmup()
+
+
+startup.mark('module_import')
+startup.start(initialize, lazy=settings.lazy_startup)
 
 
 def create_response(user_msg, max_tokens=200, temperature=0.7):
+    import openai   # only needed on this path, kept out of startup
+    openai.api_key = os.getenv('OPENAI_API_KEY')
+
     response = openai.chat.completions.create(
         model="gpt-4.1",
         messages=[
@@ -55,39 +128,8 @@ def create_response(user_msg, max_tokens=200, temperature=0.7):
 
 
 def parse_query(message):
-    language = 'english'
-    search_terms = []
-    skip_indices = set()
-    year_data = settings.YEAR_FILTER_WORDS[-1]
-
-    message = re.sub(r'[^\w\s]', '', message).lower()
-    words = message.split()
-
-    for i, word in enumerate(words):
-        if word in settings.LANGUAGE_CODES:
-            language = word
-            skip_indices.add(i)  # Don't include in search_terms
-
-        if word in settings.YEAR_FILTER_WORDS:
-            year_data = settings.YEAR_FILTER_WORDS[word]
-
-        elif word in settings.NUM_RESULTS_WORDS:
-            # Check neighboring digit
-            if (i > 0 and words[i - 1].isdigit()):
-                settings.num_books = int(words[i - 1])
-                skip_indices.update({i, i - 1})
-            elif (i < len(words) - 1 and words[i + 1].isdigit()):
-                settings.num_books = int(words[i + 1])
-                skip_indices.update({i, i + 1})
-            settings.num_books = min(max(settings.num_books, 3), 30)
-
-    search_terms = [
-        word for i, word in enumerate(words)
-        if i not in skip_indices and word not in settings.STOP_WORDS
-    ]
-
-    clean_query = ' '.join(search_terms)
-    return clean_query, language, year_data
+    """ParsedQuery (terms, language, year_data, num_books) for one request"""
+    return query_parser.parse(message)
 
 
 def is_popular(book):
@@ -104,49 +146,49 @@ def cosine_similarity(a, b):
     return np.dot(a, b) / (norm(a) * norm(b))
 
 
-def semantic_sort(books, message, year_data):
-    if not books or not message:
-        return books
-
-    target_year, year_weight = year_data
-    book_texts = [b.get('description') or b['title'] for b in books]
+def metadata_text(book):
+    """Ranking text available straight from the search response: title, author and subjects"""
+    text = f"{book['title']}. By {book['author']}."
+    if book.get('subjects'):
+        text += f" Subjects: {', '.join(book['subjects'])}."
+    return text
 
-    # Generate embeddings
-    query_embedding = model.encode(message, convert_to_tensor=False)
-    book_embeddings = model.encode(book_texts, convert_to_tensor=False)
 
-    scores = []
-    for i, book in enumerate(books):
-        # Semantic match (50%)
-        semantic_score = np.dot(query_embedding, book_embeddings[i])
+def metadata_sort(books, query, top_k=None):
+    """
+    Books ordered by semantic_sort's weighted score with BM25 over metadata_text (scaled to [0, 1])
+    as the semantic part; only the best top_k if given. No model forward pass, so it can rank every
+    search result before anything is fetched for them.
+    """
+    if not books:
+        return books
 
-        # Popularity (weighted)
-        popularity = np.log1p(book.get('ratings_count', 0)) * book.get('ratings_average', 0)
-        pop_weight = settings.popularity_weight
+    relevance = np.zeros(len(books))
+    indices, scores = BM25Index([metadata_text(b) for b in books]).search(query.terms, len(books))
+    if len(scores):
+        relevance[indices] = scores / scores[0]
+    scores = combine_scores(books, relevance, query.year_data, settings.popularity_weight)
+    return [books[i] for i in top_k_indices(scores, top_k)]
 
-        # Year closeness (weighted)
-        book_year = int(book.get('year')) if book.get('year') and str(book.get('year')).isdigit() else None
-        if book_year:
-            year_score = 6 / (1 + 0.01 * abs(book_year - target_year))  # closer years get higher score
-        else:
-            year_score = 0  # no info
 
-        total_score = (
-            (1 - pop_weight - year_weight) * semantic_score +
-            pop_weight * popularity +
-            year_weight * year_score
-        )
+def semantic_sort(books, message, year_data, top_k=None):
+    """
+    Books ordered by weighted semantic/popularity/year score; only the best top_k if given.
+    The semantic part compares the query with each description.
+    """
+    if not books or not message:
+        return books
 
-        scores.append(total_score)
+    items = [(b.get('key'), b.get('description') or b['title']) for b in books]
 
-    # Sort by score
-    sorted_books = [book for _, book in sorted(
-        zip(scores, books),
-        key=lambda x: x[0],
-        reverse=True
-    )]
+    # Generate embeddings (texts seen before come from the embedding store)
+    with timing.stage('embedding'):
+        query_embedding = query_embeddings.encode(message)
+        book_embeddings = embedding_store.embed(model, items)
 
-    return sorted_books
+    with timing.stage('scoring'):
+        scores = score_books(books, query_embedding, book_embeddings, year_data, settings.popularity_weight)
+        return [books[i] for i in top_k_indices(scores, top_k)]
 
 
 def format_book_data(doc):
@@ -165,71 +207,81 @@ def format_book_data(doc):
     }
 
 
-def fetch_open_library_books(message):
-    print(f"Processing message: {message}")
-    topics, language, year_data = parse_query(message)
-    print(f"Searching for books with terms: {topics}")
-
-    print(f"Filtering for {language} language books")
-
-    try:
-        encoded_message = urllib.parse.quote(topics)
-        language_code = settings.LANGUAGE_CODES.get(language, 'eng')
-        url = (
-            f"https://openlibrary.org/search.json?q={urllib.parse.quote(topics)}"
-            f"&sort=rating"
-            f"&limit={settings.initial_fetch_limit}"
-            f"&language={language_code}"
-            f"&fields=title,author_name,first_publish_year,number_of_pages_median,"
-            f"subject,ratings_average,ratings_count,cover_i,key"
-        )
-
-        response = requests.get(url)
-        books = []
-
-        if response.status_code == 200:
-            data = response.json()
-            total_found = data.get('numFound', 0)
-            print(f"Found {total_found} total books in response")
-
-            for doc in data.get('docs', []):
-                if not doc.get('title'):
-                    continue
-
-                work_key = doc.get('key', '')
-                description = fetch_book_description(work_key) if work_key else ''
-
-                if not description:
-                    description = generate_description(doc)
-
-                book = format_book_data(doc)
-                book['description'] = description
-                # Provide a preview/search link
-                book['previewLink'] = f"<a href='https://kcls.bibliocommons.com/v2/search?query={urllib.parse.quote(doc.get('title',''))}&searchType=smart' target='_blank'>Search in KCLS</a>"
-
-                books.append(book)
-
-            print(f"Processing complete. Found {len(books)} valid books")
-            return books, topics, language, year_data
+def dedupe_docs(docs):
+    """Docs with a title, keeping the first of each work key and of each (title, first author) pair,
+    so other editions of the same book are dropped before anything is fetched for them"""
+    seen = set()
+    unique = []
+    for doc in docs:
+        if not doc.get('title'):
+            continue
+        identities = {(normalize(doc['title']), normalize((doc.get('author_name') or [''])[0]))}
+        if doc.get('key'):
+            identities.add(doc['key'])
+        if identities & seen:
+            continue
+        seen |= identities
+        unique.append(doc)
+    return unique
+
+
+def fetch_descriptions(books, budget=None):
+    """Replace each book's description with its Open Library one: cached ones for every book, and at most
+    budget (all if None) downloaded concurrently, for the first books without one cached. The others,
+    and books without a description (or whose fetch fails), keep the one generated from their metadata."""
+    load = timing.bind(openlibrary.load_description)
+    futures = []
+    for book in books:
+        cached = openlibrary.description_cache.get(book['key']) if book.get('key') else ''
+        if cached is not MISSING:
+            futures.append(cached)
+        elif budget is None or budget > 0:
+            futures.append(description_pool.submit(load, book['key'], timeout=settings.enrich_stage_timeout))
+            budget = None if budget is None else budget - 1
         else:
-            print(f"API request failed with status code: {response.status_code}")
-            return [], topics, language, year_data
+            futures.append('')
+    for book, future in zip(books, futures):
+        try:
+            description = future if isinstance(future, str) else future.result()
+        except Exception:
+            description = ''
+        if description:
+            book['description'] = description
+    return books
 
-    except requests.RequestException as e:
-        print(f"Error fetching books: {e}")
-        return [], topics, language, year_data
 
+def fetch_open_library_books(message):
+    query = parse_query(message)
+    topics, language = query.terms, query.language
+    log.debug("search terms=%r language=%s num_books=%d", topics, language, query.num_books)
 
-def fetch_book_description(work_key):
     try:
-        open_library_url = f"https://openlibrary.org{work_key}.json"
-        response = requests.get(open_library_url)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get('description', {}).get('value', '') if isinstance(data.get('description'), dict) else data.get('description', '')
-        return ''
-    except:
-        return ''
+        params = {
+            'q': topics,
+            'sort': 'rating',
+            'limit': settings.initial_fetch_limit,
+            'language': settings.LANGUAGE_CODES.get(language, 'eng'),
+            'fields': "title,author_name,first_publish_year,number_of_pages_median,"
+                      "subject,ratings_average,ratings_count,cover_i,key",
+        }
+        # Live search.json, or the local dump mirror (settings.openlibrary_source)
+        data = openlibrary.search(params)
+    except (requests.RequestException, ValueError) as e:
+        log.warning("Open Library search failed terms=%r error=%s", topics, e)
+        return [], query
+
+    books = []
+    for doc in dedupe_docs(data.get('docs', [])):
+        book = format_book_data(doc)
+        # Until the shortlist gets its Open Library descriptions (fetch_descriptions)
+        book['description'] = generate_description(doc)
+        # Provide a preview/search link
+        book['previewLink'] = f"<a href='https://kcls.bibliocommons.com/v2/search?query={urllib.parse.quote(doc.get('title',''))}&searchType=smart' target='_blank'>Search in KCLS</a>"
+
+        books.append(book)
+
+    log.debug("search found=%s unique=%d", data.get('numFound', 0), len(books))
+    return books, query
 
 
 def generate_description(doc):
@@ -306,23 +358,65 @@ def format_books_info(books):
     return book_info
 
 
+def catalog_candidates(message, query):
+    """Up to settings.hybrid_candidates catalog books for the query (BM25 and embedding rankings, fused),
+    in the query's language. They come with their descriptions, so nothing is fetched for them."""
+    if catalog_retriever is None:
+        return []
+
+    indices, _ = catalog_retriever.search(query.terms, query_embeddings.encode(message), settings.hybrid_candidates)
+    language_code = settings.LANGUAGE_CODES.get(query.language, 'eng')
+    books = []
+    for i in indices:
+        doc = catalog[i]
+        if doc.get('language') and language_code not in doc['language']:
+            continue
+        book = format_book_data(doc)
+        book['description'] = doc['description']
+        books.append(book)
+    return books
+
+
+def recommend_books(message):
+    """The best query.num_books books for message, with descriptions and links, and the ParsedQuery"""
+    with timing.stage('search'):
+        books, query = fetch_open_library_books(message)
+
+    # Local catalog candidates, including books Open Library's keyword search misses
+    with timing.stage('catalog'):
+        local_books = catalog_candidates(message, query)
+    local_keys = {book['key'] for book in local_books}
+    books = [book for book in books if book['key'] not in local_keys]
+
+    # Phase one: rank the Open Library candidates on their search metadata (BM25, no model) and keep a shortlist
+    shortlist_size = math.ceil(query.num_books * settings.shortlist_factor)
+    with timing.stage('rank'):
+        shortlist = metadata_sort(books, query, top_k=shortlist_size)
+
+    # Phase two: descriptions for the shortlist (at most description_fetch_budget downloads, fetched
+    # concurrently, best first), then the final ranking together with the catalog candidates
+    with timing.stage('descriptions'):
+        fetch_descriptions(shortlist, budget=settings.description_fetch_budget)
+    with timing.stage('rank'):
+        top_books = semantic_sort(shortlist + local_books, message, query.year_data, top_k=query.num_books)
+
+    for book in top_books:
+        book['previewLink'] = generate_link(book, query.language)
+    return top_books, query
+
+
 @app.route('/chat', methods=['POST'])
 def chat():
+    if not startup.wait_ready(settings.ready_timeout):
+        return not_ready_response(startup)
+
     data = request.get_json()
     message = data.get('message', '')
 
-    books, topics, language, year_data = fetch_open_library_books(message)
-
-    # Sort semantically and pick top results
-    books = semantic_sort(books, message, year_data)
-    top_books = books[:settings.num_books]
-
-    for book in top_books:
-        if book.get('key'):
-            book['description'] = fetch_book_description(book['key']) or generate_description(book)
-        book['previewLink'] = generate_link(book, language)
+    top_books, query = recommend_books(message)
 
-    response_message = format_message(top_books, topics, language) + f"<br>{format_books_info(top_books)}"
+    with timing.stage('render'):
+        response_message = format_message(top_books, query.terms, query.language) + f"<br>{format_books_info(top_books)}"
     return jsonify({"message": response_message})
 
 
@@ -0,0 +1,126 @@
+"""
+Per-request context: a request ID and stage timing.
+Every request gets an ID (the caller's X-Request-ID, or a new one), echoed in the X-Request-ID
+response header and attached to every log line written while it runs (logs.py). Its stages are
+reported in the Server-Timing response header ("search;dur=212.4, rank;dur=35.0") and every stage
+is also observed in the bookquest_stage_seconds histogram, including ones timed outside a request.
+The request's stages live in a dict held in a ContextVar: each Flask request thread and each Quart
+request task gets its own, and asyncio.to_thread carries it along; work handed to pool threads
+carries it with bind(). Stages of concurrent work (one KCLS lookup per book) add up.
+"""
+import contextvars
+import logging
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+import metrics
+
+log = logging.getLogger('bookquest.requests')
+
+_stages = ContextVar('stages', default=None)
+_request_id = ContextVar('request_id', default='-')
+_started = ContextVar('started', default=None)
+
+# Context managers entered around every bind()-ed call, in the thread running it (profiling.attached)
+bound_call_hooks = []
+
+
+def start_request(request_id=None):
+    _stages.set({})
+    _request_id.set((request_id or uuid.uuid4().hex[:16])[:64])
+    _started.set(time.perf_counter())
+
+
+def current():
+    """The stage dict of the current request (None outside one), to record into from other threads"""
+    return _stages.get()
+
+
+def request_id():
+    return _request_id.get()
+
+
+def bind(fn):
+    """fn, run in a copy of the current context (request ID and stages), for submitting to another thread"""
+    context = contextvars.copy_context()
+
+    def call(*args, **kwargs):
+        with ExitStack() as stack:
+            for hook in bound_call_hooks:
+                stack.enter_context(hook())
+            return fn(*args, **kwargs)
+
+    return lambda *args, **kwargs: context.copy().run(call, *args, **kwargs)
+
+
+def record(name, seconds, stages=None):
+    """Add seconds to a stage of the current request (or of stages)"""
+    metrics.STAGE_SECONDS.observe(seconds, stage=name)
+    stages = _stages.get() if stages is None else stages
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def server_timing(stages):
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items())
+
+
+def parse_server_timing(header):
+    """{stage: milliseconds} from a Server-Timing header"""
+    stages = {}
+    for entry in filter(None, (part.strip() for part in (header or '').split(','))):
+        name, _, params = entry.partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur':
+                stages[name.strip()] = float(value)
+    return stages
+
+
+def finish_request(request, response):
+    """Add the X-Request-ID and Server-Timing headers, observe the request time and log the request"""
+    stages = _stages.get() or {}
+    response.headers['X-Request-ID'] = _request_id.get()
+    if stages:
+        response.headers['Server-Timing'] = server_timing(stages)
+    started = _started.get()
+    elapsed = time.perf_counter() - started if started is not None else 0.0
+    path = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUEST_SECONDS.observe(elapsed, path=path, status=response.status_code)
+    if log.isEnabledFor(logging.INFO):
+        log.info("method=%s path=%s status=%s duration_ms=%.1f stages=%s", request.method, request.path,
+                 response.status_code, elapsed * 1000,
+                 ','.join(f"{name}:{seconds * 1000:.1f}" for name, seconds in stages.items()) or '-')
+    return response
+
+
+def register(app):
+    """Give the requests of a Flask or Quart app an ID and stage timing (both hooks run in the request's context)"""
+    if hasattr(app, 'before_serving'):
+        # Quart runs sync hooks in a worker thread, whose context does not reach the request task
+        from quart import request
+
+        async def start_async():
+            start_request(request.headers.get('X-Request-ID'))
+
+        async def finish_async(response):
+            return finish_request(request, response)
+
+        app.before_request(start_async)
+        app.after_request(finish_async)
+    else:
+        from flask import request
+
+        app.before_request(lambda: start_request(request.headers.get('X-Request-ID')))
+        app.after_request(lambda response: finish_request(request, response))